@@ -0,0 +1,49 @@
+'''Compare the per value and vectorized timestamp conversions
+
+    Run from the top of the repository with
+    python -m benchmarks.bench_datetimeify'''
+
+import time
+
+import numpy as np
+import pandas as pd
+
+from pyEnFace.EnphaseInterface import DateTimeType
+
+ROWS = 288 * 90 #90 days of 5 minute intervals
+START = 1420070400
+
+def perValue(dtt, key, series):
+    return series.apply(lambda x:dtt.datetimeify(key,x))
+
+def timeit(f, *args):
+    start = time.perf_counter()
+    output = f(*args)
+    return output, time.perf_counter() - start
+
+def check(name, dtt, key, series, same):
+    old,told = timeit(perValue, dtt, key, series)
+    new,tnew = timeit(dtt.datetimeifySeries, key, series)
+    if not same(old, new):
+        raise AssertionError('%s conversions differ' % name)
+    print('%-16s %8d rows  per value %8.3fs  vectorized %8.4fs  %6.1fx' %
+        (name, len(series), told, tnew, told/tnew))
+
+def main():
+    epochs = pd.Series(np.arange(START, START + ROWS*300, 300))
+    dates = pd.Series(pd.date_range('2015-01-01', periods=ROWS//288,
+        freq='D').strftime('%Y-%m-%d'))
+    isos = pd.Series(pd.to_datetime(epochs, unit='s', utc=True).dt.tz_convert(
+        'America/Denver').map(lambda x:x.isoformat()))
+
+    naive = lambda old,new:(pd.to_datetime(old) == new).all()
+    instant = lambda old,new:(pd.to_datetime(old, utc=True) ==
+        new.dt.tz_convert('UTC')).all()
+
+    check('enphase end_at', DateTimeType.Enphase, 'end_at', epochs, naive)
+    check('enphase _date', DateTimeType.Enphase, 'summary_date', dates, naive)
+    check('epoch end_at', DateTimeType.Epoch, 'end_at', epochs, naive)
+    check('iso8601 end_at', DateTimeType.Iso8601, 'end_at', isos, instant)
+
+if __name__ == '__main__':
+    main()
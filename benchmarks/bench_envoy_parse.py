@@ -0,0 +1,83 @@
+'''Compare the CPU time of parsing a poll's worth of recorded Envoy pages
+    the way EnvoyInterface used to and the way it does now
+
+    A poll reads the home page for stats() and again for envoys().  The
+    old parsers decoded every page to a str and searched a full tree with
+    uncompiled paths each time, now the bytes are parsed once per poll
+    and searched with compiled XPath.
+
+    Run from the top of the repository with
+    python -m benchmarks.bench_envoy_parse'''
+
+import os
+import time
+
+from lxml import etree as et
+
+from pyEnFace.EnvoyInterface import (parseEnergy, parsePage, parseHome,
+    parseProduction)
+
+POLLS = 2000
+PAGES = os.path.join(os.path.dirname(__file__), 'pages')
+
+def oldHome(body):
+    data = {}
+    root = et.HTML(body.decode(encoding='UTF-8'))
+    serial = root.xpath('.//td[contains(text(),"Envoy Serial Number")]')
+    key,value = serial[0].text.split(':',1)
+    data[key] = value.strip()
+    table = root.findall('.//table[@style]')[1]
+    for div in table.findall('.//div[@class]'):
+        if div.text is not None:
+            if div.text.strip() == 'Connection to Web':
+                if div.attrib['class'] == 'good':
+                    data['status'] = 'normal'
+    if 'status' not in data:
+        data['status'] = 'comm'
+    for k,v in table.find('.//table').findall('.//tr'):
+        if v.text is None:
+            data[k.text] = v[0].text.strip()
+        else:
+            data[k.text] = v.text.strip()
+    return parseEnergy(data)
+
+def oldProduction(body):
+    root = et.HTML(body.decode(encoding='UTF-8'))
+    data = {}
+    for row in root.find('.//div[@style]/table').findall('./tr'):
+        if len(row) > 1:
+            key,value = row
+            data[key.text] = value.text.strip()
+        else:
+            data['start_date'] = row.find(
+                './/div[@class="good"]').text.strip()
+    return parseEnergy(data)
+
+def oldPoll(home, production):
+    return oldHome(home), oldHome(home), oldProduction(production)
+
+def newPoll(home, production):
+    data = parseHome(parsePage(home))
+    return data, dict(data), parseProduction(parsePage(production))
+
+def timeit(f, *args):
+    start = time.process_time()
+    for i in range(POLLS):
+        output = f(*args)
+    return output, (time.process_time() - start) / POLLS
+
+def main():
+    with open(os.path.join(PAGES, 'envoy_home.html'), 'rb') as f:
+        home = f.read()
+    with open(os.path.join(PAGES, 'envoy_production.html'), 'rb') as f:
+        production = f.read()
+
+    old,told = timeit(oldPoll, home, production)
+    new,tnew = timeit(newPoll, home, production)
+    if old != new:
+        raise AssertionError('parsed fields differ')
+    print('%d polls  old %8.1fus/poll  new %8.1fus/poll  %5.2fx' %
+        (POLLS, told*1e6, tnew*1e6, told/tnew))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+'''Measure the hot paths of the interfaces against a local stub server
+
+    Every scenario makes its calls one after another and reports the
+    calls per second, latency percentiles and, from a second run under
+    tracemalloc, the peak memory allocated.  The stub replays v2 payloads
+    for --systems systems over --days days, the last scenario has it
+    answer every --error-every'th request with a 409, 422 or 503 so the
+    error handling is measured too.  No network access is needed.
+
+    Run from the top of the repository with
+    python -m benchmarks.bench_suite [--systems N] [--days N] [--only NAME]'''
+
+import datetime as dt
+import argparse
+import functools
+import tracemalloc
+import time
+import json
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+from pyEnFace import EnphaseInterface as ei
+from pyEnFace.EnphaseInterface import (RawEnphaseInterface,
+    PandasEnphaseInterface, CachingEnphaseInterface, EnphaseErrorHandler,
+    DateTimeType)
+from pyEnFace.EnvoyInterface import EnvoyInterface
+from pyEnFace.ConnectionPool import ConnectionPool
+from pyEnFace.Retry import RetryEngine
+
+from .stub import StubServer
+
+USER_ID = '4d6a51330a'
+START = dt.datetime(2016, 1, 1)
+KEYS = 64
+#calls of each scenario repeated under tracemalloc
+MEMORY_CALLS = 20
+
+def registerKeys():
+    '''Keys without limits, so only the errors of the stub slow requests'''
+
+    ei.APIKEYRING.clear()
+    for i in range(KEYS):
+        ei.APIKEYRING.append('bench%02d' % i, per_minute=10**9,
+            per_month=10**9)
+
+def handler():
+    #retry at once rather than back off for seconds
+    retry = RetryEngine(base_delay=0.001, max_delay=0.01, budget=10**9,
+        failure_threshold=10**9)
+    return EnphaseErrorHandler(DateTimeType.Enphase, 60, retry=retry)
+
+def engine():
+    return create_engine('sqlite://', poolclass=StaticPool,
+        connect_args={'check_same_thread':False})
+
+def days(args):
+    return [START + dt.timedelta(days=i) for i in range(args.days)]
+
+def statsCalls(interface, args):
+    return [functools.partial(interface.stats, s, start_at=d,
+        end_at=d + dt.timedelta(days=1))
+        for s in range(1, args.systems + 1) for d in days(args)]
+
+def raw(server):
+    interface = RawEnphaseInterface(USER_ID, errorhandler=handler(),
+        pool=ConnectionPool(), cache=None)
+    interface.apiDest = server.api
+    return interface
+
+def pandas(server):
+    interface = PandasEnphaseInterface(USER_ID, errorhandler=handler(),
+        pool=ConnectionPool(), cache=None)
+    interface.apiDest = server.api
+    return interface
+
+def caching(server, args, warm=False):
+    interface = CachingEnphaseInterface(USER_ID, 60, engine=engine(),
+        pool=ConnectionPool(), workers=1)
+    interface.handler.retry = handler().retry
+    interface.apiDest = server.api
+    calls = statsCalls(interface, args)
+    if warm:
+        for call in calls:
+            call()
+    return interface, calls
+
+def summaryRaw(server, args):
+    interface = raw(server)
+    return [functools.partial(interface.summary, s)
+        for s in range(1, args.systems + 1)]
+
+def statsRaw(server, args):
+    return statsCalls(raw(server), args)
+
+def statsPandas(server, args):
+    return statsCalls(pandas(server), args)
+
+def statsNormalize(server, args):
+    '''json_normalize and _datetimeify of decoded stats, no transport'''
+
+    interface = pandas(server)
+    bodies = [json.loads(x().decode('UTF-8'))
+        for x in statsCalls(raw(server), args)]
+    return [functools.partial(interface._toFrame, 'stats', x) for x in bodies]
+
+def statsDatetimeify(server, args):
+    interface = pandas(server)
+    frames = [x().reset_index() for x in statsCalls(interface, args)]
+    for x in frames:
+        x['end_at'] = ei.toEpoch(x['end_at'])
+    return [lambda x=x:interface._datetimeify(x.copy()) for x in frames]
+
+def cacheMiss(server, args):
+    return caching(server, args)[1]
+
+def cacheHit(server, args):
+    return caching(server, args, warm=True)[1]
+
+def cacheRead(server, args):
+    '''Hits of the backend, the memory tier is emptied before each'''
+
+    interface,calls = caching(server, args, warm=True)
+    def read(call):
+        interface.memory.clear()
+        return call()
+    return [functools.partial(read, x) for x in calls]
+
+def fleetReport(server, args):
+    interface,_ = caching(server, args, warm=True)
+    systems = list(range(1, args.systems + 1))
+    return interface, systems, START + dt.timedelta(days=args.days)
+
+def rollupMonthly(server, args):
+    '''Monthly totals of every system read from the rollups'''
+
+    interface,systems,end = fleetReport(server, args)
+    return [functools.partial(interface.rollup, systems, START, end,
+        freq='monthly')] * args.systems
+
+def resampleMonthly(server, args):
+    '''The same totals resampled from every cached interval'''
+
+    interface,systems,end = fleetReport(server, args)
+    lower,upper = int(START.timestamp()), int(end.timestamp())
+    def report():
+        stats = pd.concat([interface._read('stats', x, lower, upper)
+            for x in systems]).reset_index()
+        return stats.groupby(['system_id', pd.Grouper(key='end_at',
+            freq='MS')]).agg(enwh=('enwh','sum'), powr=('powr','max'))
+    return [report] * args.systems
+
+def envoyHome(server, args):
+    envoy = EnvoyInterface(server.host, pool=ConnectionPool())
+    def poll():
+        envoy.clearPages()
+        return envoy._parseHome()
+    return [poll] * (args.systems * args.days)
+
+def statsErrors(server, args):
+    return statsCalls(raw(server), args)
+
+SCENARIOS = [
+    ('summary raw', summaryRaw, False),
+    ('stats raw', statsRaw, False),
+    ('stats pandas', statsPandas, False),
+    ('stats normalize', statsNormalize, False),
+    ('stats datetimeify', statsDatetimeify, False),
+    ('stats cache miss', cacheMiss, False),
+    ('stats cache read', cacheRead, False),
+    ('stats cache hit', cacheHit, False),
+    ('rollup monthly', rollupMonthly, False),
+    ('resample monthly', resampleMonthly, False),
+    ('envoy home', envoyHome, False),
+    ('stats with errors', statsErrors, True),
+]
+
+def measure(calls):
+    latencies = np.empty(len(calls))
+    start = time.perf_counter()
+    for i,call in enumerate(calls):
+        t = time.perf_counter()
+        call()
+        latencies[i] = time.perf_counter() - t
+    return time.perf_counter() - start, latencies
+
+def peakMemory(calls):
+    tracemalloc.start()
+    try:
+        for call in calls:
+            call()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def run(name, setup, args, server):
+    total,latencies = measure(setup(server, args))
+    peak = peakMemory(setup(server, args)[:MEMORY_CALLS])
+    p50,p90,p99 = np.percentile(latencies, [50, 90, 99]) * 1000
+    print('%-18s %6d %10.1f %8.2f %8.2f %8.2f %9.2f' % (name,
+        len(latencies), len(latencies)/total, p50, p90, p99, peak/2**20))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--systems', type=int, default=10)
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--error-every', type=int, default=20)
+    parser.add_argument('--only', help='run the scenarios containing this')
+    args = parser.parse_args()
+
+    registerKeys()
+    server = StubServer(args.systems).start()
+    failing = StubServer(args.systems, args.error_every).start()
+
+    print('%-18s %6s %10s %8s %8s %8s %9s' % ('scenario', 'calls',
+        'calls/s', 'p50 ms', 'p90 ms', 'p99 ms', 'peak MiB'))
+    try:
+        for name,setup,errors in SCENARIOS:
+            if args.only is None or args.only in name:
+                run(name, setup, args, failing if errors else server)
+    finally:
+        server.stop()
+        failing.stop()
+
+    if args.only is None or args.only in 'stats with errors':
+        print('error stub answered %s' % dict(failing.statuses))
+
+if __name__ == '__main__':
+    main()
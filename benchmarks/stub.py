@@ -0,0 +1,191 @@
+'''A local server replaying Enphase v2 api payloads and Envoy pages so
+    the benchmarks run without network access
+
+    Payloads are generated deterministically for any system and day, a
+    stats day is 288 intervals following a noisy solar curve.  Every
+    error_every'th api request of a kind is answered with that error
+    instead, in the shapes the api uses for 409, 422 and 503.'''
+
+import http.server
+import urllib.parse as p
+import collections
+import functools
+import threading
+import socket
+import random
+import json
+import math
+import time
+import os
+
+PAGES = os.path.join(os.path.dirname(__file__), 'pages')
+
+INTERVAL = 300
+MICROINVERTERS = 24
+
+@functools.lru_cache(maxsize=4096)
+def _stats(system_id, start, end):
+    rng = random.Random(system_id * 1000003 + start)
+    peak = 200 * MICROINVERTERS
+    intervals = []
+    for t in range(start - start % INTERVAL + INTERVAL, end + 1, INTERVAL):
+        hour = (t % 86400) / 3600.0
+        sun = max(0.0, math.sin((hour - 6) / 12 * math.pi))
+        powr = int(peak * sun * rng.uniform(0.7, 1.0))
+        if powr == 0:
+            continue
+        intervals.append({'end_at':t, 'devices_reporting':MICROINVERTERS,
+            'powr':powr, 'enwh':powr // 12})
+    return json.dumps({'system_id':system_id,
+        'total_devices':MICROINVERTERS, 'intervals':intervals}).encode()
+
+def _summary(system_id, now):
+    return json.dumps({'system_id':system_id, 'current_power':3450,
+        'energy_lifetime':38400000 + system_id, 'energy_today':18200,
+        'last_report_at':now - 120, 'modules':MICROINVERTERS,
+        'operational_at':1420070400, 'size_w':6000,
+        'source':'microinverters', 'status':'normal',
+        'summary_date':time.strftime('%Y-%m-%d')}).encode()
+
+def _envoys(system_id, now):
+    return json.dumps({'system_id':system_id, 'envoys':[{'envoy_id':
+        system_id, 'last_report_at':now - 120, 'name':'Envoy %d' % system_id,
+        'part_number':'800-00069-r05', 'serial_number':'1215%08d' % system_id,
+        'status':'normal'}]}).encode()
+
+def _inventory(system_id):
+    return json.dumps({'system_id':system_id, 'inverters':[{'model':'M215',
+        'sn':'%06d%06d' % (system_id, i)} for i in range(MICROINVERTERS)]
+        }).encode()
+
+def _index(systems):
+    return json.dumps({'systems':[{'system_id':i, 'system_name':'System %d'
+        % i, 'system_public_name':'Residential System', 'status':'normal',
+        'timezone':'America/Denver', 'country':'US', 'state':'CO',
+        'city':'Denver', 'postal_code':'80202', 'connection_type':'ethernet',
+        'meta':{'status':'normal', 'last_report_at':1451606400,
+        'last_energy_at':1451606400, 'operational_at':1420070400}}
+        for i in range(1, systems + 1)]}).encode()
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    #send the headers and body of a response in one segment
+    wbufsize = 64 * 1024
+
+    def setup(self):
+        super(StubHandler,self).setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, code, body, kind='application/json'):
+        self.send_response(code)
+        self.send_header('Content-Type', kind)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count(code)
+
+    def _error(self, query):
+        '''The error to answer with instead of the payload, if any'''
+
+        server = self.server
+        every = server.error_every
+        if every is None:
+            return None
+
+        n = server.next()
+        now = int(time.time())
+        if n % every == every - 1:
+            return 503, {'reason':'Service Unavailable'}
+        if n % every == every // 2:
+            return 409, {'reason':'Usage limit exceeded for plan watt',
+                'message':['Usage limit exceeded'], 'period':'minute',
+                'period_start':now - 60, 'period_end':now, 'limit':10}
+        if n % every == every // 3 and 'start_at' in query:
+            #answered by retrying from midnight, here the same start
+            start = int(query['start_at'])
+            return 422, {'reason':'Requested start_at is after the last '
+                'interval', 'start_at':start, 'end_at':start,
+                'last_interval':start - INTERVAL}
+        return None
+
+    def do_GET(self):
+        url = p.urlparse(self.path)
+        query = dict(p.parse_qsl(url.query))
+
+        if url.path in ('/home', '/production'):
+            return self._send(200, self.server.pages[url.path[1:]],
+                'text/html')
+
+        parts = url.path.strip('/').split('/')
+        if parts[:3] != ['api','v2','systems']:
+            return self._send(404, b'{}')
+
+        error = self._error(query)
+        if error is not None:
+            return self._send(error[0], json.dumps(error[1]).encode())
+
+        now = int(time.time())
+        system_id = int(parts[3]) if len(parts) > 3 else None
+        command = parts[4] if len(parts) > 4 else ''
+        if command == '':
+            body = _index(self.server.systems)
+        elif command in ('stats','rgm_stats'):
+            start = int(query.get('start_at', 1451606400))
+            end = min(int(query.get('end_at', start + 86400)), start + 86400)
+            body = _stats(system_id, start, end)
+        elif command == 'summary':
+            body = _summary(system_id, now)
+        elif command == 'envoys':
+            body = _envoys(system_id, now)
+        elif command == 'inventory':
+            body = _inventory(system_id)
+        else:
+            return self._send(404, b'{}')
+        self._send(200, body)
+
+class StubServer(http.server.ThreadingHTTPServer):
+    '''Serves the stub api under /api/v2 and the recorded Envoy pages
+        under /home and /production on a free local port'''
+
+    daemon_threads = True
+
+    def __init__(self, systems=100, error_every=None):
+        super(StubServer,self).__init__(('127.0.0.1', 0), StubHandler)
+        self.systems = systems
+        self.error_every = error_every
+        self.statuses = collections.Counter()
+        self._n = 0
+        self._lock = threading.Lock()
+
+        self.pages = {}
+        for k in ('home','production'):
+            with open(os.path.join(PAGES, 'envoy_%s.html' % k), 'rb') as f:
+                self.pages[k] = f.read()
+
+    def next(self):
+        with self._lock:
+            self._n += 1
+            return self._n
+
+    def count(self, code):
+        with self._lock:
+            self.statuses[code] += 1
+
+    @property
+    def host(self):
+        return '127.0.0.1:%d' % self.server_address[1]
+
+    @property
+    def api(self):
+        return 'http://%s/api/v2' % self.host
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
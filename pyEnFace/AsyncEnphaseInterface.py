@@ -0,0 +1,431 @@
+
+import urllib.parse as p
+import urllib.error as e
+import http.client as h
+import collections
+import asyncio
+import logging
+import json
+import time
+import ssl
+import io
+
+from .EnphaseInterface import (RawEnphaseInterface, PandasEnphaseInterface,
+    DateTimeType, DEFAULT_MAX_WAIT, APIKEYRING)
+from .ConnectionPool import DEFAULT_POOL_SIZE, DEFAULT_IDLE_TIMEOUT
+from .HttpCache import DEFAULT_CACHE
+from .Retry import RateLimitError, endpointOf
+from .Metrics import DEFAULT_METRICS, LazyPayload, maskKey
+from .SingleFlight import AsyncSingleFlight, flightKey
+
+DEFAULT_TIMEOUT = 60
+DEFAULT_MAX_CONCURRENCY = 100
+
+class AsyncConnectionPool(object):
+    '''A minimal HTTP/1.1 client over asyncio streams that keeps idle
+        keep-alive connections per host, the asyncio counterpart of
+        ConnectionPool
+
+        A pool belongs to the event loop it is first used on.'''
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE,
+            idle_timeout=DEFAULT_IDLE_TIMEOUT, timeout=DEFAULT_TIMEOUT,
+            context=None):
+
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.context = context
+
+        self._idle = collections.defaultdict(collections.deque)
+
+        self.created = 0
+        self.reused = 0
+
+    def _reap(self, now):
+        for key in list(self._idle.keys()):
+            idle = self._idle[key]
+            while len(idle) > 0 and now - idle[0][2] > self.idle_timeout:
+                _,writer,_ = idle.popleft()
+                writer.close()
+            if len(idle) == 0:
+                del self._idle[key]
+
+    async def _checkout(self, scheme, host, port):
+        self._reap(time.monotonic())
+        idle = self._idle.get((scheme, host, port))
+        while idle:
+            reader,writer,_ = idle.pop()
+            if not reader.at_eof():
+                self.reused += 1
+                return reader, writer, True
+            writer.close()
+
+        self.created += 1
+        logging.debug('Opening new %s connection to %s' % (scheme, host))
+        context = None
+        if scheme == 'https':
+            context = self.context or ssl.create_default_context()
+        reader,writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=context), self.timeout)
+        return reader, writer, False
+
+    def _release(self, scheme, host, port, reader, writer):
+        idle = self._idle[(scheme, host, port)]
+        if len(idle) < self.pool_size:
+            idle.append((reader, writer, time.monotonic()))
+        else:
+            writer.close()
+
+    def close(self):
+        '''Close every idle connection in the pool'''
+
+        for idle in self._idle.values():
+            for _,writer,_ in idle:
+                writer.close()
+        self._idle.clear()
+
+    @staticmethod
+    async def _readBody(reader, method, status, hdrs):
+        if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            return b'', True
+
+        if hdrs.get('Transfer-Encoding','').lower() == 'chunked':
+            chunks = []
+            while True:
+                line = await reader.readuntil(b'\r\n')
+                size = int(line.split(b';',1)[0], 16)
+                if size == 0:
+                    #skip any trailers
+                    while (await reader.readuntil(b'\r\n')) != b'\r\n':
+                        pass
+                    return b''.join(chunks), True
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+
+        if 'Content-Length' in hdrs:
+            return await reader.readexactly(int(hdrs['Content-Length'])), True
+
+        #no framing, the body runs until the server closes the connection
+        return await reader.read(), False
+
+    async def _exchange(self, reader, writer, method, request):
+        writer.write(request)
+        await writer.drain()
+
+        head = await reader.readuntil(b'\r\n\r\n')
+        statusLine,rest = head.split(b'\r\n',1)
+        version,status,reason = (statusLine.decode('iso-8859-1').split(' ',2)
+            + [''])[:3]
+        status = int(status)
+        hdrs = h.parse_headers(io.BytesIO(rest))
+
+        data,reusable = await self._readBody(reader, method, status, hdrs)
+        if hdrs.get('Connection','').lower() == 'close' or \
+                version == 'HTTP/1.0':
+            reusable = False
+        return status, reason, hdrs, data, reusable
+
+    async def request(self, method, url, headers=None):
+        '''Perform a request over a pooled connection
+
+            Returns a tuple of the status, reason, headers and the body.'''
+
+        s,n,pa,pr,q,f = p.urlparse(url)
+        parts = p.urlsplit(url)
+        host = parts.hostname
+        port = parts.port or (443 if s == 'https' else 80)
+        selector = p.urlunparse(('','',pa or '/',pr,q,''))
+
+        headers = dict(headers or {})
+        headers.setdefault('Host', n)
+        headers.setdefault('Connection', 'keep-alive')
+        lines = ['%s %s HTTP/1.1' % (method, selector)]
+        lines.extend('%s: %s' % (k,v) for k,v in headers.items())
+        request = ('\r\n'.join(lines) + '\r\n\r\n').encode('iso-8859-1')
+
+        while True:
+            reader,writer,reused = await self._checkout(s, host, port)
+            try:
+                result = await asyncio.wait_for(
+                    self._exchange(reader, writer, method, request),
+                    self.timeout)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                writer.close()
+                if reused:
+                    #the server timed out the idle connection, try again
+                    logging.debug('Stale connection to %s, retrying' % n)
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            break
+
+        status,reason,hdrs,data,reusable = result
+        if reusable:
+            self._release(s, host, port, reader, writer)
+        else:
+            writer.close()
+        return status, reason, hdrs, data
+
+class AsyncRawEnphaseInterface(RawEnphaseInterface):
+    '''Interfaces with the Enphase api without blocking the event loop
+
+        Every query method is a coroutine returning the raw json.  Rate
+        limit, unprocessable and too many concurrent request errors are
+        retried as the error handler's RetryEngine decides, with
+        asyncio.sleep instead of time.sleep, and at most max_concurrency
+        requests are in flight at once.'''
+
+    def __init__(self, userId, max_wait=DEFAULT_MAX_WAIT,
+            useragent='Mozilla/5.0', datetimeType=DateTimeType.Enphase,
+            errorhandler=None, pool=None,
+            max_concurrency=DEFAULT_MAX_CONCURRENCY, cache=DEFAULT_CACHE,
+            metrics=DEFAULT_METRICS):
+
+        super(AsyncRawEnphaseInterface,self).__init__(userId, max_wait,
+            useragent, datetimeType, errorhandler, cache=cache,
+            metrics=metrics)
+
+        if pool is None:
+            pool = AsyncConnectionPool()
+        self.pool = pool
+        self.retry = self.handler.retry
+        self.max_concurrency = max_concurrency
+        self.flights = AsyncSingleFlight()
+        self._semaphore = None
+
+    async def _fetch(self, url, no_cache=False):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        attempt = 0
+
+        while True:
+            headers = {'Content-Type':'application/json',
+                'User-agent':self.useragent}
+            if self.cache is not None:
+                entry = None if no_cache else self.cache.fresh(url)
+                if entry is not None:
+                    self.metrics.count('cache', tier='http', result='hit',
+                        endpoint=endpointOf(url))
+                    return entry.body
+                headers.update(self.cache.conditionalHeaders(url))
+
+            logging.debug('GET %s', url)
+            self.retry.check(url, attempt > 0)
+            labels = {'endpoint':endpointOf(url), 'key':maskKey(dict(
+                p.parse_qsl(p.urlparse(url).query)).get('key'))}
+            async with self._semaphore:
+                with self.metrics.timer('transport', **labels):
+                    try:
+                        status,reason,hdrs,data = await self.pool.request(
+                            'GET', url, headers)
+                    except Exception:
+                        self.retry.failure(url)
+                        raise
+                    except BaseException:
+                        #cancelled
+                        self.retry.abandon(url)
+                        raise
+            self.metrics.count('requests', status=status, **labels)
+            self.metrics.count('response_bytes', len(data), **labels)
+
+            if status < 400:
+                self.retry.success(url)
+            if status == 200:
+                if self.cache is not None:
+                    self.cache.store(url, hdrs, data)
+                return data
+            if status == 304 and self.cache is not None:
+                entry = self.cache.notModified(url, hdrs)
+                if entry is not None:
+                    return entry.body
+
+            retry = None
+            wait = 0.0
+            if status == 409:
+                logging.info('Received HTTP Error 409')
+                body = json.loads(data.decode('UTF-8'))
+                retry = self.handler.retry409(url, body)
+                if retry is None:
+                    self.retry.giveUp(url, status)
+                    end = self.dtt.datetimeify('period_end',
+                        body['period_end'])
+                    raise RateLimitError(url, status, reason, hdrs,
+                        io.BytesIO(data), end.timestamp() - time.time())
+                retry,wait = retry
+            elif status == 422:
+                logging.info('Received HTTP Error 422')
+                retry = self.handler.retryUrl422(url, json.loads(
+                    data.decode('UTF-8')))
+            elif status == 503:
+                #too many concurrent requests, back off and try again
+                logging.info('Received HTTP Error 503')
+                retry = url
+
+            if retry is not None:
+                wait = self.retry.backoff(url, status, attempt, wait)
+                if wait is None:
+                    if status == 409:
+                        APIKEYRING.cancel(dict(p.parse_qsl(
+                            p.urlparse(retry).query))['key'])
+                    retry = None
+            elif status in (409, 422, 503):
+                self.retry.giveUp(url, status)
+            elif status >= 400:
+                self.retry.failure(url, status)
+
+            if retry is None:
+                raise e.HTTPError(url, status, reason, hdrs, io.BytesIO(data))
+            if wait > 0:
+                logging.info('Sleeping for %.1f seconds' % wait)
+                self.handler.metrics.count('retry_sleep_seconds', wait,
+                    endpoint=endpointOf(url), code=status)
+                await asyncio.sleep(wait)
+            url = retry
+            attempt += 1
+
+    async def _execQuery(self, system_id, command, extraParams = dict()):
+        '''Query the Enphase API and return the response body
+
+            Tasks making the same query at the same time share one
+            request.'''
+
+        data,_ = await self.flights.do((system_id, command) +
+            flightKey(extraParams), self._query, system_id, command,
+            extraParams)
+        return data
+
+    async def _query(self, system_id, command, extraParams):
+        extraParams = dict(extraParams)
+        no_cache = extraParams.pop('no_cache', False)
+        key = extraParams.get('key')
+        if key is None:
+            #a fresh cached response is served without using up a key
+            url = self._buildUrl(system_id, command, extraParams, '')
+            if no_cache or self.cache is None or \
+                    not self.cache.isFresh(url):
+                key,wait = APIKEYRING.reserve()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+
+        data = await self._fetch(self._buildUrl(system_id, command,
+            extraParams, key or ''), no_cache)
+        logging.debug('%s', LazyPayload(data))
+        return data
+
+    async def iter_many(self, method, system_ids, **kwargs):
+        '''Call the query method named method for many systems at once
+
+            Yields a tuple of the system_id and the result as each query
+            completes.  A failed query yields its exception instead of
+            stopping the others.'''
+
+        query = getattr(self, method)
+
+        async def run(system_id):
+            try:
+                return system_id, await query(system_id, **kwargs)
+            except Exception as x:
+                logging.error('%s failed for system %s: %s' %
+                    (method, system_id, x))
+                return system_id, x
+
+        for task in asyncio.as_completed([run(x) for x in system_ids]):
+            yield await task
+
+    async def close(self):
+        '''Close the idle connections held by this interface'''
+
+        self.pool.close()
+
+    async def energy_lifetime(self, system_id, **kwargs):
+        '''Get the lifetime energy produced by the system'''
+
+        return await super(AsyncRawEnphaseInterface,self).energy_lifetime(
+            system_id, **kwargs)
+
+    async def envoys(self, system_id, **kwargs):
+        '''List the envoys associated with the system'''
+
+        return await super(AsyncRawEnphaseInterface,self).envoys(
+            system_id, **kwargs)
+
+    async def index(self, no_cache=False, **kwargs):
+        '''List the systems available by this API key'''
+
+        return await super(AsyncRawEnphaseInterface,self).index(no_cache,
+            **kwargs)
+
+    async def inventory(self, system_id, **kwargs):
+        '''List the inverters associated with this system'''
+
+        return await super(AsyncRawEnphaseInterface,self).inventory(
+            system_id, **kwargs)
+
+    async def monthly_production(self, system_id, **kwargs):
+        '''List the energy produced in the last month'''
+
+        return await super(AsyncRawEnphaseInterface,self).monthly_production(
+            system_id, **kwargs)
+
+    async def rgm_stats(self, system_id, **kwargs):
+        '''List the Revenue Grade Meter stats'''
+
+        return await super(AsyncRawEnphaseInterface,self).rgm_stats(
+            system_id, **kwargs)
+
+    async def stats(self, system_id, **kwargs):
+        '''Get the 5 minute interval data for the given day'''
+
+        return await super(AsyncRawEnphaseInterface,self).stats(
+            system_id, **kwargs)
+
+    async def summary(self, system_id, **kwargs):
+        '''Get the system summary'''
+
+        return await super(AsyncRawEnphaseInterface,self).summary(
+            system_id, **kwargs)
+
+class AsyncJsonEnphaseInterface(AsyncRawEnphaseInterface):
+    async def _execQuery(self, system_id, command, extraParams = dict()):
+        data = await super(AsyncJsonEnphaseInterface,self)._execQuery(
+            system_id, command, extraParams)
+        with self.metrics.timer('decode', endpoint=command or 'systems'):
+            return json.loads(data.decode('UTF-8'))
+
+class AsyncPandasEnphaseInterface(AsyncJsonEnphaseInterface,
+        PandasEnphaseInterface):
+    '''The DataFrame conversion comes from PandasEnphaseInterface, the
+        transport from AsyncJsonEnphaseInterface'''
+
+    async def _execQuery(self, system_id, command, extraParams = dict()):
+        if command in ('stats','rgm_stats'):
+            data = await AsyncRawEnphaseInterface._execQuery(self, system_id,
+                command, extraParams)
+            return self._statsFrame(io.BytesIO(data), command)
+
+        data = await super(AsyncPandasEnphaseInterface,self)._execQuery(
+            system_id, command, extraParams)
+        return self._toFrame(command, data)
+
+    async def summaries(self, system_ids, errors=None, **kwargs):
+        '''Get the summary of many systems in one DataFrame'''
+
+        results = [x async for x in self.iter_many('summary', system_ids,
+            **kwargs)]
+        return self._collect(results, errors)
+
+    async def stats_many(self, system_ids, start_at=None, end_at=None,
+            errors=None, **kwargs):
+        '''Get the 5 minute interval data of many systems in one DataFrame'''
+
+        if start_at is not None:
+            kwargs['start_at'] = start_at
+        if end_at is not None:
+            kwargs['end_at'] = end_at
+        results = [x async for x in self.iter_many('stats', system_ids,
+            **kwargs)]
+        return self._collect(results, errors)
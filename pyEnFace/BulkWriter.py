@@ -0,0 +1,142 @@
+
+import contextlib
+import threading
+import logging
+import time
+
+from sqlalchemy import event
+
+class BulkWriter(object):
+    '''Writes DataFrames to SQLite tables with executemany upserts
+
+        Every batch is a single transaction on a connection tuned for bulk
+        ingest, write ahead logging and synchronous=NORMAL by default.
+        Rows that already exist are updated in place so the same data can
+        be written any number of times.  The pragmas are applied once to
+        every connection the engine opens after the writer is created.
+        Needs SQLite 3.24 or newer.'''
+
+    def __init__(self, engine, journal_mode='WAL', synchronous='NORMAL'):
+        self.engine = engine
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+
+        self._statements = {}
+        self._lock = threading.Lock()
+
+        self.rows = 0
+        self.seconds = 0.0
+        self.transactions = 0
+
+        event.listen(engine, 'connect', self._pragmas)
+
+    def _pragmas(self, con, record):
+        '''Tunes a new DBAPI connection for bulk ingest, before any
+            transaction is begun on it'''
+
+        cur = con.cursor()
+        if self.journal_mode is not None:
+            #in memory databases keep their own journal mode
+            cur.execute('PRAGMA journal_mode=%s' % self.journal_mode)
+        if self.synchronous is not None:
+            cur.execute('PRAGMA synchronous=%s' % self.synchronous)
+        cur.close()
+
+    def connect(self):
+        '''A raw connection with the bulk ingest pragmas applied'''
+
+        return self.engine.raw_connection()
+
+    def _statement(self, table, columns, keys):
+        '''The upsert statement for the given columns, prepared once'''
+
+        k = (table, columns, keys)
+        q = self._statements.get(k)
+        if q is None:
+            updates = [c for c in columns if c not in keys]
+            q = 'INSERT INTO %s (%s) VALUES (%s) ON CONFLICT (%s) ' % (table,
+                ','.join(columns), ','.join('?'*len(columns)), ','.join(keys))
+            if len(updates) > 0:
+                q += 'DO UPDATE SET ' + ','.join('%s=excluded.%s' % (c,c)
+                    for c in updates)
+            else:
+                q += 'DO NOTHING'
+            self._statements[k] = q
+        return q
+
+    @staticmethod
+    def _rows(frame):
+        #tolist hands back python ints and floats, sqlite stores NaN as NULL
+        return zip(*[frame[c].to_numpy().tolist() for c in frame.columns])
+
+    @contextlib.contextmanager
+    def transaction(self):
+        '''Yields a Batch, everything written to it commits together'''
+
+        con = self.connect()
+        start = time.perf_counter()
+        batch = Batch(self, con.cursor())
+        try:
+            yield batch
+            con.commit()
+        except:
+            con.rollback()
+            raise
+        finally:
+            con.close()
+
+        with self._lock:
+            self.rows += batch.rows
+            self.seconds += time.perf_counter() - start
+            self.transactions += 1
+        logging.debug('Wrote %d rows in one transaction' % batch.rows)
+
+    def write(self, table, frame, keys):
+        '''Upsert a single frame in its own transaction'''
+
+        with self.transaction() as batch:
+            batch.write(table, frame, keys)
+
+    def rowsPerSecond(self):
+        '''Rows written per second spent in write transactions'''
+
+        if self.seconds == 0:
+            return 0.0
+        return self.rows / self.seconds
+
+class Batch(object):
+    '''The writes of one BulkWriter transaction'''
+
+    def __init__(self, writer, cursor):
+        self.writer = writer
+        self.cursor = cursor
+        self.rows = 0
+
+    def write(self, table, frame, keys):
+        '''Upsert the columns of frame into table, keys are the columns of
+            its primary key'''
+
+        if len(frame) == 0:
+            return
+        q = self.writer._statement(table, tuple(frame.columns), tuple(keys))
+        self.cursor.executemany(q, self.writer._rows(frame))
+        self.rows += len(frame)
+
+    def execute(self, q, params=()):
+        '''Run any other statement as part of the transaction'''
+
+        self.cursor.execute(q, params)
+
+    def fetchall(self, q, params=()):
+        '''The rows of a select run as part of the transaction'''
+
+        self.cursor.execute(q, params)
+        return self.cursor.fetchall()
+
+    def executemany(self, table, columns, rows, keys):
+        '''Upsert plain tuples of the given columns into table'''
+
+        rows = list(rows)
+        q = self.writer._statement(table, tuple(columns), tuple(keys))
+        self.cursor.executemany(q, rows)
+        self.rows += len(rows)
@@ -0,0 +1,259 @@
+
+import http.client as h
+import urllib.request as r
+import urllib.response as ur
+import urllib.parse as p
+import collections
+import threading
+import logging
+import socket
+import time
+import io
+
+DEFAULT_POOL_SIZE = 4
+DEFAULT_IDLE_TIMEOUT = 30
+DEFAULT_TIMEOUT = socket._GLOBAL_DEFAULT_TIMEOUT
+
+#errors that mean a reused keep-alive socket was closed by the far end
+STALE_ERRORS = (h.RemoteDisconnected, h.BadStatusLine,
+    ConnectionResetError, BrokenPipeError, ConnectionAbortedError)
+
+class ConnectionPool(object):
+    '''Keeps idle keep-alive connections around so repeated requests to
+        the same host skip the TCP and TLS handshakes
+
+        At most pool_size idle connections are kept per host, any extra
+        connections opened under contention are closed when released.
+        Connections idle for longer than idle_timeout seconds are reaped.'''
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE,
+            idle_timeout=DEFAULT_IDLE_TIMEOUT, timeout=DEFAULT_TIMEOUT,
+            context=None):
+
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.context = context
+
+        self._idle = collections.defaultdict(collections.deque)
+        self._lock = threading.Lock()
+
+        self.created = 0
+        self.reused = 0
+
+    def _newConnection(self, scheme, host):
+        self.created += 1
+        logging.debug('Opening new %s connection to %s' % (scheme, host))
+        if scheme == 'https':
+            return h.HTTPSConnection(host, timeout=self.timeout,
+                context=self.context)
+        return h.HTTPConnection(host, timeout=self.timeout)
+
+    def _reapLocked(self, now):
+        for key in list(self._idle.keys()):
+            idle = self._idle[key]
+            while len(idle) > 0 and now - idle[0][1] > self.idle_timeout:
+                con,_ = idle.popleft()
+                con.close()
+            if len(idle) == 0:
+                del self._idle[key]
+
+    def reap(self):
+        '''Close every connection that has been idle for too long'''
+
+        with self._lock:
+            self._reapLocked(time.monotonic())
+
+    def checkout(self, scheme, host):
+        '''Get a connection to host, reusing an idle one if possible
+
+            Returns a tuple of the connection and whether it was reused'''
+
+        with self._lock:
+            self._reapLocked(time.monotonic())
+            idle = self._idle.get((scheme, host))
+            if idle:
+                #most recently used connections are the least likely to
+                #have been dropped by the server
+                con,_ = idle.pop()
+                self.reused += 1
+                return con, True
+
+        return self._newConnection(scheme, host), False
+
+    def _setTimeout(self, con, timeout):
+        '''Apply timeout to con, and to its socket once connected'''
+
+        con.timeout = timeout
+        if con.sock is not None:
+            if timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+                timeout = socket.getdefaulttimeout()
+            con.sock.settimeout(timeout)
+
+    def release(self, scheme, host, con):
+        '''Return a connection to the pool once its response is read'''
+
+        if con.timeout != self.timeout:
+            #undo the timeout of the request it served
+            self._setTimeout(con, self.timeout)
+        with self._lock:
+            idle = self._idle[(scheme, host)]
+            if len(idle) < self.pool_size:
+                idle.append((con, time.monotonic()))
+                return
+        con.close()
+
+    def discard(self, con):
+        '''Close a connection that can not be reused'''
+
+        con.close()
+
+    def close(self):
+        '''Close every idle connection in the pool'''
+
+        with self._lock:
+            for idle in self._idle.values():
+                for con,_ in idle:
+                    con.close()
+            self._idle.clear()
+
+    def idleCount(self, scheme=None, host=None):
+        with self._lock:
+            if scheme is None:
+                return sum(len(x) for x in self._idle.values())
+            return len(self._idle.get((scheme, host), ()))
+
+    def open(self, method, url, body=None, headers=None, timeout=None):
+        '''Send a request over a pooled connection
+
+            Returns a PooledResponse, the connection goes back in the pool
+            once its body has been read to the end.  A timeout other than
+            None replaces the pool's until then.'''
+
+        s,n,pa,pr,q,f = p.urlparse(url)
+        selector = p.urlunparse(('','',pa,pr,q,''))
+        headers = dict(headers or {})
+        headers.setdefault('Connection', 'keep-alive')
+
+        while True:
+            con,reused = self.checkout(s, n)
+            if timeout is not None:
+                self._setTimeout(con, timeout)
+            try:
+                con.request(method, selector, body, headers)
+                response = con.getresponse()
+            except STALE_ERRORS:
+                self.discard(con)
+                if reused:
+                    #the server timed out the idle connection, try again
+                    logging.debug('Stale connection to %s, retrying' % n)
+                    continue
+                raise
+            except Exception:
+                self.discard(con)
+                raise
+            return PooledResponse(self, s, n, con, response)
+
+    def request(self, method, url, body=None, headers=None):
+        '''Perform a request over a pooled connection
+
+            Returns a tuple of the status, reason, headers and the body.'''
+
+        response = self.open(method, url, body, headers)
+        try:
+            data = response.read()
+        finally:
+            response.close()
+        return response.status, response.reason, response.msg, data
+
+class PooledResponse(io.RawIOBase):
+    '''The body of a response that hands its connection back to the pool
+        once it has been read to the end
+
+        Closing it early closes the connection instead.'''
+
+    def __init__(self, pool, scheme, host, con, response):
+        super(PooledResponse,self).__init__()
+        self.pool = pool
+        self.scheme = scheme
+        self.host = host
+        self.con = con
+        self.response = response
+
+        self.status = response.status
+        self.reason = response.reason
+        self.msg = response.msg
+
+        if response.isclosed():
+            self._finish()
+
+    def _finish(self):
+        con,self.con = self.con,None
+        if self.response.will_close:
+            self.pool.discard(con)
+        else:
+            self.pool.release(self.scheme, self.host, con)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = self.response.readinto(b)
+        if self.con is not None and self.response.isclosed():
+            self._finish()
+        return n
+
+    def close(self):
+        if self.con is not None:
+            if self.response.isclosed():
+                self._finish()
+            else:
+                #the rest of the body is still on the wire
+                self.response.close()
+                con,self.con = self.con,None
+                self.pool.discard(con)
+        super(PooledResponse,self).close()
+
+DEFAULT_POOL = ConnectionPool()
+
+class KeepAliveHandler(r.AbstractHTTPHandler):
+    '''A urllib handler that sends http and https requests over a
+        ConnectionPool instead of opening a new connection every time
+
+        The responses still pass through the other handlers in the opener
+        so error handlers such as EnphaseErrorHandler keep working.'''
+
+    #run ahead of the stock HTTPHandler and HTTPSHandler
+    handler_order = 499
+
+    def __init__(self, pool=None):
+        super(KeepAliveHandler,self).__init__()
+        if pool is None:
+            pool = DEFAULT_POOL
+        self.pool = pool
+
+    def _open(self, req):
+        headers = dict(req.unredirected_hdrs)
+        headers.update(req.headers)
+        headers = dict((k.title(),v) for k,v in headers.items())
+
+        #the timeout given to the opener, if any
+        timeout = req.timeout
+        if timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+            timeout = None
+        pooled = self.pool.open(req.get_method(), req.get_full_url(),
+            req.data, headers, timeout)
+
+        response = ur.addinfourl(io.BufferedReader(pooled), pooled.msg,
+            req.get_full_url(), pooled.status)
+        response.msg = pooled.reason
+        return response
+
+    def http_open(self, req):
+        return self._open(req)
+
+    def https_open(self, req):
+        return self._open(req)
+
+    http_request = r.AbstractHTTPHandler.do_request_
+    https_request = r.AbstractHTTPHandler.do_request_
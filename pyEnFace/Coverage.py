@@ -0,0 +1,115 @@
+
+import bisect
+import threading
+
+INTERVAL = 300
+
+class IntervalSet(object):
+    '''A set of merged half open [lower, upper) ranges kept sorted so
+        membership and gap queries are a binary search away'''
+
+    def __init__(self, ranges=()):
+        self.lowers = []
+        self.uppers = []
+        for lower,upper in ranges:
+            self.add(lower, upper)
+
+    def __len__(self):
+        return len(self.lowers)
+
+    def __iter__(self):
+        return iter(list(zip(self.lowers, self.uppers)))
+
+    def add(self, lower, upper):
+        '''Add [lower, upper), merging it with any range it touches'''
+
+        if upper <= lower:
+            return
+
+        #first range ending at or after lower and first starting after upper
+        i = bisect.bisect_left(self.uppers, lower)
+        j = bisect.bisect_right(self.lowers, upper)
+        if i < j:
+            lower = min(lower, self.lowers[i])
+            upper = max(upper, self.uppers[j-1])
+        self.lowers[i:j] = [lower]
+        self.uppers[i:j] = [upper]
+
+    def gaps(self, lower, upper):
+        '''The ranges within [lower, upper) that are not in the set'''
+
+        output = []
+        i = max(bisect.bisect_right(self.lowers, lower) - 1, 0)
+        while lower < upper and i < len(self.lowers) and \
+                self.lowers[i] < upper:
+            if self.lowers[i] > lower:
+                output.append((lower, self.lowers[i]))
+            lower = max(lower, self.uppers[i])
+            i += 1
+        if lower < upper:
+            output.append((lower, upper))
+        return output
+
+    def covers(self, lower, upper):
+        return len(self.gaps(lower, upper)) == 0
+
+class CoverageIndex(object):
+    '''Tracks which interval end times of each system and endpoint are
+        already in the cache
+
+        Ranges are in epoch seconds on the 5 minute interval grid, a range
+        [lower, upper) holds every interval with lower <= end_at < upper.
+        The sets are loaded on first use with load(system_id, endpoint),
+        which should return the stored (lower, upper) pairs.'''
+
+    def __init__(self, load):
+        self.load = load
+        self._sets = {}
+        self._lock = threading.RLock()
+
+    def _set(self, system_id, endpoint):
+        k = (system_id, endpoint)
+        s = self._sets.get(k)
+        if s is None:
+            s = self._sets[k] = IntervalSet(self.load(system_id, endpoint))
+        return s
+
+    @staticmethod
+    def requestRange(start_at, end_at):
+        '''The interval end times returned by a request with the given
+            epoch start_at and end_at, those ending after start_at up to
+            and including end_at'''
+
+        return ((int(start_at)//INTERVAL + 1)*INTERVAL,
+            (int(end_at)//INTERVAL + 1)*INTERVAL)
+
+    @staticmethod
+    def queryRange(lower, upper):
+        '''The start_at and end_at of a request returning [lower, upper)'''
+
+        return lower - INTERVAL, upper - INTERVAL
+
+    def gaps(self, system_id, endpoint, lower, upper):
+        with self._lock:
+            return self._set(system_id, endpoint).gaps(lower, upper)
+
+    def add(self, system_id, endpoint, lower, upper):
+        '''Record [lower, upper) as cached, returns every range now stored
+            for the system and endpoint'''
+
+        with self._lock:
+            s = self._set(system_id, endpoint)
+            s.add(lower, upper)
+            return list(s)
+
+    def ranges(self, system_id, endpoint):
+        with self._lock:
+            return list(self._set(system_id, endpoint))
+
+    def forget(self, system_id=None, endpoint=None):
+        '''Drop loaded sets so they are read again from storage'''
+
+        with self._lock:
+            for k in list(self._sets):
+                if system_id in (None, k[0]) and endpoint in (None, k[1]):
+                    del self._sets[k]
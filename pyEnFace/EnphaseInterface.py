@@ -6,26 +6,108 @@ import dateutil.parser as dp
 import json
 import time
 import logging
-import collections
+import concurrent.futures as cf
+import urllib.error as e
+import contextlib
+import threading
+import io
 
 from lxml import etree as et
 from pandas import Series,to_timedelta,to_datetime,concat
 import pandas as pd
+import numpy as np
 from pandas.io.json import json_normalize
 from enum import Enum
 from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+from .ConnectionPool import KeepAliveHandler, DEFAULT_POOL
+from .HttpCache import HttpCacheHandler, DEFAULT_CACHE
+from .KeyRing import KeyRing
+from .Retry import (DEFAULT_RETRY, CircuitOpenError, RateLimitError,
+    endpointOf)
+from .Metrics import DEFAULT_METRICS, LazyPayload, maskKey
+from .StreamingJson import IntervalDecoder
+from .BulkWriter import BulkWriter
+from .MemoryCache import MemoryCache
+from .Coverage import CoverageIndex, IntervalSet
+from .SingleFlight import SingleFlight, flightKey
 
 APIV2 = 'https://api.enphaseenergy.com/api/v2'
-APIKEYRING = collections.deque()
+APIKEYRING = KeyRing()
 
 DEFAULT_MAX_WAIT = 60
+DEFAULT_WORKERS = 4
+DEFAULT_BATCH_SIZE = 30
+
+#version of the CachingEnphaseInterface tables
+SCHEMA_VERSION = 4
+#systems read by one SqlCacheBackend statement
+SQL_MAX_SYSTEMS = 500
+
+#seconds the memory tier keeps data that can still change
+DEFAULT_LIVE_TTL = 60
+DEFAULT_ENVOYS_TTL = 3600
+INTERVAL = 300
+#the api returns at most a day of intervals per stats request
+MAX_RANGE = 86400
+
+#primary keys of the CachingEnphaseInterface tables
+CACHE_KEYS = {'stats':('system_id','end_at'),
+    'rgm_stats':('system_id','end_at'),
+    'summary':('system_id','summary_date'),
+    'envoys':('system_id','serial_number'),
+    'coverage':('system_id','endpoint','lower')}
+
+#columns of the CachingEnphaseInterface tables, besides coverage, and the
+#kind of value each holds.  Times are integer epoch seconds.
+CACHE_COLUMNS = {'stats':(('system_id','int'),('end_at','int'),
+        ('devices_reporting','int'),('enwh','int'),('powr','int'),
+        ('total_devices','int')),
+    'rgm_stats':(('system_id','int'),('end_at','int'),
+        ('devices_reporting','int'),('wh_del','int'),('total_devices','int')),
+    'summary':(('system_id','int'),('summary_date','int'),
+        ('current_power','int'),('energy_lifetime','int'),
+        ('energy_today','int'),('last_report_at','int'),('modules','int'),
+        ('operational_at','int'),('size_w','int'),('source','text'),
+        ('status','text')),
+    'envoys':(('system_id','int'),('serial_number','text'),
+        ('envoy_id','int'),('last_report_at','int'),('name','text'),
+        ('part_number','text'),('status','text'))}
+
+#rollups of the interval tables, finest first, and how each column is
+#aggregated.  intervals counts the intervals a rollup row was made from.
+ROLLUP_FREQS = ('hourly','daily','monthly')
+ROLLUPS = {'stats':(('enwh','sum'),('powr','max')),
+    'rgm_stats':(('wh_del','sum'),)}
+
+def rollupTable(table, freq):
+    return '%s_%s' % (table, freq)
+
+#rollup rows are keyed on the local start of their hour, day or month
+CACHE_KEYS.update((rollupTable(t, f), ('system_id','start_at'))
+    for t in ROLLUPS for f in ROLLUP_FREQS)
+CACHE_COLUMNS.update((rollupTable(t, f), (('system_id','int'),
+        ('start_at','int')) + tuple((x,'int') for x,_ in v) +
+        (('intervals','int'),))
+    for t,v in ROLLUPS.items() for f in ROLLUP_FREQS)
 
 class EnphaseErrorHandler(r.BaseHandler):
-    def __init__(self, datetimetype, max_wait = DEFAULT_MAX_WAIT):
+    '''Retries rate limited, unprocessable and unavailable requests
+
+        Retries go back through the opener the handler belongs to so they
+        keep its headers, connection pool and response cache.  When and
+        whether to retry is up to a RetryEngine, shared by default.
+        Seconds slept before retries are counted in metrics.'''
+
+    def __init__(self, datetimetype, max_wait = DEFAULT_MAX_WAIT, retry=None,
+            metrics=None):
         super(EnphaseErrorHandler,self).__init__()
 
         self.dtt = datetimetype
         self.max_wait = max_wait
+        self.retry = retry if retry is not None else DEFAULT_RETRY
+        self.metrics = metrics if metrics is not None else DEFAULT_METRICS
         logging.debug('Initialized EnphaseErrorHandler')
 
     def setMaxWait(self, max_wait):
@@ -36,38 +118,44 @@ class EnphaseErrorHandler(r.BaseHandler):
         self.dtt = dtt
         logging.debug('Set DateTimeType to %s' % self.dtt.value)
 
-    def http_error_409(self, req, fp, code, msg, hdrs):
+    @staticmethod
+    def _replaceParams(url, **kwargs):
+        s,n,pa,pr,q,f = p.urlparse(url)
+        params = dict(p.parse_qsl(q))
+        params.update(kwargs)
+        return p.urlunparse((s,n,pa,pr,p.urlencode(params),f))
 
-        s = fp.read().decode(encoding='UTF-8')
-        data = json.loads(s)
+    def retry409(self, url, data):
+        '''The url to retry a rate limited request with and the seconds to
+            wait before sending it, or None if the wait would be longer
+            than max_wait
 
-        logging.info('Received HTTP Error 409')
-        logging.debug(data)
+            The key that hit the limit is parked until the end of the
+            period and the retry goes out on the key with the most
+            headroom, so the handler only sleeps when every key is spent.'''
 
         end = self.dtt.datetimeify('period_end',data['period_end'])
-        diff = end.timestamp() - int(time.time())
+        key = dict(p.parse_qsl(p.urlparse(url).query)).get('key')
+        APIKEYRING.penalize(key, end.timestamp())
 
-        if diff < self.max_wait:
-            #is there a good way to handle clock skew
-            logging.info('Sleeping for %s seconds' % str(diff+5.0))
-            time.sleep(diff+5) #sleep +5 to prevent a second 409
-            return r.build_opener(self).open(req.get_full_url())
-
-    def http_error_422(self, req, fp, code, msg, hdrs):
+        newKey,wait = APIKEYRING.reserve()
+        if wait >= self.max_wait:
+            APIKEYRING.cancel(newKey)
+            return
 
-        s = fp.read().decode(encoding='UTF-8')
-        data = json.loads(s)
+        return self._replaceParams(url, key=newKey), wait
 
-        logging.info('Received HTTP Error 422')
-        logging.debug(data)
+    def retryUrl422(self, url, data):
+        '''The url to retry an unprocessable request with, or None if the
+            request can not be fixed'''
 
         if 'Failed to parse date' in data['reason']:
-            logging.error(req.get_full_url())
+            logging.error(url)
             logging.error(data)
             return
 
         if 'Requested date range is invalid for this system' in data['reason']:
-            logging.error(req.get_full_url())
+            logging.error(url)
             logging.error(data)
             return
 
@@ -76,21 +164,266 @@ class EnphaseErrorHandler(r.BaseHandler):
 
         if startAt > lastInt:
             endAt = self.dtt.datetimeify('end_at',data['end_at'])
-            startAt = dt.combine(endAt.date(),datetime.time())
-
-            s,n,pa,pr,q,f = p.urlparse(req.get_full_url())
-            params = dict(p.parse_qsl(q))
-            params['start_at'] = self.dtt.stringify('start_at',
-                    startAt.timestamp())
-            qstring = p.urlencode(params)
-            url = p.urlunparse((s,n,pa,pr,qstring,f))
-            return r.build_opener(self).open(url)
+            startAt = dt.datetime.combine(endAt.date(),dt.time())
+
+            return self._replaceParams(url,
+                start_at=self.dtt.stringify('start_at', startAt))
         #handle other potential error cases
 
+    def http_request(self, req):
+        self.retry.check(req.get_full_url(), getattr(req, 'retries', 0) > 0)
+        return req
+
+    def http_response(self, req, response):
+        if response.getcode() < 400:
+            self.retry.success(req.get_full_url())
+        return response
+
+    https_request = http_request
+    https_response = http_response
+
+    def _count(self, req, code):
+        '''Count an error response, the ones that end up retried never
+            reach the interface'''
+
+        url = req.get_full_url()
+        self.metrics.count('requests', status=code, endpoint=endpointOf(url),
+            key=maskKey(dict(p.parse_qsl(p.urlparse(url).query)).get('key')))
+
+    @staticmethod
+    def _error(req, code, msg, hdrs, body, cls=e.HTTPError, **kwargs):
+        return cls(req.get_full_url(), code, msg, hdrs, io.BytesIO(body),
+            **kwargs)
+
+    def _retry(self, req, url, code, wait=0.0):
+        '''Send req again as url through the opener after waiting, None
+            if the RetryEngine gives up'''
+
+        attempt = getattr(req, 'retries', 0)
+        wait = self.retry.backoff(req.get_full_url(), code, attempt, wait)
+        if wait is None:
+            return None
+        if wait > 0:
+            logging.info('Sleeping for %.1f seconds' % wait)
+            self.metrics.count('retry_sleep_seconds', wait,
+                endpoint=endpointOf(url), code=code)
+            time.sleep(wait)
+
+        retry = r.Request(url, headers=req.headers, method=req.get_method())
+        retry.retries = attempt + 1
+        return self.parent.open(retry, timeout=req.timeout)
+
+    def http_error_409(self, req, fp, code, msg, hdrs):
+
+        self._count(req, code)
+        body = fp.read()
+        data = json.loads(body.decode(encoding='UTF-8'))
+
+        logging.info('Received HTTP Error 409')
+        logging.debug(data)
+
+        retry = self.retry409(req.get_full_url(), data)
+        if retry is None:
+            self.retry.giveUp(req.get_full_url(), code)
+            logging.error('Rate limited until %s, longer than max_wait' %
+                data.get('period_end'))
+            end = self.dtt.datetimeify('period_end',data['period_end'])
+            raise self._error(req, code, msg, hdrs, body, RateLimitError,
+                wait=end.timestamp() - time.time())
+
+        url,wait = retry
+        response = self._retry(req, url, code, wait)
+        if response is None:
+            APIKEYRING.cancel(dict(p.parse_qsl(p.urlparse(url).query))['key'])
+            raise self._error(req, code, msg, hdrs, body)
+        return response
+
+    def http_error_422(self, req, fp, code, msg, hdrs):
+
+        self._count(req, code)
+        body = fp.read()
+        data = json.loads(body.decode(encoding='UTF-8'))
+
+        logging.info('Received HTTP Error 422')
+        logging.debug(data)
+
+        url = self.retryUrl422(req.get_full_url(), data)
+        response = None
+        if url is not None:
+            response = self._retry(req, url, code)
+        else:
+            self.retry.giveUp(req.get_full_url(), code)
+        if response is None:
+            raise self._error(req, code, msg, hdrs, body)
+        return response
+
     def http_error_503(self, req, fp, code, msg, hdrs):
         #The api says if you have made to many concurrent requests
         #then you will get a http_error_503, but they say nothing else
-        pass
+
+        self._count(req, code)
+        body = fp.read()
+        logging.info('Received HTTP Error 503')
+
+        response = self._retry(req, req.get_full_url(), code)
+        if response is None:
+            raise self._error(req, code, msg, hdrs, body)
+        return response
+
+def _localOffset(timestamp):
+    d = dt.datetime.fromtimestamp(timestamp)
+    return (d - dt.datetime.utcfromtimestamp(timestamp)).total_seconds()
+
+def _localOffsets(seconds):
+    '''The local utc offset in seconds of every epoch timestamp
+
+        Offsets are looked up once per day and only per value on days
+        where the offset changes, converting every value through a
+        tzlocal is orders of magnitude slower.'''
+
+    valid = ~np.isnan(seconds)
+    offsets = np.zeros(len(seconds))
+    if not valid.any():
+        return offsets
+
+    days = (seconds[valid] // 86400).astype('int64')
+    uniq,inverse = np.unique(days, return_inverse=True)
+    first = np.array([_localOffset(x*86400) for x in uniq])
+    last = np.array([_localOffset(x*86400 + 86399) for x in uniq])
+
+    dayOffsets = first[inverse]
+    changing = (first != last)[inverse]
+    if changing.any():
+        values = seconds[valid]
+        dayOffsets[changing] = [_localOffset(x) for x in values[changing]]
+
+    offsets[valid] = dayOffsets
+    return offsets
+
+EPOCH = pd.Timestamp('1970-01-01')
+
+def fromEpoch(series, tz=None):
+    '''Convert a Series of epoch seconds to naive local times, or to
+        aware times in tz when one is given'''
+
+    if tz is not None:
+        #copied, to_datetime rejects the read only arrays of zero copy
+        #Parquet reads
+        seconds = Series(series.to_numpy(copy=True), index=series.index,
+            name=series.name)
+        return to_datetime(seconds, unit='s', utc=True).dt.tz_convert(tz)
+
+    seconds = series.to_numpy(dtype='float64')
+    return Series(to_datetime(seconds + _localOffsets(seconds), unit='s'),
+        index=series.index, name=series.name)
+
+def toEpoch(series):
+    '''Convert a Series of datetimes to epoch seconds, the inverse of
+        fromEpoch.  Naive times are taken to be local times.'''
+
+    series = to_datetime(series)
+    if series.dt.tz is not None:
+        series = series.dt.tz_convert('UTC').dt.tz_localize(None)
+        return ((series - EPOCH) // pd.Timedelta(seconds=1)).to_numpy(
+            dtype='float64')
+
+    local = ((series - EPOCH) // pd.Timedelta(seconds=1)).to_numpy(
+        dtype='float64')
+    #the offset of the local time read as utc is at most a transition away
+    return local - _localOffsets(local - _localOffsets(local))
+
+#numpy units of the rollup buckets and a span longer than any of their
+#buckets but shorter than two, days last 23 to 25 hours
+BUCKET_UNITS = {'hourly':'h', 'daily':'D', 'monthly':'M'}
+BUCKET_SPANS = {'hourly':3600, 'daily':27*3600, 'monthly':32*86400}
+
+def floorLocal(seconds, freq):
+    '''The epoch of the local start of the hour, day or month, by freq,
+        of every epoch timestamp'''
+
+    seconds = np.asarray(seconds, dtype='float64')
+    offsets = _localOffsets(seconds)
+    if freq == 'hourly':
+        #offsets change on hour boundaries so an hour has one offset
+        return ((seconds + offsets) // 3600 * 3600 - offsets).astype('int64')
+
+    local = (seconds + offsets).astype('int64').astype('datetime64[s]')
+    local = local.astype('datetime64[%s]' % BUCKET_UNITS[freq]).astype(
+        'datetime64[s]').astype('int64').astype('float64')
+    return (local - _localOffsets(local - _localOffsets(local))).astype(
+        'int64')
+
+def ceilLocal(seconds, freq):
+    '''The epoch of the first local start of an hour, day or month, by
+        freq, at or after every epoch timestamp'''
+
+    seconds = np.asarray(seconds, dtype='int64')
+    floor = floorLocal(seconds, freq)
+    return np.where(floor < seconds, nextBucket(floor, freq), floor)
+
+def nextBucket(starts, freq):
+    '''The start of the bucket after each bucket start'''
+
+    return floorLocal(np.asarray(starts) + BUCKET_SPANS[freq], freq)
+
+def _compactSeries(name, series, ratio):
+    if pd.api.types.is_bool_dtype(series):
+        return series
+    if pd.api.types.is_integer_dtype(series):
+        return pd.to_numeric(series, downcast='integer')
+    if pd.api.types.is_float_dtype(series):
+        values = series.to_numpy()
+        if len(values) > 0 and not np.isnan(values).any() and \
+                (values == np.floor(values)).all():
+            return pd.to_numeric(series.astype('int64'), downcast='integer')
+        return series
+    if series.dtype != object:
+        return series
+
+    if '_at' in name or '_date' in name:
+        try:
+            return to_datetime(series)
+        except (ValueError, TypeError):
+            return series
+    values = series.dropna()
+    types = values.map(type)
+    if len(values) > 0 and types.eq(int).all():
+        #python ints, such as the values json_normalize repeats, nullable
+        #when some are missing
+        try:
+            return pd.to_numeric(series.astype('int64' if
+                len(values) == len(series) else 'Int64'), downcast='integer')
+        except OverflowError:
+            return series
+    if len(values) > 0 and types.eq(str).all() and \
+            series.nunique() <= ratio * len(series):
+        return series.astype('category')
+    return series
+
+def compactFrame(frame, ratio=0.5):
+    '''Shrink a frame to the smallest dtypes that hold its values
+
+        Integers are downcast, floats holding only whole numbers and
+        objects holding only integers become integers, nullable if some
+        objects are missing, times left as objects become datetime64 and strings
+        become categoricals when there are at most ratio distinct values
+        per row.  A MultiIndex is rebuilt from its integer codes without
+        unused levels.  Arithmetic on downcast integers can overflow,
+        cast them back up before multiplying.'''
+
+    output = frame.copy(deep=False)
+    for col in output.columns:
+        output[col] = _compactSeries(col, output[col], ratio)
+
+    index = output.index
+    if isinstance(index, pd.MultiIndex):
+        index = index.remove_unused_levels()
+        #levels hold distinct values so never become categoricals
+        levels = [_compactSeries(str(n), Series(l), 0)
+            for n,l in zip(index.names, index.levels)]
+        output.index = pd.MultiIndex(levels=levels, codes=index.codes,
+            names=index.names, verify_integrity=False)
+    return output
 
 class DateTimeType(Enum):
     Enphase = 'enphase'
@@ -121,11 +454,40 @@ class DateTimeType(Enum):
             else:
                 return dt.datetime.fromtimestamp(value)
         elif self is DateTimeType.Iso8601:
-            return dp.parser.parse(value)
+            return dp.parse(value)
         elif self is DateTimeType.Epoch:
             return dt.datetime.fromtimestamp(value)
         logging.warning('Failed to datetimeify %s' % value)
 
+    def datetimeifySeries(self, key, series, tz=None):
+        '''Convert a whole Series of Enphase timestamps or time strings
+
+            Gives the same times as datetimeify does for each value but
+            converts in bulk.  With tz None times are naive local times
+            like datetimeify returns, Iso8601 strings with an offset come
+            back in UTC.  Otherwise times are aware and in tz.'''
+
+        if '_date' in key and self is not DateTimeType.Iso8601:
+            output = to_datetime(series, format='%Y-%m-%d')
+            if tz is not None:
+                output = output.dt.tz_localize(tz)
+            return output
+
+        if self is DateTimeType.Iso8601:
+            strings = series.astype(str)
+            if not strings.str.contains(r'(?:[+-]\d\d:?\d\d|Z)$').any():
+                output = to_datetime(strings)
+                if tz is not None:
+                    output = output.dt.tz_localize(tz)
+                return output
+            #utc first so strings with different offsets can be combined
+            output = to_datetime(strings, utc=True)
+            if tz is not None:
+                output = output.dt.tz_convert(tz)
+            return output
+
+        return fromEpoch(series, tz)
+
     def sanatizeTimes(self, query):
         '''Make sure the datetime values are sane'''
 
@@ -151,44 +513,116 @@ class RawEnphaseInterface(object):
 
     def __init__(self, userId, max_wait=DEFAULT_MAX_WAIT,
             useragent='Mozilla/5.0', datetimeType=DateTimeType.Enphase,
-            errorhandler=None):
+            errorhandler=None, pool=DEFAULT_POOL, cache=DEFAULT_CACHE,
+            metrics=DEFAULT_METRICS):
+        '''The connection pool is shared by every interface by default so
+            keep-alive connections to the api are reused across instances
+
+            Responses of the endpoints given a ttl are kept in cache, a
+            ResponseCache also shared by default, and revalidated with
+            conditional requests.  Pass cache=None to always download
+            them.
+
+            Request latency, bytes and the time spent in each stage are
+            recorded in metrics, a MetricsRegistry.'''
 
         if errorhandler==None:
-            errorhandler=EnphaseErrorHandler(datetimeType,max_wait)
+            errorhandler=EnphaseErrorHandler(datetimeType,max_wait,
+                metrics=metrics)
 
         self.userId = userId
+        self.metrics = metrics
 
         self.dtt = datetimeType
         self.handler = errorhandler
-
-        self.opener = r.build_opener(self.handler)
+        self.pool = pool
+        self.cache = cache
+        self.useragent = useragent
+
+        handlers = [KeepAliveHandler(pool), self.handler]
+        if cache is not None:
+            handlers.insert(0, HttpCacheHandler(cache))
+        self.opener = r.build_opener(*handlers)
         self.opener.addheaders = [('User-agent',useragent)]
         self.apiDest = APIV2
 
-    def _execQuery(self, system_id, command, extraParams = dict()):
+    def _buildUrl(self, system_id, command, extraParams, key):
         '''Generates a request url for the Enphase API'''
 
-        if system_id is not '':
+        if system_id != '':
             system_id = '/' + str(system_id)
-        if command is not '':
+        if command != '':
             command = '/' + command
 
-        try:
-            query = {'user_id':self.userId,'key':APIKEYRING[0]}
-        except IndexError:
-            raise ValueError('Must register at least one key with APIKEYRING')
+        query = {'user_id':self.userId,'key':key}
         query.update(extraParams)
 
         self.dtt.sanatizeTimes(query)
 
         q = p.urlencode(query)
 
-        query = self.apiDest + '/systems' + system_id + command + '?' + q
+        return self.apiDest + '/systems' + system_id + command + '?' + q
+
+    def _openQuery(self, system_id, command, extraParams = dict()):
+        '''Query the Enphase API and return the unread response
+
+            no_cache in extraParams revalidates a cached response instead
+            of reusing it while fresh.'''
+
+        extraParams = dict(extraParams)
+        no_cache = extraParams.pop('no_cache', False)
+        key = extraParams.get('key')
+        if key is None:
+            #a fresh cached response is served without using up a key
+            query = self._buildUrl(system_id, command, extraParams, '')
+            if no_cache or self.cache is None or \
+                    not self.cache.isFresh(query):
+                with self.metrics.timer('key_wait',
+                        endpoint=endpointOf(query)):
+                    key = APIKEYRING.acquire()
+        query = self._buildUrl(system_id, command, extraParams, key or '')
         req = r.Request(query, headers={'Content-Type':'application/json'})
+        if no_cache:
+            req.add_header('Cache-Control', 'no-cache')
 
-        logging.debug('GET %s' % query)
-        response = self.opener.open(req).read()
-        logging.debug(response.decode('UTF-8'))
+        logging.debug('GET %s', query)
+        labels = {'endpoint':endpointOf(query), 'key':maskKey(key)}
+        try:
+            with self.metrics.timer('transport', **labels):
+                response = self.opener.open(req)
+        except CircuitOpenError:
+            raise
+        except e.HTTPError as x:
+            #the error handler counted the codes it handles
+            if x.code not in (409, 422, 503):
+                self.metrics.count('requests', status=x.code, **labels)
+                self.handler.retry.failure(query, x.code)
+            raise
+        except Exception:
+            self.handler.retry.failure(query)
+            raise
+        except BaseException:
+            #interrupted, such as by KeyboardInterrupt
+            self.handler.retry.abandon(query)
+            raise
+        self._countResponse(response, labels)
+        return response
+
+    def _countResponse(self, response, labels):
+        if getattr(response, 'from_cache', False):
+            self.metrics.count('cache', tier='http', result='hit',
+                endpoint=labels['endpoint'])
+            return
+        self.metrics.count('requests', status=response.getcode(), **labels)
+        length = response.headers.get('Content-Length')
+        if length is not None and length.isdigit():
+            self.metrics.count('response_bytes', int(length), **labels)
+
+    def _execQuery(self, system_id, command, extraParams = dict()):
+        '''Query the Enphase API and return the response body'''
+
+        response = self._openQuery(system_id, command, extraParams).read()
+        logging.debug('%s', LazyPayload(response))
         return response
 
     def _filterAttributes(self,attrs,kwargs):
@@ -253,6 +687,27 @@ class RawEnphaseInterface(object):
         logging.debug(r3.info()['enlighten-api-user-id'])
         return r3.info()['enlighten-api-user-id']
 
+    def iter_many(self, method, system_ids, workers=DEFAULT_WORKERS,
+            **kwargs):
+        '''Call the query method named method for many systems at once
+
+            Yields a tuple of the system_id and the result as each query
+            completes.  A failed query yields its exception instead of
+            stopping the others.'''
+
+        query = getattr(self, method)
+        with cf.ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = dict((pool.submit(query, x, **kwargs),x)
+                for x in system_ids)
+            for future in cf.as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as x:
+                    logging.error('%s failed for system %s: %s' %
+                        (method, futures[future], x))
+                    result = x
+                yield futures[future], result
+
     def energy_lifetime(self, system_id, **kwargs):
         '''Get the lifetime energy produced by the system'''
 
@@ -265,8 +720,9 @@ class RawEnphaseInterface(object):
         validArgs = self._filterAttributes(tuple(),kwargs)
         return self._execQuery(system_id, 'envoys', validArgs)
 
-    def index(self, **kwargs):
-        '''List the systems available by this API key'''
+    def index(self, no_cache=False, **kwargs):
+        '''List the systems available by this API key, no_cache asks the
+            api even if a cached list is still fresh'''
 
         sysAttributes = ['system_id', 'system_name', 'status', 'reference',
                             'installer', 'connection_type']
@@ -276,6 +732,8 @@ class RawEnphaseInterface(object):
         if len(uset) > 1:
             for x in uset:
                 validArgs[x+'[]'] = validArgs.pop(x)
+        if no_cache is True:
+            validArgs['no_cache'] = True
 
         return self._execQuery('', '', validArgs)
 
@@ -317,15 +775,57 @@ class JsonEnphaseInterface(RawEnphaseInterface):
     def _execQuery(self, system_id, command, extraParams = dict()):
         data = super(JsonEnphaseInterface,self)._execQuery(system_id,
             command, extraParams)
-        return json.loads(data.decode('UTF-8'))
+        with self.metrics.timer('decode', endpoint=command or 'systems'):
+            return json.loads(data.decode('UTF-8'))
 
-class PandasEnphaseInterface(JsonEnphaseInterface):
-    def _execQuery(self, system_id, command, extraParams = dict()):
+class FrameBuilder(object):
+    '''Builds the DataFrames of api responses, shared by the pandas
+        interfaces and the pipeline's PandasStage
 
-        data = super(PandasEnphaseInterface,self)._execQuery(system_id,
-            command, extraParams)
-        logging.debug(data)
+        Expects dtt, the DateTimeType of the responses, to be set.'''
 
+    #timezone of returned times, None for naive local times
+    tz = None
+    #return frames shrunk by compactFrame
+    compact = False
+    #records the time spent building frames
+    metrics = DEFAULT_METRICS
+
+    def setTimeZone(self, tz):
+        '''Return timezone aware times in tz instead of naive local times'''
+
+        self.tz = tz
+
+    def setCompact(self, compact=True):
+        '''Return frames with the smallest dtypes that hold their values,
+            see compactFrame'''
+
+        self.compact = compact
+
+    def _compact(self, output):
+        if self.compact:
+            return compactFrame(output)
+        return output
+
+    def to_frame(self, command, data):
+        '''The DataFrame of the decoded json the api returned for command,
+            as the queries of the pandas interfaces return it'''
+
+        return self._toFrame(command, data)
+
+    def _toFrame(self, command, data):
+        '''Convert the decoded json for command into a DataFrame'''
+
+        logging.debug('%s', data)
+
+        with self.metrics.timer('normalize', endpoint=command or 'systems'):
+            output = self._buildFrame(command, data)
+
+        indexes = output.index.names
+        output = self._datetimeify(output).set_index(indexes)
+        return self._compact(output)
+
+    def _buildFrame(self, command, data):
         if command == 'energy_lifetime':
             output = self._energy_lifetime(data)
         elif command == 'envoys':
@@ -337,16 +837,14 @@ class PandasEnphaseInterface(JsonEnphaseInterface):
         elif command == 'monthly_production':
             output = self._monthly_production(data)
         elif command == 'rgm_stats':
-            output = self._stats(data)
+            output = self._stats(data, command)
         elif command == 'stats':
-            output = self._stats(data)
+            output = self._stats(data, command)
         elif command == 'summary':
             output = self._summary(data)
         else:
             raise ValueError('datatype parameter not supported')
-
-        indexes = output.index.names
-        return self._datetimeify(output).set_index(indexes)
+        return output
 
     def _energy_lifetime(self,data):
         d = json_normalize(data, 'production',['start_date','system_id'])
@@ -385,86 +883,612 @@ class PandasEnphaseInterface(JsonEnphaseInterface):
                     ['start_date','system_id','end_date','production_wh'])
         return output.set_index(['system_id','start_date','end_date'])
 
-    def _stats(self,data):
+    def _stats(self,data,command='stats'):
         if len(data['intervals']) > 0:
-            output = json_normalize(data,'intervals',
-                ['system_id','total_devices']).set_index(['system_id',
+            output = _cacheLayout(command, json_normalize(data,'intervals',
+                ['system_id','total_devices'])).set_index(['system_id',
                     'end_at'])
         else:
             output = json_normalize(data).set_index('system_id')
         return output
 
+    def _streamStats(self,fp,command='stats'):
+        '''Build the same frame as _stats straight from a response
+
+            The intervals are decoded into column arrays as they are read
+            so the DataFrame is only built once.'''
+
+        decoder = IntervalDecoder(fp)
+        meta = decoder.decode()
+        if decoder.rows == 0:
+            meta['intervals'] = []
+            return self._stats(meta, command)
+
+        output = pd.DataFrame(decoder.arrays())
+        for k in ('system_id','total_devices'):
+            output[k] = meta.get(k)
+        return _cacheLayout(command, output).set_index(['system_id',
+            'end_at'])
+
+    def _statsFrame(self, fp, command='stats', utc=False):
+        '''The DataFrame of a stats or rgm_stats response read from fp,
+            with aware times in UTC instead of tz if utc is True'''
+
+        #decoding reads fp, so this includes reading an unread response
+        with self.metrics.timer('decode', endpoint=command):
+            output = self._streamStats(fp, command)
+        indexes = output.index.names
+        output = self._datetimeify(output, utc).set_index(indexes)
+        return self._compact(output)
+
     def _summary(self,data):
         return json_normalize(data).set_index(['system_id','summary_date'])
 
 
-    def _datetimeify(self,output):
-        output.reset_index(inplace=True)
-        for col in output.columns:
-            if '_at' in col or '_date' in col:
-                output[col] = output[col].apply(
-                    lambda x:self.dtt.datetimeify(col,x))
+    def _datetimeify(self,output,utc=False):
+        tz = 'UTC' if utc else self.tz
+        with self.metrics.timer('datetime'):
+            output.reset_index(inplace=True)
+            for col in output.columns:
+                if '_at' in col or '_date' in col:
+                    output[col] = self.dtt.datetimeifySeries(col, output[col],
+                        tz)
         return output
 
-class CachingEnphaseInterface(PandasEnphaseInterface):
-    def __init__(self, userId, max_wait=DEFAULT_MAX_WAIT,
-            engine = create_engine('sqlite://')):
-        super(CachingEnphaseInterface,self).__init__(
-                userId, max_wait)
-        self.engine = engine
+class PandasEnphaseInterface(FrameBuilder, JsonEnphaseInterface):
+    def _execQuery(self, system_id, command, extraParams = dict()):
+
+        if command in ('stats','rgm_stats'):
+            response = self._openQuery(system_id, command, extraParams)
+            try:
+                return self._statsFrame(response, command)
+            finally:
+                response.close()
+
+        data = super(PandasEnphaseInterface,self)._execQuery(system_id,
+            command, extraParams)
+        return self._toFrame(command, data)
+
+    def _collect(self, results, errors):
+        frames = []
+        for system_id,result in results:
+            if isinstance(result, Exception):
+                if errors is not None:
+                    errors[system_id] = result
+            else:
+                frames.append(result)
+
+        if len(frames) == 0:
+            return pd.DataFrame()
+        return self._compact(concat(frames).sort_index())
+
+    def summaries(self, system_ids, errors=None, **kwargs):
+        '''Get the summary of many systems in one DataFrame
+
+            The systems are queried concurrently, systems that fail are
+            left out and their exceptions stored in the errors dict when
+            one is given.  Use iter_many to get results as they arrive.'''
+
+        return self._collect(self.iter_many('summary', system_ids,
+            **kwargs), errors)
+
+    def stats_many(self, system_ids, start_at=None, end_at=None,
+            errors=None, **kwargs):
+        '''Get the 5 minute interval data of many systems in one DataFrame
+
+            Failures are handled the same as summaries'''
+
+        if start_at is not None:
+            kwargs['start_at'] = start_at
+        if end_at is not None:
+            kwargs['end_at'] = end_at
+        return self._collect(self.iter_many('stats', system_ids, **kwargs),
+            errors)
+
+def _isTime(col):
+    return '_at' in col or '_date' in col
+
+def _cacheLayout(table, frame):
+    '''The columns of a flat stats or rgm_stats frame in the order and, for
+        the values repeated from the top of the response, with the dtypes
+        frames read from the cache have, any others after them'''
+
+    names = [x for x,_ in CACHE_COLUMNS[table]]
+    for col in ('system_id','total_devices'):
+        if col in frame.columns:
+            frame[col] = pd.to_numeric(frame[col])
+    return frame[[x for x in names if x in frame.columns] +
+        [x for x in frame.columns if x not in names]]
+
+def _flatten(table, frame):
+    '''Flatten a frame into the columns of a cache table with times as
+        epoch seconds'''
+
+    names = [x for x,_ in CACHE_COLUMNS[table]]
+    frame = frame.reset_index()
+    frame = frame[[x for x in frame.columns if x in names]]
+    for col in frame.columns:
+        if _isTime(col):
+            frame[col] = toEpoch(frame[col])
+    return frame
+
+def _rollupColumns(table):
+    return ('system_id','start_at') + tuple(x for x,_ in ROLLUPS[table]) + (
+        'intervals',)
+
+def _intervalRows(table, flat):
+    '''Flat intervals of table as rollup rows, a column name to array
+        dict, each starting an interval before its end_at'''
+
+    rows = {'system_id':flat['system_id'].to_numpy(dtype='int64'),
+        'start_at':flat['end_at'].to_numpy(dtype='int64') - INTERVAL}
+    for col,_ in ROLLUPS[table]:
+        rows[col] = flat[col].to_numpy(dtype='float64') if col in \
+            flat.columns else np.full(len(flat), np.nan)
+    rows['intervals'] = np.ones(len(flat))
+    return rows
+
+def _storedRows(table, frame):
+    '''A frame read from a rollup of table as rollup rows'''
+
+    return dict((x, frame[x].to_numpy(dtype='int64' if x in ('system_id',
+        'start_at') else 'float64')) for x in _rollupColumns(table))
+
+def _concatRows(table, parts):
+    return dict((x, np.concatenate([p[x] for p in parts]))
+        for x in _rollupColumns(table))
+
+def _latest(rows):
+    '''rows without those replaced by a later row of the same system and
+        start'''
+
+    n = len(rows['start_at'])
+    order = np.lexsort((np.arange(n), rows['start_at'], rows['system_id']))
+    system_ids = rows['system_id'][order]
+    starts = rows['start_at'][order]
+    last = np.r_[(np.diff(system_ids) != 0) | (np.diff(starts) != 0), True]
+    keep = order[last[:n]]
+    return dict((k, v[keep]) for k,v in rows.items())
+
+def _rollUp(table, rows, starts):
+    '''Aggregate rollup rows of table into the buckets starting at
+        starts'''
+
+    system_ids = rows['system_id']
+    starts = np.asarray(starts, dtype='int64')
+    order = np.lexsort((starts, system_ids))
+    system_ids = system_ids[order]
+    starts = starts[order]
+
+    #the first row of every system and bucket, groupby is several times
+    #slower on the few hundred rows of a write
+    first = np.flatnonzero(np.r_[True, (np.diff(system_ids) != 0) |
+        (np.diff(starts) != 0)])[:len(order)]
+    output = {'system_id':system_ids[first], 'start_at':starts[first]}
+    for col,how in ROLLUPS[table] + (('intervals','sum'),):
+        values = rows[col][order]
+        if len(first) > 0 and how == 'sum':
+            values = np.add.reduceat(np.nan_to_num(values), first)
+        elif len(first) > 0:
+            #fmax skips missing values like pandas does
+            values = np.fmax.reduceat(values, first)
+        output[col] = values
+    return output
+
+def _rollupFrame(rows):
+    '''Rollup rows as a frame, with integer columns where nothing is
+        missing'''
+
+    columns = {}
+    for k,v in rows.items():
+        if v.dtype.kind == 'f' and not np.isnan(v).any():
+            v = v.astype('int64')
+        columns[k] = v
+    return pd.DataFrame(columns)
+
+def _rollups(table, flat):
+    '''Every rollup of the flat intervals of table as (name, frame)'''
+
+    rows = _latest(_intervalRows(table, flat))
+    for freq in ROLLUP_FREQS:
+        rows = _rollUp(table, rows, floorLocal(rows['start_at'], freq))
+        yield rollupTable(table, freq), _rollupFrame(rows)
+
+def _runs(values, gap):
+    '''The (first, last) of the runs of sorted values less than gap apart'''
+
+    breaks = np.flatnonzero(np.diff(values) >= gap)
+    return list(zip(values[np.r_[0, breaks + 1]].tolist(),
+        values[np.r_[breaks, len(values) - 1]].tolist()))
+
+class CacheBackend(object):
+    '''Where CachingEnphaseInterface keeps its tables
+
+        The tables, their columns and keys are those of CACHE_COLUMNS and
+        CACHE_KEYS.  Frames passed to and returned by a backend are flat,
+        one column per field with times as integer epoch seconds.  Rows
+        are looked up by system_id and a range of the second key column.
+
+        Coverage is kept per system and endpoint as the list of merged
+        (lower, upper) ranges of a CoverageIndex.'''
+
+    def read(self, table, system_id, lower=None, upper=None):
+        '''The rows of table for system_id whose second key is between
+            lower and upper inclusive, a bound of None is open'''
+
+        raise NotImplementedError()
+
+    def readMany(self, table, system_ids, lower=None, upper=None):
+        '''The rows of table for every system of system_ids like read,
+            backends able to read them at once should'''
+
+        frames = [self.read(table, x, lower, upper) for x in system_ids]
+        return pd.concat(frames, ignore_index=True)
+
+    def transaction(self):
+        '''A context manager yielding a batch with write(table, frame) and
+            addCoverage(system_id, endpoint, ranges) methods, what is
+            written to the batch is stored when the block exits cleanly
+
+            Added ranges are merged with the coverage stored when the
+            transaction commits, not replace it, so backends shared by
+            several interfaces keep the ranges of each.'''
+
+        raise NotImplementedError()
+
+    def loadCoverage(self, system_id, endpoint):
+        '''The stored (lower, upper) ranges of system_id and endpoint'''
+
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+class SqlCacheBatch(object):
+    '''The writes of one SqlCacheBackend transaction'''
+
+    def __init__(self, batch):
+        self.batch = batch
+
+    def write(self, table, frame):
+        self.batch.write(table, frame, CACHE_KEYS[table])
+
+    def addCoverage(self, system_id, endpoint, ranges):
+        '''Merge ranges into the stored coverage of system_id and endpoint,
+            the stored rows are read inside the transaction'''
+
+        key = (system_id, endpoint)
+        merged = IntervalSet(self.batch.fetchall('select lower, upper from '
+            'coverage where system_id = ? and endpoint = ?', key))
+        for lower,upper in ranges:
+            merged.add(lower, upper)
+        self.batch.execute('delete from coverage where system_id = ? and '
+            'endpoint = ?', key)
+        self.batch.executemany('coverage', ('system_id','endpoint','lower',
+            'upper'), [key + (l, u) for l,u in merged],
+            CACHE_KEYS['coverage'])
+
+class SqlCacheBackend(CacheBackend):
+    '''Keeps the cache tables in a SQLAlchemy engine
 
-        self.createTables()
+        Writes are executemany upserts through a BulkWriter, tables of an
+        older schema found in the database are migrated when the backend
+        is created.
+
+        The engine is used by one thread at a time.  An in memory
+        database is a single connection shared by every thread, a commit
+        or rollback of one would end the transaction of another.'''
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.writer = BulkWriter(engine)
+        self._lock = threading.RLock()
+
+        with self._lock:
+            self.createTables()
+
+    @contextlib.contextmanager
+    def _connection(self):
+        '''A raw connection no other thread uses until the block exits'''
+
+        with self._lock:
+            con = self.engine.raw_connection()
+            try:
+                yield con
+            finally:
+                con.close()
+
+    def _execute(self, statements):
+        '''Run a list of (sql, params) in a single transaction'''
+
+        with self._connection() as con:
+            try:
+                cur = con.cursor()
+                for q,params in statements:
+                    cur.execute(q, params)
+                con.commit()
+            except:
+                con.rollback()
+                raise
+
+    def _fetchall(self, q, params=()):
+        with self._connection() as con:
+            cur = con.cursor()
+            cur.execute(q, params)
+            return cur.fetchall()
+
+    def _frame(self, q, params=()):
+        '''The rows of a query as a DataFrame, like pd.read_sql without
+            its warning about raw DBAPI connections'''
+
+        with self._connection() as con:
+            cur = con.cursor()
+            cur.execute(q, params)
+            return pd.DataFrame.from_records(cur.fetchall(),
+                columns=[x[0] for x in cur.description], coerce_float=True)
+
+    def _tables(self):
+        q = "select name from sqlite_master where type = 'table'"
+        return set(x[0] for x in self._fetchall(q))
+
+    def schemaVersion(self):
+        '''The version of the cache schema in the database, 0 if empty'''
+
+        tables = self._tables()
+        if 'schema_version' in tables:
+            return self._fetchall('select version from schema_version')[0][0]
+        if 'stats' in tables:
+            #the original layout was not versioned
+            return 1
+        return 0
 
     def createTables(self):
+        '''Create the cache tables, migrating an older layout if found
+
+            Times are stored as integer epoch seconds and dates as the
+            epoch of local midnight.  Every table is keyed on system_id
+            first so range reads for a system are index seeks.'''
+
+        version = self.schemaVersion()
+        if version == SCHEMA_VERSION:
+            return
+        if version > SCHEMA_VERSION:
+            raise ValueError('Cache schema version %d is newer than %d' %
+                (version, SCHEMA_VERSION))
 
         t = {}
 
         t['stats']      = '''CREATE TABLE stats (
-                            [system_id] INTEGER,
-                            [end_at] TEXT UNIQUE ON CONFLICT IGNORE,
+                            [system_id] INTEGER NOT NULL,
+                            [end_at] INTEGER NOT NULL,
                             [devices_reporting] INTEGER,
                             [enwh] INTEGER,
                             [powr] INTEGER,
-                            [total_devices] INTEGER)'''
+                            [total_devices] INTEGER,
+                            PRIMARY KEY (system_id, end_at)
+                                ON CONFLICT IGNORE) WITHOUT ROWID'''
         t['rgm_stats']  = '''CREATE TABLE rgm_stats (
-                            [system_id] INTEGER,
-                            [end_at] TEXT UNIQUE ON CONFLICT IGNORE,
+                            [system_id] INTEGER NOT NULL,
+                            [end_at] INTEGER NOT NULL,
                             [devices_reporting] INTEGER,
                             [wh_del] INTEGER,
-                            [total_devices] INTEGER)'''
+                            [total_devices] INTEGER,
+                            PRIMARY KEY (system_id, end_at)
+                                ON CONFLICT IGNORE) WITHOUT ROWID'''
         t['summary']    = '''CREATE TABLE summary (
-                            [system_id] INTEGER,
-                            [summary_date] TEXT UNIQUE ON CONFLICT IGNORE,
+                            [system_id] INTEGER NOT NULL,
+                            [summary_date] INTEGER NOT NULL,
                             [current_power] INTEGER,
                             [energy_lifetime] INTEGER,
                             [energy_today] INTEGER,
-                            [last_report_at] TEXT,
+                            [last_report_at] INTEGER,
                             [modules] INTEGER,
-                            [operational_at] TEXT,
+                            [operational_at] INTEGER,
                             [size_w] INTEGER,
                             [source] TEXT,
-                            [status] TEXT)'''
+                            [status] TEXT,
+                            PRIMARY KEY (system_id, summary_date)
+                                ON CONFLICT IGNORE) WITHOUT ROWID'''
         t['envoys']     = '''CREATE TABLE envoys (
-                            [system_id] INTEGER,
-                            [serial_number] TEXT,
+                            [system_id] INTEGER NOT NULL,
+                            [serial_number] TEXT NOT NULL,
                             [envoy_id] INTEGER,
-                            [last_report_at] TEXT,
+                            [last_report_at] INTEGER,
                             [name] TEXT,
                             [part_number] TEXT,
-                            [status] TEXT)'''
-        t['metastats']  = '''CREATE TABLE metastats (
-                            [system_id] INT,
-                            [obs_date] TEXT UNIQUE ON CONFLICT REPLACE,
-                            [obs_type] TEXT)'''
-        t['metargm_stats']='''CREATE TABLE metargm_stats (
-                            [system_id] INT,
-                            [obs_date] TEXT UNIQUE ON CONFLICT REPLACE,
-                            [obs_type] TEXT)'''
-
-        with self.engine.connect() as con:
-            for k,v in t.items():
-                if not self.engine.has_table(k):
-                    con.execute(v)
+                            [status] TEXT,
+                            PRIMARY KEY (system_id, serial_number)
+                                ON CONFLICT REPLACE) WITHOUT ROWID'''
+        t['coverage']   = '''CREATE TABLE coverage (
+                            [system_id] INTEGER NOT NULL,
+                            [endpoint] TEXT NOT NULL,
+                            [lower] INTEGER NOT NULL,
+                            [upper] INTEGER NOT NULL,
+                            PRIMARY KEY (system_id, endpoint, lower))
+                                WITHOUT ROWID'''
+        for k in CACHE_KEYS:
+            if k not in t:
+                t[k] = '''CREATE TABLE %s (%s,
+                            PRIMARY KEY (system_id, start_at)) WITHOUT ROWID
+                            ''' % (k, ','.join('[%s] INTEGER%s' % (c,
+                    ' NOT NULL' if c in CACHE_KEYS[k] else '')
+                    for c,_ in CACHE_COLUMNS[k]))
+
+        old = []
+        statements = []
+        tables = self._tables()
+        for k in list(t.keys()) + ['metastats','metargm_stats',
+                'schema_version']:
+            if k in tables:
+                old.append(k)
+                statements.append(('ALTER TABLE %s RENAME TO %s_old' %
+                    (k,k), ()))
+
+        statements.extend((v,()) for v in t.values())
+        statements.append(('CREATE TABLE schema_version ([version] INTEGER)',
+            ()))
+        statements.append(('INSERT INTO schema_version VALUES (?)',
+            (SCHEMA_VERSION,)))
+        self._execute(statements)
+
+        if version > 0:
+            self._migrate(version, old)
+
+    def _migrate(self, version, tables):
+        '''Copy the tables of an older schema, renamed to *_old, into the
+            current one and drop them
+
+            Version 1 stored times as text, versions before 3 tracked
+            cached days in the metastats and metargm_stats tables and
+            versions before 4 had no rollups, they are built from the
+            copied intervals.'''
+
+        logging.info('Migrating the cache from schema version %d' % version)
+        for k in tables:
+            frame = self._frame('select * from %s_old' % k)
+            frame = frame.drop(columns=['index'], errors='ignore')
+
+            if k.startswith('meta'):
+                self._migrateMeta(k[4:], version, frame)
+            elif k in CACHE_KEYS:
+                if version == 1:
+                    frame = _flatten(k, frame)
+                self.writer.write(k, frame, CACHE_KEYS[k])
+                if version < 4 and k in ROLLUPS:
+                    for name,rows in _rollups(k, frame):
+                        self.writer.write(name, rows, CACHE_KEYS[name])
+            self._execute([('DROP TABLE %s_old' % k, ())])
+
+    def _migrateMeta(self, endpoint, version, frame):
+        '''Turn the full days of a meta table into coverage ranges'''
+
+        frame = frame[frame['obs_type'] == 'full']
+        if version == 1:
+            days = toEpoch(to_datetime(frame['obs_date']))
+        else:
+            days = frame['obs_date'].to_numpy()
+
+        sets = {}
+        for system_id,day in zip(frame['system_id'].tolist(), days.tolist()):
+            lower,upper = CoverageIndex.requestRange(day, day + 86400)
+            sets.setdefault(system_id, IntervalSet()).add(lower, upper)
+
+        with self.transaction() as batch:
+            for system_id,ranges in sets.items():
+                batch.addCoverage(system_id, endpoint, list(ranges))
+
+    def read(self, table, system_id, lower=None, upper=None):
+        q = 'select * from %s where system_id = ?' % table
+        params = [system_id]
+        key = CACHE_KEYS[table][1]
+        if lower is not None:
+            q += ' and %s >= ?' % key
+            params.append(lower)
+        if upper is not None:
+            q += ' and %s <= ?' % key
+            params.append(upper)
+
+        return self._frame(q, params)
+
+    def readMany(self, table, system_ids, lower=None, upper=None):
+        key = CACHE_KEYS[table][1]
+        system_ids = list(system_ids)
+        frames = []
+        #stay under the 999 variables older SQLite allows a statement
+        for i in range(0, max(len(system_ids), 1), SQL_MAX_SYSTEMS):
+            chunk = system_ids[i:i+SQL_MAX_SYSTEMS]
+            q = 'select * from %s where system_id in (%s)' % (table,
+                ','.join('?'*len(chunk)))
+            params = list(chunk)
+            if lower is not None:
+                q += ' and %s >= ?' % key
+                params.append(lower)
+            if upper is not None:
+                q += ' and %s <= ?' % key
+                params.append(upper)
+
+            frames.append(self._frame(q, params))
+        return pd.concat(frames, ignore_index=True)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self._lock, self.writer.transaction() as batch:
+            yield SqlCacheBatch(batch)
+
+    def loadCoverage(self, system_id, endpoint):
+        q = '''select lower, upper from coverage where system_id = ? and
+                endpoint = ? order by lower'''
+        return self._fetchall(q, (system_id, endpoint))
+
+class CachingEnphaseInterface(PandasEnphaseInterface):
+    def __init__(self, userId, max_wait=DEFAULT_MAX_WAIT,
+            engine=None, pool=DEFAULT_POOL,
+            workers=DEFAULT_WORKERS, batch_size=DEFAULT_BATCH_SIZE,
+            memory=None, backend=None, flights=None, rollup_lock=None):
+        '''Missing days are fetched by up to workers threads at once and
+            written to the cache batch_size days per transaction
+
+            The cache is kept by backend, a CacheBackend, which defaults
+            to a SqlCacheBackend on engine, a new in memory database if
+            none is given.  Frames read from the cache
+            are also kept in memory, a MemoryCache, so repeated requests
+            skip the backend.
+
+            Threads asking for the same data at the same time share one
+            lookup, fetch and write through flights, a SingleFlight.  Pass
+            the same one to interfaces on the same backend to share it
+            between them.
+
+            Hourly, daily and monthly rollups of stats and rgm_stats are
+            updated in the transaction writing their intervals and read by
+            rollup.  Interfaces writing intervals of the same systems to
+            one backend should share rollup_lock, a threading.Lock.'''
+
+        super(CachingEnphaseInterface,self).__init__(
+                userId, max_wait, pool=pool)
+        if backend is None:
+            if engine is None:
+                engine = create_engine('sqlite://', poolclass=StaticPool,
+                    connect_args={'check_same_thread':False})
+            backend = SqlCacheBackend(engine)
+        self.backend = backend
+        self.memory = memory if memory is not None else MemoryCache()
+        self.workers = workers
+        self.batch_size = batch_size
+        self.coverage = CoverageIndex(self.backend.loadCoverage)
+        self.flights = flights if flights is not None else SingleFlight()
+        self.rollup_lock = rollup_lock if rollup_lock is not None else \
+            threading.Lock()
+
+    def _write(self, table, frame):
+        '''Upsert a frame into a cache table'''
+
+        frame = _flatten(table, frame)
+        with self.metrics.timer('cache_write', table=table), self.rollup_lock:
+            rollups = self._rollups(table, [frame])
+            with self.backend.transaction() as batch:
+                batch.write(table, frame)
+                for name,rows in rollups:
+                    batch.write(name, rows)
+
+    def _read(self, table, system_id, lower=None, upper=None, exclude=(),
+            utc=False):
+        '''Read from a cache table, converting epochs back to times, in
+            UTC if utc is True, and leaving out the rows whose key is in
+            one of the [lower, upper) ranges of exclude'''
+
+        with self.metrics.timer('cache_read', table=table):
+            frame = self.backend.read(table, system_id, lower, upper)
+        if len(exclude) > 0 and len(frame) > 0:
+            keys = frame[CACHE_KEYS[table][1]].to_numpy()
+            keep = np.ones(len(frame), dtype=bool)
+            for l,u in exclude:
+                keep &= (keys < l) | (keys >= u)
+            frame = frame[keep]
+        for col in frame.columns:
+            if _isTime(col):
+                frame[col] = fromEpoch(frame[col], 'UTC' if utc else self.tz)
+        return self._compact(frame.set_index(list(CACHE_KEYS[table])))
 
     def summary(self, system_id, no_cache = False, **kwargs):
         '''Get the system summary'''
@@ -473,94 +1497,507 @@ class CachingEnphaseInterface(PandasEnphaseInterface):
             summary = super(CachingEnphaseInterface,self)._execQuery(
                 system_id,'summary',kwargs)
         else:
-            q = 'select * from summary where system_id = ? and summary_date = ?'
-
             #summary_date defaults to midnight local time today
             default_date = dt.datetime.combine(dt.date.today(),dt.time(0))
             summary_date = kwargs.get('summary_date',default_date)
-            params = (system_id,summary_date.isoformat())
+            params = (system_id,int(summary_date.timestamp()))
+
+            key = ('summary',) + params
+            summary = self._shared(key + flightKey(kwargs, ('summary_date',)),
+                self._loadSummary, system_id, summary_date, key, kwargs)
+
+        return summary
+
+    def _remembered(self, key):
+        '''The frame the memory tier holds for key, counting hits'''
+
+        frame = self.memory.get(key)
+        self.metrics.count('cache', tier='memory', endpoint=key[0],
+            result='miss' if frame is None else 'hit')
+        return frame
+
+    def _countBackend(self, endpoint, hit):
+        self.metrics.count('cache', tier='backend', endpoint=endpoint,
+            result='hit' if hit else 'miss')
+
+    def _loadSummary(self, system_id, summary_date, key, kwargs):
+        summary = self._remembered(key)
+        if summary is not None:
+            return summary
 
-            with self.engine.connect() as con:
-                summary = pd.read_sql(
-                        q, 
-                        con.connection, 
-                        index_col=['system_id','summary_date'], 
-                        parse_dates=['summary_date'],
-                        params = params)
+        summary = self._read('summary', system_id, key[2], key[2])
 
-                if len(summary) < 1:
-                    summary = super(CachingEnphaseInterface,self)._execQuery(
-                        system_id,'summary',kwargs)
+        self._countBackend('summary', len(summary) > 0)
+        if len(summary) < 1:
+            summary = super(CachingEnphaseInterface,self)._execQuery(
+                system_id,'summary',kwargs)
 
-                    summary.to_sql('summary',con.connection, if_exists='append')
+            self._write('summary', summary)
 
+        dayEnd = summary_date + dt.timedelta(days=1)
+        self.memory.put(key, summary, self._ttl(dayEnd))
         return summary
 
-    def _istats(self, system_id, table, kwargs):
+    def _shared(self, key, fn, *args):
+        '''Call fn(*args) once for every thread asking for key at the same
+            time, the threads that joined a running call get a copy of
+            its frame'''
 
-        midnight = dt.datetime.combine(dt.date.today(),dt.time(0))
-        start_at = kwargs.get('start_at',midnight)
-        end_at   = kwargs.get('end_at',dt.datetime.now())
-        params = (system_id,start_at.isoformat(),end_at.isoformat())
+        frame,shared = self.flights.do(key, fn, *args)
+        if shared:
+            return frame.copy()
+        return frame
 
-        no_cache = kwargs.get('no_cache',False)
+    @staticmethod
+    def _ttl(end_at):
+        '''How long the memory tier may keep data reaching up to end_at,
+            data that is complete never expires'''
 
-        if no_cache == True:
-            return super(CachingEnphaseInterface,self)._execQuery(
-                system_id,table,kwargs)
+        if end_at.timestamp() > time.time() - INTERVAL:
+            return DEFAULT_LIVE_TTL
 
-        q = '''select * from %s where system_id = ? and 
-                end_at between ? and ?''' % table
+    def cacheStats(self):
+        '''Hit and miss statistics of the memory tier'''
 
-        with self.engine.connect() as con:
-            stats = pd.read_sql(
-                    q, 
-                    con.connection, 
-                    params = params,
-                    index_col=['system_id','end_at'],
-                    parse_dates=['end_at'])
+        return self.memory.stats()
 
-        q = '''select * from %s where system_id = ?''' % ('meta'+table)
-        with self.engine.connect() as con:
-            result = con.execute(q, (system_id,)).fetchall()
+    def _addCoverage(self, system_id, endpoint, ranges):
+        '''Add ranges to the coverage index, once they are committed'''
 
-        condition = lambda x:x[2] == 'full' and x[0] == system_id
-        observedDates = set([x[1] for x in result if condition(x)])
+        for lower,upper in ranges:
+            self.coverage.add(system_id, endpoint, lower, upper)
 
-        datetimes = pd.DatetimeIndex(start=start_at,end=end_at,freq='D')
-        requestedDates = set([x.date().isoformat() for x in datetimes])
+    def _covered(self, lower, upper, tstats):
+        '''The part of a requested [lower, upper) range that is complete
 
-        daysToFetch = requestedDates - observedDates
+            Ranges before today are complete once fetched, today only up
+            to the newest interval the system has reported.'''
 
-        if len(daysToFetch) > 0:
-            kwargs.pop('end_at',0)
-            results = [stats]
-            for day in daysToFetch:
-                start_at = dt.datetime.combine(pd.Timestamp(day),dt.time(0))
-                logging.debug('Fetching %s'%start_at.isoformat())
-                kwargs['start_at'] = start_at
+        midnight = dt.datetime.combine(dt.date.today(),dt.time(0))
+        if upper <= midnight.timestamp() + INTERVAL:
+            return lower, upper
+        if 'intervals' in tstats.columns or len(tstats) == 0:
+            return lower, lower
+
+        newest = tstats.index.get_level_values('end_at').max()
+        newest = int(toEpoch(Series([newest]))[0])
+        return lower, min(upper, newest + INTERVAL)
+
+    def _storeRanges(self, system_id, table, fetched):
+        '''Write a batch of fetched ranges and their coverage to the cache
+            in a single transaction'''
+
+        frames = []
+        covered = []
+        for (lower,upper),tstats in fetched:
+            covered.append(self._covered(lower, upper, tstats))
+            if 'intervals' not in tstats.columns:
+                frames.append(_flatten(table, tstats))
+
+        with self.metrics.timer('cache_write', table=table), self.rollup_lock:
+            rollups = self._rollups(table, frames)
+            with self.backend.transaction() as batch:
+                for frame in frames:
+                    batch.write(table, frame)
+                for name,rows in rollups:
+                    batch.write(name, rows)
+                batch.addCoverage(system_id, table, covered)
+            #a failed write must not leave the index claiming its ranges
+            self._addCoverage(system_id, table, covered)
+
+    def _rollups(self, table, frames):
+        '''The rollup rows of the buckets the flat frames of table touch
+            as (name, frame), to be written with the frames
+
+            Each level is aggregated from the one below it, the stored
+            rows of the touched buckets are read back and the new rows
+            laid over them, so writing the same intervals again leaves the
+            rollups as they were.  Call it holding rollup_lock, before the
+            transaction writing the frames.'''
+
+        frames = [x for x in frames if len(x) > 0]
+        if table not in ROLLUPS or len(frames) == 0:
+            return []
+
+        output = []
+        rows = _concatRows(table, [_intervalRows(table, x) for x in frames])
+        source = table
+        for freq in ROLLUP_FREQS:
+            starts = floorLocal(rows['start_at'], freq)
+            stored = self._readBuckets(table, source, rows['system_id'],
+                starts, freq)
+            rows = _latest(_concatRows(table, stored + [rows]))
+            rows = _rollUp(table, rows, floorLocal(rows['start_at'], freq))
+            source = rollupTable(table, freq)
+            output.append((source, _rollupFrame(rows)))
+        return output
+
+    def _readBuckets(self, table, source, system_ids, starts, freq):
+        '''The stored rows of source, table or one of its rollups, in the
+            freq buckets starting at starts of system_ids as a list of
+            rollup rows.  Buckets less than a day apart are read at once.'''
+
+        frames = []
+        for system_id in np.unique(system_ids).tolist():
+            buckets = np.unique(starts[system_ids == system_id])
+            for first,last in _runs(buckets, MAX_RANGE):
+                upper = int(nextBucket([last], freq)[0])
+                if source == table:
+                    frames.append(_intervalRows(table, self.backend.read(
+                        table, system_id, first + INTERVAL, upper)))
+                else:
+                    frames.append(_storedRows(table, self.backend.read(
+                        source, system_id, first, upper - 1)))
+        return frames
 
-                tstats = super(CachingEnphaseInterface,self)._execQuery(
-                    system_id,table,kwargs)
+    def rebuildRollups(self, system_id, table='stats'):
+        '''Build the rollups of a system's cached intervals from scratch,
+            for caches written before rollups were kept'''
 
-                if start_at >= midnight:
-                    params = (system_id, start_at.date().isoformat(),'partial')
+        with self.rollup_lock:
+            flat = self.backend.read(table, system_id)
+            with self.backend.transaction() as batch:
+                for name,rows in _rollups(table, flat):
+                    batch.write(name, rows)
+
+    @staticmethod
+    def _pieces(lower, upper, freqs):
+        '''Split [lower, upper) into the ranges of whole buckets of the
+            coarsest of freqs each spans, as (freq, lower, upper) with a
+            freq of None for the intervals left at the edges'''
+
+        if lower >= upper:
+            return []
+        if len(freqs) == 0:
+            return [(None, lower, upper)]
+
+        first = int(ceilLocal([lower], freqs[0])[0])
+        last = int(floorLocal([upper], freqs[0])[0])
+        if first >= last:
+            return CachingEnphaseInterface._pieces(lower, upper, freqs[1:])
+        return (CachingEnphaseInterface._pieces(lower, first, freqs[1:]) +
+            [(freqs[0], first, last)] +
+            CachingEnphaseInterface._pieces(last, upper, freqs[1:]))
+
+    def rollup(self, system_ids, start_at, end_at=None, freq='daily',
+            table='stats'):
+        '''Totals of the cached intervals of table from start_at to
+            end_at for each system of system_ids, one system_id or many,
+            per local hour, day or month by freq, 'hourly', 'daily' or
+            'monthly', or over the whole range if freq is None
+
+            enwh, or wh_del for rgm_stats, is summed, powr is the highest
+            and intervals counts the intervals summed.  Every part of the
+            range is read from the coarsest rollup whose buckets it spans
+            whole, finer rollups and the intervals themselves only at its
+            edges, so a year of monthly totals is twelve rows a system and
+            a fleet is read a rollup at a time.  Only cached intervals are
+            counted, fetch them first with stats or a SyncService and
+            compare intervals with the length of the range for gaps.'''
+
+        if end_at is None:
+            end_at = dt.datetime.now()
+        if np.ndim(system_ids) == 0:
+            system_ids = [system_ids]
+        system_ids = [int(x) for x in system_ids]
+
+        #whole intervals only, starting at or after start_at and ending
+        #at or before end_at
+        lower = -(-int(start_at.timestamp())//INTERVAL)*INTERVAL
+        upper = int(end_at.timestamp())//INTERVAL*INTERVAL
+        freqs = ROLLUP_FREQS if freq is None else \
+            ROLLUP_FREQS[:ROLLUP_FREQS.index(freq) + 1]
+
+        parts = [_intervalRows(table, pd.DataFrame({'system_id':[],
+            'end_at':[]}))]
+        with self.metrics.timer('cache_read', table=rollupTable(table,
+                freq or 'total')):
+            for level,first,last in self._pieces(lower, upper, freqs[::-1]):
+                if level is None:
+                    parts.append(_intervalRows(table, self.backend.readMany(
+                        table, system_ids, first + INTERVAL, last)))
                 else:
-                    params = (system_id, start_at.date().isoformat(),'full')
+                    parts.append(_storedRows(table, self.backend.readMany(
+                        rollupTable(table, level), system_ids, first,
+                        last - 1)))
+
+        rows = _concatRows(table, parts)
+        if freq is None:
+            starts = np.full(len(rows['start_at']), lower)
+        else:
+            starts = floorLocal(rows['start_at'], freq)
+
+        #sorted on system_id and start_at
+        output = _rollupFrame(_rollUp(table, rows, starts))
+        output['start_at'] = fromEpoch(output['start_at'], self.tz)
+        if freq is None:
+            return output.drop(columns=['start_at']).set_index('system_id')
+        return output.set_index(['system_id','start_at'])
+
+    def store(self, table, frame):
+        '''Write a frame a query returned, such as a summary, to the cache
+            table of its endpoint
+
+            Intervals written this way are not marked as covered, store
+            them with storePolled.'''
+
+        self._write(table, frame)
+
+    def storePolled(self, stats, envoys=(), rgm_stats=()):
+        '''Write stats, envoys and rgm_stats frames read from somewhere
+            other than the api, such as an Envoy, to the cache in one
+            transaction
+
+            Every interval in stats and rgm_stats is marked as covered so
+            it is served from the cache, and the memory tier of the
+            systems is dropped.  Naive times are read as local times, only
+            aware times tell the hour repeated when daylight saving ends
+            from the hour before.'''
+
+        intervals = {'stats':list(stats), 'rgm_stats':list(rgm_stats)}
+        coverage = {}
+        for table,frames in intervals.items():
+            for frame in frames:
+                ends = toEpoch(Series(frame.index.get_level_values('end_at')))
+                systems = frame.index.get_level_values('system_id')
+                for system_id,end in zip(systems.tolist(), ends.tolist()):
+                    coverage.setdefault((system_id, table), []).append(
+                        (int(end), int(end) + INTERVAL))
+
+        flat = dict((k, [_flatten(k, x) for x in v])
+            for k,v in intervals.items())
+        with self.metrics.timer('cache_write', table='stats'), \
+                self.rollup_lock:
+            rollups = [x for k,v in flat.items() for x in self._rollups(k, v)]
+            with self.backend.transaction() as batch:
+                for table,frames in flat.items():
+                    for frame in frames:
+                        batch.write(table, frame)
+                for name,rows in rollups:
+                    batch.write(name, rows)
+                for frame in envoys:
+                    batch.write('envoys', _flatten('envoys', frame))
+                for (system_id,table),r in coverage.items():
+                    batch.addCoverage(system_id, table, r)
+            for (system_id,table),r in coverage.items():
+                self._addCoverage(system_id, table, r)
+
+        polled = set(k[0] for k in coverage)
+        polled.update(x for frame in envoys
+            for x in frame.index.get_level_values('system_id').tolist())
+        self.memory.invalidate(lambda k:k[0] in ('stats','rgm_stats',
+            'envoys') and k[1] in polled)
+
+    def _backfill(self, system_id, table, kwargs, ranges, progress=None,
+            utc=False):
+        '''Fetch the given [lower, upper) ranges concurrently, yielding
+            each range's frame, with aware UTC times if utc is True
+
+            Ranges are committed to the cache batch_size at a time along
+            with their coverage, so an interrupted backfill resumes from
+            the last committed batch.'''
+
+        def fetch(r):
+            start_at,end_at = self.coverage.queryRange(*r)
+            rangeArgs = dict(kwargs)
+            rangeArgs['start_at'] = dt.datetime.fromtimestamp(start_at)
+            rangeArgs['end_at'] = dt.datetime.fromtimestamp(end_at)
+            logging.debug('Fetching %s'%rangeArgs['start_at'].isoformat())
+            if not utc:
+                return super(CachingEnphaseInterface,self)._execQuery(
+                    system_id,table,rangeArgs)
+            response = self._openQuery(system_id, table, rangeArgs)
+            try:
+                return self._statsFrame(response, table, utc=True)
+            finally:
+                response.close()
+
+        done = 0
+        batch = []
+        with cf.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = dict((pool.submit(fetch, x),x) for x in ranges)
+            try:
+                for future in cf.as_completed(futures):
+                    batch.append((futures[future],future.result()))
+                    done += 1
+                    if progress is not None:
+                        progress(done, len(ranges))
+
+                    if len(batch) >= self.batch_size:
+                        self._storeRanges(system_id, table, batch)
+                        for _,tstats in batch:
+                            yield tstats
+                        batch = []
+            except:
+                for future in futures:
+                    future.cancel()
+                if len(batch) > 0:
+                    self._storeRanges(system_id, table, batch)
+                raise
+
+        if len(batch) > 0:
+            self._storeRanges(system_id, table, batch)
+            for _,tstats in batch:
+                yield tstats
+
+    def _localize(self, frame):
+        '''Convert the UTC times of a frame to the times of tz, naive
+            local times if it is None'''
+
+        indexes = frame.index.names
+        frame = frame.reset_index()
+        for col in frame.columns:
+            if _isTime(col):
+                frame[col] = fromEpoch(Series(toEpoch(frame[col]),
+                    index=frame.index, name=col), self.tz)
+        return frame.set_index(indexes)
+
+    @staticmethod
+    def _split(gaps):
+        '''Split gaps into ranges a single request can return'''
+
+        output = []
+        for lower,upper in gaps:
+            while lower < upper:
+                output.append((lower, min(upper, lower + MAX_RANGE)))
+                lower += MAX_RANGE
+        return output
 
-                with self.engine.connect() as con:
-                    q = '''insert into %s values (?,?,?)'''%('meta'+table)
-                    con.execute(q,params)
-                    if 'intervals' in tstats.columns:
-                        continue
-                    tstats.to_sql(table,con.connection, if_exists='append')
+    def _istats(self, system_id, table, kwargs, remember=True):
+        '''The intervals of table in the range of kwargs, from the memory
+            tier, the backend and the api in that order.  The result is
+            kept in the memory tier when remember is True.'''
 
-                results.append(tstats)
-            stats = pd.concat(results).drop_duplicates()
+        midnight = dt.datetime.combine(dt.date.today(),dt.time(0))
+        start_at = kwargs.get('start_at',midnight)
+        end_at   = kwargs.get('end_at',dt.datetime.now())
+        params = (system_id,int(start_at.timestamp()),int(end_at.timestamp()))
+
+        no_cache = kwargs.pop('no_cache',False)
+        progress = kwargs.pop('progress',None)
+
+        if no_cache == True:
+            return super(CachingEnphaseInterface,self)._execQuery(
+                system_id,table,kwargs)
+
+        #stats only changes on interval boundaries so round the range
+        #onto them, the start up and the end down
+        key = (table, system_id, -(-params[1]//INTERVAL)*INTERVAL,
+            params[2]//INTERVAL*INTERVAL)
+        return self._shared(key + (remember,) + flightKey(kwargs,
+            ('start_at','end_at')), self._loadStats, system_id, table,
+            kwargs, params, key, end_at, progress, remember)
+
+    def _loadStats(self, system_id, table, kwargs, params, key, end_at,
+            progress, remember):
+        if remember:
+            stats = self._remembered(key)
+            if stats is not None:
+                return stats
+
+        lower,upper = self.coverage.requestRange(params[1], params[2])
+        gaps = self.coverage.gaps(system_id, table, lower, upper)
+        self._countBackend(table, len(gaps) == 0)
+
+        #naive local times of the hour repeated when daylight saving ends
+        #would be written over and sorted into the hour before, so the
+        #rows are merged in UTC.  Iso8601 times with an offset come back
+        #in UTC anyway.  The gaps are fetched whole, the rows read are
+        #the ones outside them.
+        utc = len(gaps) > 0 and self.dtt is not DateTimeType.Iso8601
+        stats = self._read(table, system_id, params[1], params[2], gaps,
+            utc)
+
+        if len(gaps) > 0:
+            kwargs.pop('start_at',0)
+            kwargs.pop('end_at',0)
+            #leave out empty frames so they do not widen the dtypes
+            results = [stats] if len(stats) > 0 else []
+            results.extend(x for x in self._backfill(system_id, table, kwargs,
+                self._split(gaps), progress, utc)
+                if 'intervals' not in x.columns)
+            if len(results) > 0:
+                stats = pd.concat(results).sort_index()
+            if utc:
+                stats = self._localize(stats)
+
+        if remember:
+            self.memory.put(key, stats, self._ttl(end_at))
         return stats
 
+    @staticmethod
+    def _chunkEdges(start_at, end_at, chunk):
+        #anchor the chunks on midnight so they fall on calendar boundaries
+        edges = pd.date_range(pd.Timestamp(start_at).normalize(), end_at,
+            freq=chunk).to_pydatetime()
+        edges = [start_at] + [x for x in edges if start_at < x < end_at]
+        return edges + [end_at]
+
+    def _iterStats(self, system_id, table, start_at, end_at, chunk, kwargs):
+        '''Yield the intervals of table between start_at and end_at in
+            chunks
+
+            Chunks are read a window of about workers days at a time so
+            the days missing from the cache are still fetched
+            concurrently, only one window is held in memory at once.'''
+
+        edges = self._chunkEdges(start_at, end_at, chunk)
+        seconds = [int(x.timestamp()) for x in edges]
+        span = MAX_RANGE * self.workers
+
+        #the end of the last yielded row, windows share their edges
+        last = seconds[0] - 1
+        i = 0
+        while i < len(edges) - 1:
+            j = i + 1
+            while j < len(edges) - 1 and seconds[j] - seconds[i] < span:
+                j += 1
+
+            windowArgs = dict(kwargs)
+            windowArgs['start_at'] = edges[i]
+            windowArgs['end_at'] = edges[j]
+            stats = self._istats(system_id, table, windowArgs, remember=False)
+
+            if len(stats) > 0:
+                ends = toEpoch(Series(stats.index.get_level_values('end_at')))
+                for k in range(i + 1, j + 1):
+                    lo = np.searchsorted(ends, last, 'right')
+                    hi = np.searchsorted(ends, seconds[k], 'right')
+                    last = max(last, seconds[k])
+                    if hi > lo:
+                        yield stats.iloc[lo:hi]
+            last = max(last, seconds[j])
+            i = j
+
+    def iter_stats(self, system_id, start_at, end_at=None, chunk='1D',
+            **kwargs):
+        '''Yield the 5 minute interval data from start_at to end_at as
+            DataFrames covering at most chunk each, a pandas frequency
+
+            Chunks come in time order without repeating intervals, only
+            a few days of intervals are held in memory at a time however
+            long the range.'''
+
+        if end_at is None:
+            end_at = dt.datetime.now()
+        return self._iterStats(system_id, 'stats', start_at, end_at, chunk,
+            kwargs)
+
+    def iter_rgm_stats(self, system_id, start_at, end_at=None, chunk='1D',
+            **kwargs):
+        '''Yield the Revenue Grade Meter stats in chunks like iter_stats'''
+
+        if end_at is None:
+            end_at = dt.datetime.now()
+        return self._iterStats(system_id, 'rgm_stats', start_at, end_at,
+            chunk, kwargs)
+
     def stats(self, system_id, **kwargs):
-        '''Get the 5 minute interval data for the given day'''
+        '''Get the 5 minute interval data for the given day
+
+            Ranges missing from the cache are fetched concurrently, pass
+            progress=callable to be called with the requests done and
+            total'''
 
         return self._istats(system_id, 'stats', kwargs)
 
@@ -568,6 +2005,14 @@ class CachingEnphaseInterface(PandasEnphaseInterface):
 
         return self._istats(system_id, 'rgm_stats', kwargs)
 
+    def fill(self, system_id, start_at, end_at, table='stats'):
+        '''Fetch the intervals of table from start_at to end_at missing
+            from the backend and return the whole range, without keeping
+            it in the memory tier, as a background sync does'''
+
+        return self._istats(system_id, table, {'start_at':start_at,
+            'end_at':end_at}, remember=False)
+
     def getAllStats(self, system_id):
         summary = self.summary(system_id,no_cache=True)
         return self.stats(system_id,
@@ -579,21 +2024,26 @@ class CachingEnphaseInterface(PandasEnphaseInterface):
             envoys = super(CachingEnphaseInterface,self)._execQuery(
                 system_id,'envoys', kwargs)
         else:
-            q = 'select * from envoys where system_id = ?'
+            key = ('envoys', system_id)
+            envoys = self._shared(key + flightKey(kwargs), self._loadEnvoys,
+                system_id, key, kwargs)
+
+        return envoys
 
-            with self.engine.connect() as con:
-                envoys = pd.read_sql(
-                        q, 
-                        con.connection, 
-                        params = (system_id,),
-                        index_col=['system_id','serial_number'],
-                        parse_dates=['last_report_at'])
+    def _loadEnvoys(self, system_id, key, kwargs):
+        envoys = self._remembered(key)
+        if envoys is not None:
+            return envoys
 
-                if len(envoys) < 1:
-                    envoys = super(CachingEnphaseInterface,self)._execQuery(
-                        system_id,'envoys',kwargs)
+        envoys = self._read('envoys', system_id)
+
+        self._countBackend('envoys', len(envoys) > 0)
+        if len(envoys) < 1:
+            envoys = super(CachingEnphaseInterface,self)._execQuery(
+                system_id,'envoys',kwargs)
 
-                envoys.to_sql('envoys',con.connection, if_exists='append')
+            self._write('envoys', envoys)
 
+        self.memory.put(key, envoys, DEFAULT_ENVOYS_TTL)
         return envoys
 
@@ -2,13 +2,49 @@ import urllib.parse as p
 import urllib.request as r
 import datetime as dt
 import dateutil.parser as dp
+import threading
 import json
 import time
 import logging
 
 from lxml import etree as et
 
-import EnphaseInterface as ei
+from . import EnphaseInterface as ei
+from .ConnectionPool import KeepAliveHandler, DEFAULT_POOL
+from .Pipeline import Payload
+from .Metrics import DEFAULT_METRICS
+
+#the queries an Envoy's pages can answer
+QUERIES = ('energy_lifetime', 'envoys', 'inventory', 'stats', 'summary')
+
+#seconds a fetched page is reused, stats() and envoys() of one poll both
+#read the home page
+DEFAULT_PAGE_TTL = 30
+
+#compiled once, XPath objects can be shared between threads
+SERIAL = et.XPath('//td[contains(text(),"Envoy Serial Number")]/text()')
+STATUS_TABLE = et.XPath('(//table[@style])[2]')
+STATUS_DIVS = et.XPath('.//div[@class]')
+STATUS_ROWS = et.XPath('(.//table)[1]//tr')
+PRODUCTION_ROWS = et.XPath('(//div[@style]/table)[1]/tr')
+START_DATE = et.XPath('.//div[@class="good"]/text()')
+#just the cells power() needs
+POWER = et.XPath('(//table[@style])[2]//td[text()="Currently generating"]'
+    '/following-sibling::td[1]/text()')
+DEVICES = et.XPath('(//table[@style])[2]//td[text()="Number of '
+    'Microinverters"]/following-sibling::td[1]/text()')
+
+_parsers = threading.local()
+
+def parsePage(body):
+    '''Parse an Envoy page from the bytes it was served as, without
+        decoding it to a str first'''
+
+    parser = getattr(_parsers, 'parser', None)
+    if parser is None:
+        #lxml parsers must not be shared between threads
+        parser = _parsers.parser = et.HTMLParser(encoding='UTF-8')
+    return et.fromstring(body, parser)
 
 def parseEnergy(data):
     for k,v in data.items():
@@ -20,14 +56,64 @@ def parseEnergy(data):
             data[k] = int(float(v.split()[0])*(10**0))
     return data
 
+def parseHome(root):
+    '''The fields of a parsed home page'''
+
+    data = {}
+    key,value = SERIAL(root)[0].split(':',1)
+    data[key] = value.strip()
+
+    table = STATUS_TABLE(root)[0]
+    for div in STATUS_DIVS(table):
+        if div.text is not None and div.text.strip() == 'Connection to Web':
+            if div.get('class') == 'good':
+                data['status'] = 'normal'
+
+    if 'status' not in data:
+        data['status'] = 'comm'
+
+    for k,v in STATUS_ROWS(table):
+        if v.text is None:
+            data[k.text] = v[0].text.strip()
+        else:
+            data[k.text] = v.text.strip()
+
+    return parseEnergy(data)
+
+def parseProduction(root):
+    '''The fields of a parsed production page'''
+
+    data = {}
+    for row in PRODUCTION_ROWS(root):
+        if len(row) > 1:
+            key,value = row
+            data[key.text] = value.text.strip()
+        else:
+            data['start_date'] = START_DATE(row)[0].strip()
+
+    return parseEnergy(data)
+
 class EnvoyInterface(object):
-    def __init__(self, envoyUrl,
-        wrapper=ei.EnphaseOutputWrapperRaw()):
+    def __init__(self, envoyUrl, wrapper=None, pool=DEFAULT_POOL,
+            page_ttl=DEFAULT_PAGE_TTL, metrics=DEFAULT_METRICS):
+        '''Pages are fetched over pool, a ConnectionPool, so polling the
+            same Envoy reuses its connection, and their fields are reused
+            for page_ttl seconds
+
+            Queries return json unless wrapper, a Pipeline stage such as
+            PandasStage, is given to convert them.  Fetching and parsing
+            pages is timed in metrics.'''
         
         self.envoyUrl = envoyUrl
         self.dtt = ei.DateTimeType.Enphase
-        self.opener = r.build_opener()
+        self.pool = pool
+        self.opener = r.build_opener(KeepAliveHandler(pool))
         self.wrapper = wrapper
+        self.page_ttl = page_ttl
+        self.metrics = metrics
+
+        self._pages = {}
+        self._lock = threading.Lock()
         
     def _getPage(self,action,**kwargs):
     
@@ -36,110 +122,108 @@ class EnvoyInterface(object):
         request = p.urlunsplit(('http',self.envoyUrl,action,query,''))
         
         logging.debug(request)
-        response = self.opener.open(request)
+        with self.metrics.timer('transport', endpoint=action, key='envoy'):
+            response = self.opener.open(request)
+            body = response.read()
+        self.metrics.count('response_bytes', len(body), endpoint=action,
+            key='envoy')
         
         logging.debug(response.geturl())
         
-        return et.HTML(response.read().decode(encoding='UTF-8'))
+        with self.metrics.timer('decode', endpoint=action):
+            return parsePage(body)
+
+    def _page(self, action, parse):
+        '''The parsed fields of a page, fetched again once older than
+            page_ttl'''
+
+        now = time.monotonic()
+        with self._lock:
+            page = self._pages.get(action)
+        if page is not None and page[0] > now:
+            return dict(page[1])
+
+        data = parse(self._getPage(action, locale='en'))
+        with self._lock:
+            self._pages[action] = (now + self.page_ttl, data)
+        return dict(data)
+
+    def clearPages(self):
+        '''Forget fetched pages so the next call reads the Envoy again'''
+
+        with self._lock:
+            self._pages.clear()
         
     def _parseProduction(self):
-        
-        root = self._getPage('production', locale='en')
-        table = root.find('.//div[@style]/table')
-        data = {}
-        for row in table.findall('./tr'):
-            if len(row) > 1:
-                key,value = row
-                data[key.text] = value.text.strip()
-            else:
-                data['start_date'] = row.find('.//div[@class="good"]').text.strip()
-        
-        return parseEnergy(data)
+        return self._page('production', parseProduction)
         
     def _parseHome(self):
-
-        data = {}    
-        root = self._getPage('home', locale='en')
+        return self._page('home', parseHome)
         
-        serial = root.xpath('.//td[contains(text(),"Envoy Serial Number")]')
-        
-        key,value = serial[0].text.split(':',1)
-        data[key] = value.strip()
-        
-        table = root.findall('.//table[@style]')[1]
-
-        for div in table.findall('.//div[@class]'):
-            if div.text is not None:
-                if div.text.strip() == 'Connection to Web':
-                    if div.attrib['class'] == 'good':
-                        data['status'] = 'normal'
+    def power(self):
+        '''The watts currently generated and the number of microinverters,
+            read from a fresh home page every call'''
 
-        if 'status' not in data:
-            data['status'] = 'comm'
-            
-        table2 = table.find('.//table')
-        
-        for k,v in table2.findall('.//tr'):
-            if v.text is None:
-                data[k.text] = v[0].text.strip()
-            else:
-                data[k.text] = v.text.strip()
+        root = self._getPage('home', locale='en')
+        powr = parseEnergy({'powr':POWER(root)[0].strip()})['powr']
+        return powr, int(DEVICES(root)[0])
 
-        return parseEnergy(data)
-        
     def _parseInventory(self):
         root = self._getPage('inventory',locale='en')
         
 
-    def energy_lifetime(self, system_id, **kwargs):
-        '''Get the lifetime energy produced by the system
-            Unlike the Enphase Restful interface this can only
-            return the total from the original date and is returned
-            as a single value, any start_date and end_date are ignored'''
-            
+    def _output(self, command, data):
+        '''The json of data, or what the wrapper stage makes of it'''
+
+        if self.wrapper is None:
+            return json.dumps(data)
+        return self.wrapper(command, Payload(command, data=data))
+
+    def _query(self, system_id, command, kwargs):
+        '''The decoded json the api would return for command'''
+
+        if command not in QUERIES:
+            raise NotImplementedError('An Envoy can not answer %s' % command)
+        return getattr(self, '_' + command)(system_id, kwargs)
+
+    def query(self, system_id, command, **kwargs):
+        '''The decoded json the api would return for command, without
+            passing it to the wrapper'''
+
+        return self._query(system_id, command, kwargs)
+
+    @staticmethod
+    def _lastReport(home):
+        delta = dt.timedelta(minutes=int(
+            home['Last connection to website'].split()[0]))
+        return int((dt.datetime.now() - delta).timestamp())
+
+    def _energy_lifetime(self, system_id, kwargs):
         data = self._parseProduction()
-        
+
         j = {}
-        
         j['start_date'] = data['start_date']
         j['system_id'] = int(system_id)
         j['production'] = [data['Since Installation']]
-        
-        return json.dumps(j)
-
-    def envoys(self, system_id, **kwargs):
-        '''List the envoys associated with the system
-            Unlike the Enphase Restful interface this can only
-            return data for the envoy we're querying'''
-            
-        j = {}
+        return j
 
+    def _envoys(self, system_id, kwargs):
         data = self._parseHome()
-        j['system_id'] = int(system_id)
+
         envoy = {}
-        
-        delta = dt.timedelta(minutes=int(data['Last connection to website'].split()[0]))
         envoy['envoy_id'] = 0
-        envoy['last_report_at'] = int((delta + dt.datetime.now()).timestamp())
+        envoy['last_report_at'] = self._lastReport(data)
         envoy['name'] = 'Envoy %s' % data['Envoy Serial Number']
         envoy['part_number'] = ''
         envoy['serial_number'] = data['Envoy Serial Number']
         envoy['status'] = data['status']
-        
-        j['envoys'] = [envoy]
-        
-        return json.dumps(j)
 
-    
-    def index(self, **kwargs):
-        '''List the systems available by this API key'''
-
-        raise NotImplementedError()
-        
-    def inventory(self, system_id, **kwargs):
-        '''List the inverters associated with this system'''
-        
         j = {}
+        j['system_id'] = int(system_id)
+        j['envoys'] = [envoy]
+        return j
+
+    def _inventory(self, system_id, kwargs):
         action = 'datatab/inventory_dt.rb'
         query = p.urlencode({'locale':'en','name':'PCU'})
         
@@ -149,13 +233,66 @@ class EnvoyInterface(object):
         
         data = json.loads(response.read().decode(encoding='UTF-8'))
         
+        j = {}
+        j['system_id'] = int(system_id)
+        j['inverters'] = [{'sn':d[2],'model':'unknown'} for d in data['aaData']]
+        return j
+
+    def _stats(self, system_id, kwargs):
+        data = self._parseHome()
+        powr = data['Currently generating']
+        #the interval being reported, rounded down onto the 5 minute grid
+        ts = int(time.time())//ei.INTERVAL*ei.INTERVAL
+        micros = int(data['Number of Microinverters'])
+        reading = {'end_at':ts,'powr':powr,'enwh':int(float(powr)/12),
+            'devices_reporting':micros}
+
+        j = {}
+        j['system_id'] = int(system_id)
+        j['total_devices'] = micros
+        j['intervals'] = [reading]
+        return j
+
+    def _summary(self, system_id, kwargs):
+        home = self._parseHome()
+        production = self._parseProduction()
+
+        j = {}
         j['system_id'] = int(system_id)
-        inverters = []
-        for d in data['aaData']:
-            inverters.append({'sn':d[2],'model':'unknown'})
-        j['inverters'] = inverters
+        j['current_power'] = home['Currently generating']
+        j['energy_today'] = production.get('Today')
+        j['energy_lifetime'] = production['Since Installation']
+        j['modules'] = int(home['Number of Microinverters'])
+        j['status'] = home['status']
+        j['last_report_at'] = self._lastReport(home)
+        j['summary_date'] = dt.date.today().isoformat()
+        return j
 
-        return json.dumps(j)
+    def energy_lifetime(self, system_id, **kwargs):
+        '''Get the lifetime energy produced by the system
+            Unlike the Enphase Restful interface this can only
+            return the total from the original date and is returned
+            as a single value, any start_date and end_date are ignored'''
+            
+        return self._output('energy_lifetime',
+            self._energy_lifetime(system_id, kwargs))
+
+    def envoys(self, system_id, **kwargs):
+        '''List the envoys associated with the system
+            Unlike the Enphase Restful interface this can only
+            return data for the envoy we're querying'''
+            
+        return self._output('envoys', self._envoys(system_id, kwargs))
+    
+    def index(self, **kwargs):
+        '''List the systems available by this API key'''
+
+        raise NotImplementedError()
+        
+    def inventory(self, system_id, **kwargs):
+        '''List the inverters associated with this system'''
+        
+        return self._output('inventory', self._inventory(system_id, kwargs))
 
     def monthly_production(self, system_id, start_date, **kwargs):
         '''List the energy produced in the last month'''
@@ -171,22 +308,10 @@ class EnvoyInterface(object):
         '''Get the 5 minute interval data for the given day
             This function ignores the start at or end at parameters'''
 
-        j = {}
-        data = self._parseHome()
-        powr = data['Currently generating']
-        enwh = int(float(powr)/12)
-        ts = dt.datetime.now()
-        ts = ts.replace(microsecond=0,second=0,minute=int((ts.minute/5)*5))
-        ts = int(ts.timestamp())
-        micros = int(data['Number of Microinverters'])
-        reading = {'end_at':ts,'powr':powr,'enwh':enwh,'devices_reporting':micros}
-        j['system_id'] = int(system_id)
-        j['total_devices'] = int(data['Number of Microinverters'])
-        j['intervals'] = [reading]
-
-        return json.dumps(j)
+        return self._output('stats', self._stats(system_id, kwargs))
 
     def summary(self, system_id, **kwargs):
-        '''Get the system summary'''
+        '''Get the system summary from the home and production pages
+            This function ignores the summary_date parameter'''
 
-        return self._execQuery(system_id, 'summary', kwargs)
+        return self._output('summary', self._summary(system_id, kwargs))
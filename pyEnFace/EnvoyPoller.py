@@ -0,0 +1,133 @@
+
+import concurrent.futures as cf
+import collections
+import threading
+import logging
+import time
+
+from .EnphaseInterface import INTERVAL
+from .EnvoyInterface import EnvoyInterface
+from .ConnectionPool import ConnectionPool
+
+DEFAULT_TIMEOUT = 10
+
+class EnvoyPoller(object):
+    '''Scrapes many Envoys on the local network at a fixed cadence and
+        writes what they report into the tables of a
+        CachingEnphaseInterface
+
+        envoys maps the host of every Envoy to the system_id its data is
+        stored under.  Each poll scrapes every Envoy at once, on up to
+        workers threads, over a ConnectionPool that keeps one connection
+        per Envoy open between polls.  An Envoy that does not answer
+        within timeout seconds fails that poll without holding up the
+        others.
+
+        The intervals read are written together with their coverage, so
+        cache.stats serves them without asking the api.'''
+
+    def __init__(self, envoys, cache, interval=INTERVAL,
+            timeout=DEFAULT_TIMEOUT, workers=None, pool=None):
+
+        self.envoys = dict(envoys)
+        self.cache = cache
+        self.interval = interval
+
+        if pool is None:
+            pool = ConnectionPool(pool_size=1, timeout=timeout)
+        self.pool = pool
+        self.interfaces = dict((host, EnvoyInterface(host, pool=pool))
+            for host in self.envoys)
+        self.executor = cf.ThreadPoolExecutor(
+            max_workers=workers or max(len(self.envoys), 1))
+
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.polls = 0
+        self.failures = collections.Counter()
+        self.errors = {}
+        self.latency = {}
+
+    def _scrape(self, host):
+        interface = self.interfaces[host]
+        system_id = self.envoys[host]
+
+        start = time.perf_counter()
+        #stats and envoys share the home page of this poll
+        interface.clearPages()
+        stats = interface.query(system_id, 'stats')
+        envoys = interface.query(system_id, 'envoys')
+        self.latency[host] = time.perf_counter() - start
+        return stats, envoys
+
+    def poll(self):
+        '''Scrape every Envoy once and store the results in a single
+            transaction, returns the exceptions of the Envoys that failed
+            by host'''
+
+        futures = dict((self.executor.submit(self._scrape, host), host)
+            for host in self.envoys)
+
+        stats = []
+        envoys = []
+        errors = {}
+        for future in cf.as_completed(futures):
+            host = futures[future]
+            try:
+                s,e = future.result()
+            except Exception as x:
+                logging.warning('Polling Envoy %s failed: %s' % (host, x))
+                self.failures[host] += 1
+                errors[host] = x
+                continue
+            stats.append(self.cache.to_frame('stats', s))
+            envoys.append(self.cache.to_frame('envoys', e))
+
+        self.cache.storePolled(stats, envoys)
+        self.polls += 1
+        self.errors = errors
+        return errors
+
+    def run(self, polls=None):
+        '''Poll every interval seconds, on the wall clock's interval
+            boundaries, until stop is called or polls have been made'''
+
+        done = 0
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception:
+                logging.exception('Storing an Envoy poll failed')
+            done += 1
+            if polls is not None and done >= polls:
+                break
+            self._stop.wait(self.interval - time.time() % self.interval)
+
+    def start(self):
+        '''Poll on a background thread'''
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        '''Stop polling and close the connections to the Envoys'''
+
+        self.stop()
+        self.executor.shutdown()
+        self.pool.close()
+
+    def stats(self):
+        '''Polls made, and failures and the last scrape time by host'''
+
+        return {'polls':self.polls,
+            'failures':dict(self.failures),
+            'latency':dict(self.latency),
+            'failing':sorted(self.errors)}
@@ -0,0 +1,199 @@
+
+import collections
+import logging
+import asyncio
+import time
+
+from .EnphaseInterface import INTERVAL
+
+DEFAULT_EVERY = 10
+#completed intervals held before they are written to the cache
+DEFAULT_BATCH_SIZE = 6
+
+Reading = collections.namedtuple('Reading', ['time', 'powr', 'devices'])
+
+class IntervalIntegrator(object):
+    '''Integrates power readings into the energy of each interval
+
+        Power is taken to change linearly between readings, so a pair of
+        readings straddling an interval boundary is split at the boundary.
+        An interval is complete once a reading past its end arrives, it
+        reports end_at, enwh and powr the way the stats api does with
+        powr the mean over the interval.  The interval readings started
+        in is partial and never reported, and nor is one in which two
+        readings were more than max_gap seconds apart.'''
+
+    def __init__(self, interval=INTERVAL, max_gap=None):
+        self.interval = interval
+        self.max_gap = max_gap
+
+        self.last = None
+        #the start of the interval being integrated, None while partial
+        self.start = None
+        self.energy = 0.0
+
+    def add(self, t, powr, devices=0):
+        '''Add a reading of powr watts at epoch t, returns the intervals
+            it completed'''
+
+        output = []
+        last = self.last
+        if last is not None and t <= last[0]:
+            return output
+        self.last = (t, powr)
+
+        if last is None:
+            if t % self.interval == 0:
+                self.start = t
+            return output
+
+        t0,p0 = last
+        if self.max_gap is not None and t - t0 > self.max_gap:
+            self.start = None
+            self.energy = 0.0
+            return output
+
+        boundary = (int(t0) // self.interval + 1) * self.interval
+        while boundary <= t:
+            pb = p0 + (powr - p0) * (boundary - t0) / (t - t0)
+            if self.start is not None:
+                energy = self.energy + (p0 + pb) / 2 * (boundary - t0)
+                output.append({'end_at':boundary,
+                    'enwh':int(round(energy / 3600)),
+                    'powr':int(round(energy / self.interval)),
+                    'devices_reporting':devices})
+            self.start = boundary
+            self.energy = 0.0
+            t0,p0 = boundary,pb
+            boundary += self.interval
+
+        if self.start is not None:
+            self.energy += (p0 + powr) / 2 * (t - t0)
+        return output
+
+class EnvoyStream(object):
+    '''Samples the power an Envoy generates every few seconds
+
+        readings() and its asyncio counterpart areadings() yield a
+        Reading every every seconds, on a fixed schedule so slow reads do
+        not make it drift.  The readings are integrated into the energy of
+        each 5 minute interval and, given a CachingEnphaseInterface as
+        cache, the completed intervals are written to its stats table
+        batch_size at a time and when the stream ends.
+
+        A failed read is logged and skipped, gaps longer than max_gap
+        seconds, by default three readings, leave their interval out.'''
+
+    def __init__(self, interface, system_id, every=DEFAULT_EVERY, cache=None,
+            batch_size=DEFAULT_BATCH_SIZE, max_gap=None):
+
+        self.interface = interface
+        self.system_id = system_id
+        self.every = every
+        self.cache = cache
+        self.batch_size = batch_size
+        self.integrator = IntervalIntegrator(
+            max_gap=max_gap if max_gap is not None else 3*every)
+
+        self.pending = []
+        self.devices = 0
+        self.samples = 0
+        self.failures = 0
+        self.flushed = 0
+
+    def sample(self):
+        '''Read the Envoy once, None if the read failed'''
+
+        try:
+            powr,devices = self.interface.power()
+        except Exception as x:
+            logging.warning('Reading Envoy %s failed: %s' %
+                (self.interface.envoyUrl, x))
+            self.failures += 1
+            return None
+        return Reading(time.time(), powr, devices)
+
+    def add(self, reading):
+        '''Integrate a reading, flushing once batch_size intervals are
+            complete'''
+
+        self.samples += 1
+        self.devices = reading.devices
+        self.pending.extend(self.integrator.add(reading.time, reading.powr,
+            reading.devices))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        '''Write the completed intervals to the cache'''
+
+        if len(self.pending) == 0:
+            return
+        intervals,self.pending = self.pending,[]
+        if self.cache is None:
+            return
+
+        data = {'system_id':int(self.system_id),
+            'total_devices':self.devices,
+            'intervals':intervals}
+        self.cache.storePolled([self.cache.to_frame('stats', data)])
+        self.flushed += len(intervals)
+
+    def _next(self, deadline, now):
+        '''When the reading after the one due at deadline is due, readings
+            missed by more than a period are skipped rather than rushed'''
+
+        deadline += self.every
+        if deadline < now:
+            deadline += (now - deadline) // self.every * self.every + \
+                self.every
+        return deadline
+
+    def readings(self, count=None):
+        '''Yield count readings, or readings forever'''
+
+        deadline = time.monotonic()
+        try:
+            while count is None or count > 0:
+                time.sleep(max(deadline - time.monotonic(), 0))
+                deadline = self._next(deadline, time.monotonic())
+                reading = self.sample()
+                if reading is not None:
+                    self.add(reading)
+                    if count is not None:
+                        count -= 1
+                    yield reading
+        finally:
+            self.flush()
+
+    __iter__ = readings
+
+    async def areadings(self, count=None):
+        '''Yield count readings, or readings forever, reading the Envoy on
+            the event loop's default executor'''
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        try:
+            while count is None or count > 0:
+                await asyncio.sleep(max(deadline - loop.time(), 0))
+                deadline = self._next(deadline, loop.time())
+                reading = await loop.run_in_executor(None, self.sample)
+                if reading is not None:
+                    await loop.run_in_executor(None, self.add, reading)
+                    if count is not None:
+                        count -= 1
+                    yield reading
+        finally:
+            self.flush()
+
+    def __aiter__(self):
+        return self.areadings()
+
+    def stats(self):
+        '''Readings taken and failed and intervals written'''
+
+        return {'samples':self.samples,
+            'failures':self.failures,
+            'pending':len(self.pending),
+            'flushed':self.flushed}
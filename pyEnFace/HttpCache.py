@@ -0,0 +1,318 @@
+
+import urllib.request as r
+import urllib.response as ur
+import urllib.parse as p
+import email.utils
+import collections
+import threading
+import logging
+import time
+import io
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+#seconds responses of an endpoint, by the last part of its path, are
+#reused without asking when the api gives no lifetime.  Only the
+#endpoints given one are kept, none by default as systems and envoys can
+#change at any time and the stats endpoints must stream, for example
+#{'inventory':3600}
+DEFAULT_TTLS = {}
+
+#the fraction of a response's age since Last-Modified it stays fresh for
+#when it carries no lifetime, as http caches usually do
+HEURISTIC_FRACTION = 0.1
+MAX_HEURISTIC = 86400
+
+def cacheKey(url, ignore=('key',)):
+    '''The url with the query parameters in ignore removed and the rest
+        sorted, so requests made with different api keys share entries'''
+
+    s,n,path,params,query,_ = p.urlparse(url)
+    query = sorted((k,v) for k,v in p.parse_qsl(query, keep_blank_values=True)
+        if k not in ignore)
+    return p.urlunparse((s, n.lower(), path, params, p.urlencode(query), ''))
+
+def _directives(headers):
+    output = {}
+    for d in headers.get('Cache-Control', '').split(','):
+        k,_,v = d.strip().partition('=')
+        if k:
+            output[k.lower()] = v.strip('"')
+    return output
+
+def _date(value):
+    if value is None:
+        return None
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+def _endpoint(url):
+    '''The last part of the path of url'''
+
+    return p.urlparse(url).path.rstrip('/').rsplit('/',1)[-1]
+
+class Entry(object):
+    '''A stored response body with its headers and validators'''
+
+    __slots__ = ('body', 'headers', 'expires', 'etag', 'last_modified')
+
+    def __init__(self, body, headers, expires):
+        self.body = body
+        self.headers = headers
+        self.expires = expires
+        self.etag = headers.get('ETag')
+        self.last_modified = headers.get('Last-Modified')
+
+class ResponseCache(object):
+    '''Keeps the bodies of successful GET responses by cacheKey
+
+        A response is reused without a request while fresh, by its
+        Cache-Control max-age, its Expires header, a ttl given for its
+        endpoint or heuristically from its Last-Modified header.  Once
+        stale it is revalidated with a conditional request and a 304 Not
+        Modified answer is served from the stored body.  Only responses
+        of the endpoints in ttls are kept, kept responses are read whole
+        so the rest stream to their decoders, and not those marked
+        no-store or with neither a lifetime nor a validator.  The least
+        recently used entries are dropped to stay under max_bytes.'''
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, ttls=DEFAULT_TTLS):
+        self.max_bytes = max_bytes
+        self.ttls = dict(ttls)
+
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.bytes -= len(entry.body)
+
+    def _expires(self, url, headers, now):
+        '''When a response stops being fresh, None if it must not be
+            kept'''
+
+        cc = _directives(headers)
+        if 'no-store' in cc:
+            return None
+        if 'no-cache' in cc:
+            return now
+
+        age = 0
+        try:
+            age = int(headers.get('Age', 0))
+        except ValueError:
+            pass
+        if 'max-age' in cc:
+            try:
+                return now + int(cc['max-age']) - age
+            except ValueError:
+                return now
+
+        expires = _date(headers.get('Expires'))
+        if expires is not None:
+            date = _date(headers.get('Date')) or now
+            return now + expires - date - age
+
+        endpoint = _endpoint(url)
+        if endpoint in self.ttls:
+            return now + self.ttls[endpoint]
+
+        modified = _date(headers.get('Last-Modified'))
+        if modified is not None:
+            date = _date(headers.get('Date')) or now
+            return now + min((date - modified) * HEURISTIC_FRACTION,
+                MAX_HEURISTIC)
+
+        return now
+
+    def get(self, url):
+        '''The entry stored for url fresh or not, or None'''
+
+        with self._lock:
+            entry = self._entries.get(cacheKey(url))
+            if entry is not None:
+                self._entries.move_to_end(cacheKey(url))
+            return entry
+
+    def isFresh(self, url):
+        '''Whether url has an entry that can be used without asking'''
+
+        with self._lock:
+            entry = self._entries.get(cacheKey(url))
+        return entry is not None and entry.expires > time.time()
+
+    def fresh(self, url):
+        '''The entry for url if it can be used without asking, or None'''
+
+        entry = self.get(url)
+        if entry is None or entry.expires <= time.time():
+            return None
+        with self._lock:
+            self.hits += 1
+        return entry
+
+    def conditionalHeaders(self, url):
+        '''Headers that make a request for url conditional on the stored
+            entry having changed'''
+
+        entry = self.get(url)
+        headers = {}
+        if entry is not None:
+            if entry.etag is not None:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified is not None:
+                headers['If-Modified-Since'] = entry.last_modified
+        return headers
+
+    def _lifetime(self, url, headers, now):
+        if _endpoint(url) not in self.ttls:
+            return None
+        expires = self._expires(url, headers, now)
+        if expires is not None and expires <= now and \
+                'ETag' not in headers and 'Last-Modified' not in headers:
+            #it could never be used again
+            return None
+        return expires
+
+    def cacheable(self, url, headers):
+        '''Whether a 200 response to url with headers would be kept'''
+
+        return self._lifetime(url, headers, time.time()) is not None
+
+    def store(self, url, headers, body):
+        '''Keep a 200 response to url if its headers allow, returns
+            whether it was kept'''
+
+        expires = self._lifetime(url, headers, time.time())
+        entry = None
+        if expires is not None and len(body) <= self.max_bytes:
+            entry = Entry(body, headers, expires)
+
+        key = cacheKey(url)
+        with self._lock:
+            self.misses += 1
+            if key in self._entries:
+                self._remove(key)
+            if entry is None:
+                return False
+            self._entries[key] = entry
+            self.bytes += len(body)
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+        return True
+
+    def notModified(self, url, headers):
+        '''Refresh the entry for url from the headers of a 304 response,
+            returns the entry or None if it is gone'''
+
+        entry = self.get(url)
+        if entry is None:
+            return None
+        for k in ('ETag', 'Last-Modified', 'Cache-Control', 'Expires',
+                'Date'):
+            if k in headers:
+                del entry.headers[k]
+                entry.headers[k] = headers[k]
+        entry.etag = entry.headers.get('ETag')
+        entry.last_modified = entry.headers.get('Last-Modified')
+        entry.expires = self._expires(url, entry.headers, time.time()) or 0
+        with self._lock:
+            self.revalidated += 1
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        '''Counts of responses served fresh, revalidated and fetched'''
+
+        with self._lock:
+            return {'hits':self.hits,
+                'revalidated':self.revalidated,
+                'misses':self.misses,
+                'entries':len(self._entries),
+                'bytes':self.bytes,
+                'max_bytes':self.max_bytes}
+
+DEFAULT_CACHE = ResponseCache()
+
+class HttpCacheHandler(r.BaseHandler):
+    '''A urllib handler answering GET requests from a ResponseCache
+
+        Fresh entries are returned without opening a connection unless the
+        request carries Cache-Control: no-cache, stale ones are
+        revalidated and 304 responses turned into the stored 200 before
+        the error handlers see them.'''
+
+    #run ahead of KeepAliveHandler and the stock handlers
+    handler_order = 498
+
+    def __init__(self, cache=None):
+        if cache is None:
+            cache = DEFAULT_CACHE
+        self.cache = cache
+
+    @staticmethod
+    def _response(req, entry):
+        response = ur.addinfourl(io.BytesIO(entry.body), entry.headers,
+            req.get_full_url(), 200)
+        response.msg = 'OK'
+        response.from_cache = True
+        return response
+
+    def http_request(self, req):
+        if req.get_method() == 'GET':
+            for k,v in self.cache.conditionalHeaders(
+                    req.get_full_url()).items():
+                req.add_unredirected_header(k, v)
+        return req
+
+    def http_open(self, req):
+        if req.get_method() != 'GET' or \
+                req.get_header('Cache-control') == 'no-cache':
+            return None
+        entry = self.cache.fresh(req.get_full_url())
+        if entry is not None:
+            logging.debug('Fresh cached response for %s' %
+                cacheKey(req.get_full_url()))
+            return self._response(req, entry)
+        return None
+
+    def http_response(self, req, response):
+        if req.get_method() != 'GET' or getattr(response, 'from_cache',
+                False):
+            return response
+
+        url = req.get_full_url()
+        if response.getcode() == 304:
+            entry = self.cache.notModified(url, response.headers)
+            if entry is not None:
+                response.read()
+                response.close()
+                logging.debug('Revalidated cached response for %s' %
+                    cacheKey(url))
+                return self._response(req, entry)
+        elif response.getcode() == 200:
+            #only buffer responses that will be kept, the rest stream
+            if self.cache.cacheable(url, response.headers):
+                body = response.read()
+                response.close()
+                self.cache.store(url, response.headers, body)
+                output = ur.addinfourl(io.BytesIO(body), response.headers,
+                    url, 200)
+                output.msg = response.msg
+                return output
+        return response
+
+    https_request = http_request
+    https_open = http_open
+    https_response = http_response
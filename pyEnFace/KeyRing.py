@@ -0,0 +1,239 @@
+
+import datetime as dt
+import threading
+import logging
+import time
+
+from .Metrics import maskKey
+
+#limits of the free Watt plan
+DEFAULT_PER_MINUTE = 10
+DEFAULT_PER_MONTH = 10000
+
+#extra seconds to wait out a rate limit period to absorb clock skew
+CLOCK_SKEW = 5
+
+def _nextMonth(now):
+    d = dt.datetime.fromtimestamp(now)
+    if d.month == 12:
+        d = dt.datetime(d.year+1, 1, 1)
+    else:
+        d = dt.datetime(d.year, d.month+1, 1)
+    return d.timestamp()
+
+class TokenBucket(object):
+    '''Allows capacity requests per period seconds, refilling continuously
+
+        Tokens may be taken while the bucket is empty, the bucket then goes
+        negative and delay() reports how long the reservation has to wait.'''
+
+    def __init__(self, capacity, period):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / period
+        self.tokens = self.capacity
+        self.last = time.time()
+
+    def _refill(self, now):
+        if now > self.last:
+            self.tokens = min(self.capacity,
+                self.tokens + (now - self.last) * self.rate)
+            self.last = now
+
+    def available(self, now):
+        self._refill(now)
+        return self.tokens
+
+    def delay(self, now):
+        '''Seconds until a token is available'''
+
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def give(self, now):
+        self._refill(now)
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+class ApiKey(object):
+    '''The quota state of a single Enphase API key'''
+
+    def __init__(self, key, per_minute=DEFAULT_PER_MINUTE,
+            per_month=DEFAULT_PER_MONTH):
+
+        self.key = key
+        self.per_month = per_month
+        self.minute = TokenBucket(per_minute, 60)
+        self.month_used = 0
+        self.month_end = _nextMonth(time.time())
+        self.blocked_until = 0
+
+    def _rollMonth(self, now):
+        if now >= self.month_end:
+            self.month_used = 0
+            self.month_end = _nextMonth(now)
+
+    def headroom(self, now):
+        '''Requests this key can make right now'''
+
+        self._rollMonth(now)
+        if now < self.blocked_until:
+            return 0
+        return max(0, min(self.minute.available(now),
+            self.per_month - self.month_used))
+
+    def delay(self, now):
+        '''Seconds until this key can make a request'''
+
+        self._rollMonth(now)
+        if self.month_used >= self.per_month:
+            return max(self.month_end, self.blocked_until) - now
+        return max(self.minute.delay(now), self.blocked_until - now, 0)
+
+    def take(self, now):
+        self._rollMonth(now)
+        self.minute.take(now)
+        self.month_used += 1
+
+    def give(self, now):
+        self._rollMonth(now)
+        self.minute.give(now)
+        self.month_used = max(0, self.month_used - 1)
+
+    def block(self, until):
+        self.blocked_until = max(self.blocked_until, until)
+
+class KeyRing(object):
+    '''Schedules requests over every registered API key
+
+        Each key keeps a per minute token bucket and a per month count.
+        Requests go to the key with the most headroom so throughput grows
+        with the number of keys.  Keys can be added with append just like
+        the deque APIKEYRING used to be.'''
+
+    def __init__(self, keys=(), per_minute=DEFAULT_PER_MINUTE,
+            per_month=DEFAULT_PER_MONTH):
+
+        self.per_minute = per_minute
+        self.per_month = per_month
+        self._keys = []
+        self._lock = threading.Lock()
+
+        self.extend(keys)
+
+    def _find(self, key):
+        for k in self._keys:
+            if k.key == key:
+                return k
+        raise KeyError(key)
+
+    def append(self, key, per_minute=None, per_month=None):
+        '''Register a key, the limits default to the ones of the ring'''
+
+        k = ApiKey(key, per_minute or self.per_minute,
+            per_month or self.per_month)
+        with self._lock:
+            self._keys.append(k)
+
+    def appendleft(self, key, per_minute=None, per_month=None):
+        k = ApiKey(key, per_minute or self.per_minute,
+            per_month or self.per_month)
+        with self._lock:
+            self._keys.insert(0, k)
+
+    def extend(self, keys):
+        for key in keys:
+            self.append(key)
+
+    def remove(self, key):
+        with self._lock:
+            self._keys.remove(self._find(key))
+
+    def clear(self):
+        with self._lock:
+            self._keys = []
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __getitem__(self, i):
+        return self._keys[i].key
+
+    def __iter__(self):
+        return iter([k.key for k in self._keys])
+
+    def __contains__(self, key):
+        return key in list(self)
+
+    def reserve(self, now=None):
+        '''Take a request slot on the key with the most headroom
+
+            Returns a tuple of the key and the seconds to wait before the
+            request may be sent.  The slot is held either way, hand it
+            back with cancel if the request is not going to be made.'''
+
+        if now is None:
+            now = time.time()
+
+        with self._lock:
+            if len(self._keys) == 0:
+                raise ValueError('Must register at least one key with APIKEYRING')
+
+            best = min(self._keys,
+                key=lambda k:(k.delay(now), -k.headroom(now)))
+            wait = best.delay(now)
+            best.take(now)
+
+        return best.key, wait
+
+    def acquire(self):
+        '''Reserve a request slot and sleep until it may be used'''
+
+        key,wait = self.reserve()
+        if wait > 0:
+            logging.info('Rate limited, sleeping for %s seconds' % str(wait))
+            time.sleep(wait)
+        return key
+
+    def cancel(self, key, now=None):
+        '''Hand back a slot taken by reserve'''
+
+        if now is None:
+            now = time.time()
+        with self._lock:
+            self._find(key).give(now)
+
+    def penalize(self, key, until):
+        '''Stop using a key until the timestamp until, normally the end of
+            the period given by a 409 response'''
+
+        logging.info('Key %s is rate limited until %s' % (maskKey(key), until))
+        with self._lock:
+            try:
+                self._find(key).block(until + CLOCK_SKEW)
+            except KeyError:
+                pass
+
+    def remaining(self, now=None):
+        '''Report the quota left on every key
+
+            Returns a dict of key to a dict with the requests left this
+            minute and month and the time the key is blocked until.'''
+
+        if now is None:
+            now = time.time()
+
+        with self._lock:
+            output = {}
+            for k in self._keys:
+                k._rollMonth(now)
+                output[k.key] = {
+                    'minute':max(0, int(k.minute.available(now))),
+                    'month':max(0, k.per_month - k.month_used),
+                    'blocked_until':k.blocked_until if k.blocked_until > now
+                        else None}
+            return output
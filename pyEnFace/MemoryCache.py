@@ -0,0 +1,104 @@
+
+import collections
+import threading
+import time
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+class MemoryCache(object):
+    '''A least recently used cache of DataFrames bounded by their size
+
+        Entries can be given a time to live in seconds, entries without
+        one never expire and only leave the cache when evicted to make
+        room.  get hands back a copy so callers can not change a cached
+        frame.'''
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    @staticmethod
+    def sizeof(frame):
+        '''Bytes used by a frame including its index and object values'''
+
+        return int(frame.memory_usage(index=True, deep=True).sum())
+
+    def _remove(self, key):
+        frame,size,expires = self._entries.pop(key)
+        self.bytes -= size
+
+    def get(self, key):
+        '''The frame cached under key, or None'''
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is not None and \
+                    entry[2] <= time.monotonic():
+                self._remove(key)
+                self.expired += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0].copy()
+
+    def put(self, key, frame, ttl=None):
+        '''Cache frame under key for ttl seconds, or until evicted if ttl
+            is None'''
+
+        size = self.sizeof(frame)
+        if size > self.max_bytes:
+            return
+
+        expires = None
+        if ttl is not None:
+            expires = time.monotonic() + ttl
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (frame.copy(), size, expires)
+            self.bytes += size
+
+            while self.bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, match):
+        '''Drop every entry whose key match(key) is true for'''
+
+        with self._lock:
+            for key in [k for k in self._entries if match(k)]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        '''Hit and miss counts and the current size of the cache'''
+
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits':self.hits,
+                'misses':self.misses,
+                'hit_rate':self.hits / lookups if lookups > 0 else 0.0,
+                'expired':self.expired,
+                'evictions':self.evictions,
+                'entries':len(self._entries),
+                'bytes':self.bytes,
+                'max_bytes':self.max_bytes}
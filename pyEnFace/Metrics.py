@@ -0,0 +1,238 @@
+
+import collections
+import threading
+import logging
+import bisect
+import time
+
+#upper bounds in seconds, the buckets prometheus clients use by default
+#stretched to the minute long waits of rate limits
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+PREFIX = 'enphase_'
+
+#bytes of a response body written to the debug log
+DEFAULT_LOG_BYTES = 2048
+
+def maskKey(key):
+    '''An api key safe to use as a label, its last four characters'''
+
+    if not key:
+        return ''
+    return '...' + key[-4:]
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if len(pairs) == 0:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, _escape(v)) for k,v in pairs)
+
+class LazyPayload(object):
+    '''A response body for the log, only decoded if the message is
+        emitted and cut to limit bytes
+
+        logging.debug('%s', LazyPayload(body)) costs nothing while debug
+        logging is off.'''
+
+    __slots__ = ('body', 'limit')
+
+    def __init__(self, body, limit=DEFAULT_LOG_BYTES):
+        self.body = body
+        self.limit = limit
+
+    def __str__(self):
+        body = self.body
+        if isinstance(body, (bytes, bytearray)):
+            if len(body) > self.limit:
+                return '%s... (%d bytes)' % (body[:self.limit].decode(
+                    'UTF-8', 'replace'), len(body))
+            return body.decode('UTF-8', 'replace')
+        return str(body)
+
+class Histogram(object):
+    '''Counts of observations at or below each bucket bound and their sum'''
+
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds=DEFAULT_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.bounds, value)
+        if i < len(self.counts):
+            self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        output = []
+        total = 0
+        for c in self.counts:
+            total += c
+            output.append(total)
+        return output
+
+class Timer(object):
+    '''Observes the seconds spent in a with block'''
+
+    __slots__ = ('registry', 'name', 'labels', 'start')
+
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.registry.observe(self.name, time.perf_counter() - self.start,
+            **self.labels)
+        return False
+
+class _NullTimer(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+NULL_TIMER = _NullTimer()
+
+class MetricsRegistry(object):
+    '''Counters and histograms of the interfaces, labelled by endpoint,
+        api key and the like
+
+        count adds to a counter and observe records a duration in a
+        histogram, timer is a with block doing the same.  Every
+        observation is also passed to the callbacks as callback(kind,
+        name, labels, value), kind being 'counter' or 'histogram', for
+        forwarding to other systems.  prometheus() renders everything in
+        the Prometheus text exposition format.  A disabled registry
+        records nothing and its timers cost next to nothing.'''
+
+    def __init__(self, enabled=True, buckets=DEFAULT_BUCKETS, prefix=PREFIX):
+        self.enabled = enabled
+        self.buckets = buckets
+        self.prefix = prefix
+
+        self.callbacks = []
+        self._counters = collections.defaultdict(float)
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def addCallback(self, callback):
+        self.callbacks.append(callback)
+
+    def removeCallback(self, callback):
+        self.callbacks.remove(callback)
+
+    def _notify(self, kind, name, labels, value):
+        for callback in self.callbacks:
+            try:
+                callback(kind, name, labels, value)
+            except Exception:
+                logging.exception('Metrics callback failed')
+
+    def count(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] += value
+        if self.callbacks:
+            self._notify('counter', name, labels, value)
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+        if self.callbacks:
+            self._notify('histogram', name, labels, value)
+
+    def timer(self, name, **labels):
+        '''A with block whose duration is observed in name'''
+
+        if not self.enabled:
+            return NULL_TIMER
+        return Timer(self, name, labels)
+
+    def counter(self, name, **labels):
+        '''The value of a counter'''
+
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))),
+                0)
+
+    def histogram(self, name, **labels):
+        '''The count and sum of a histogram'''
+
+        with self._lock:
+            h = self._histograms.get((name, tuple(sorted(labels.items()))))
+            if h is None:
+                return 0, 0.0
+            return h.count, h.sum
+
+    def snapshot(self):
+        '''Every counter and the count and sum of every histogram, keyed
+            by name and a tuple of label pairs'''
+
+        with self._lock:
+            return {'counters':dict(self._counters),
+                'histograms':dict((k, (v.count, v.sum))
+                    for k,v in self._histograms.items())}
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def prometheus(self):
+        '''Everything recorded in the Prometheus text exposition format'''
+
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((k, v.bounds, v.cumulative(), v.sum, v.count)
+                for k,v in self._histograms.items())
+
+        typed = set()
+        for (name,labels),value in counters:
+            name = self.prefix + name + '_total'
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE %s counter' % name)
+            lines.append('%s%s %s' % (name, _labels(labels), repr(value)))
+
+        for (name,labels),bounds,cumulative,total,count in histograms:
+            name = self.prefix + name + '_seconds'
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE %s histogram' % name)
+            for bound,c in zip(bounds, cumulative):
+                lines.append('%s_bucket%s %d' % (name, _labels(labels,
+                    [('le', repr(bound))]), c))
+            lines.append('%s_bucket%s %d' % (name, _labels(labels,
+                [('le', '+Inf')]), count))
+            lines.append('%s_sum%s %s' % (name, _labels(labels), repr(total)))
+            lines.append('%s_count%s %d' % (name, _labels(labels), count))
+
+        return '\n'.join(lines) + '\n'
+
+DEFAULT_METRICS = MetricsRegistry()
@@ -0,0 +1,194 @@
+
+import contextlib
+import threading
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .EnphaseInterface import (CacheBackend, CACHE_KEYS, CACHE_COLUMNS,
+    ROLLUPS, rollupTable, _isTime)
+from .Coverage import IntervalSet
+
+#a week of 5 minute intervals, reads skip row groups outside their range
+DEFAULT_ROW_GROUP_SIZE = 2016
+
+DATA_FILE = 'data.parquet'
+
+TYPES = {'int':pa.int64(), 'text':pa.string()}
+
+COVERAGE_SCHEMA = pa.schema([('lower',pa.int64()), ('upper',pa.int64())])
+
+#a system's daily and monthly rollups are small enough for one file
+SINGLE_FILE = set(rollupTable(t, f) for t in ROLLUPS
+    for f in ('daily','monthly'))
+
+def _months(seconds):
+    '''The yyyymm partition of every epoch timestamp, in UTC'''
+
+    months = np.asarray(seconds, dtype='int64').astype(
+        'datetime64[s]').astype('datetime64[M]').astype('int64')
+    return (1970 + months // 12) * 100 + months % 12 + 1
+
+class ParquetBatch(object):
+    '''The writes of one ParquetCacheBackend transaction, held until the
+        transaction ends'''
+
+    def __init__(self):
+        self.frames = {}
+        self.coverage = {}
+
+    def write(self, table, frame):
+        if len(frame) > 0:
+            self.frames.setdefault(table, []).append(frame)
+
+    def addCoverage(self, system_id, endpoint, ranges):
+        self.coverage.setdefault((system_id, endpoint), []).extend(ranges)
+
+class ParquetCacheBackend(CacheBackend):
+    '''Keeps the cache tables as Parquet datasets in a directory
+
+        Each table is hive partitioned under root by system_id and, for
+        the tables keyed on a time, by the UTC month of that time, for
+        example root/stats/system_id=67/month=201601/data.parquet, but
+        daily and monthly rollups are a file per system.  A partition is
+        one file sorted on its key.  Reads open only the partitions of the
+        requested range, skip row groups by their statistics on the key
+        and memory map the rest, so reading a system's year is twelve
+        mapped files.
+
+        Parquet files can not be updated in place, writing to a
+        partition rewrites it with new rows replacing old rows of the
+        same key.  Partitions are replaced atomically one at a time and
+        coverage, merged with the stored file under the lock, is written
+        last, an interrupted transaction at worst leaves rows that are
+        fetched again.  Needs pyarrow.'''
+
+    def __init__(self, root, row_group_size=DEFAULT_ROW_GROUP_SIZE,
+            memory_map=True):
+        self.root = root
+        self.row_group_size = row_group_size
+        self.memory_map = memory_map
+
+        self._lock = threading.Lock()
+        self.schemas = dict((k, pa.schema([(c, TYPES[t]) for c,t in v]))
+            for k,v in CACHE_COLUMNS.items())
+
+    @staticmethod
+    def _partitioned(table):
+        return _isTime(CACHE_KEYS[table][1]) and table not in SINGLE_FILE
+
+    def _systemPath(self, table, system_id):
+        return os.path.join(self.root, table, 'system_id=%d' % system_id)
+
+    def _path(self, table, system_id, month=None):
+        path = self._systemPath(table, system_id)
+        if month is not None:
+            path = os.path.join(path, 'month=%d' % month)
+        return os.path.join(path, DATA_FILE)
+
+    def _paths(self, table, system_id, lower, upper):
+        '''The files of the partitions that can hold rows in range'''
+
+        if not self._partitioned(table):
+            path = self._path(table, system_id)
+            return [path] if os.path.exists(path) else []
+
+        base = self._systemPath(table, system_id)
+        if not os.path.isdir(base):
+            return []
+
+        first = _months([lower])[0] if lower is not None else 0
+        last = _months([upper])[0] if upper is not None else 999999
+        months = sorted(int(x.split('=')[1]) for x in os.listdir(base)
+            if x.startswith('month='))
+        return [self._path(table, system_id, x) for x in months
+            if first <= x <= last]
+
+    def _empty(self, table):
+        return self.schemas[table].empty_table().to_pandas()
+
+    def read(self, table, system_id, lower=None, upper=None):
+        key = CACHE_KEYS[table][1]
+        filters = []
+        if lower is not None:
+            filters.append((key, '>=', lower))
+        if upper is not None:
+            filters.append((key, '<=', upper))
+
+        tables = [pq.read_table(x, memory_map=self.memory_map,
+            filters=filters or None, partitioning=None,
+            schema=self.schemas[table])
+            for x in self._paths(table, system_id, lower, upper)]
+        if len(tables) == 0:
+            return self._empty(table)
+        return pa.concat_tables(tables).to_pandas(split_blocks=True)
+
+    def _toTable(self, table, frame):
+        names = self.schemas[table].names
+        return pa.Table.from_pandas(frame.reindex(columns=names),
+            schema=self.schemas[table], preserve_index=False)
+
+    def _replace(self, path, data):
+        '''Write data to path through a temporary file so readers never
+            see a partial file'''
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + '.tmp'
+        pq.write_table(data, tmp, row_group_size=self.row_group_size)
+        os.replace(tmp, path)
+
+    def _writeTable(self, table, frames):
+        keys = list(CACHE_KEYS[table])
+        frame = pd.concat(frames)
+        if self._partitioned(table):
+            frame['month'] = _months(frame[keys[1]])
+            groups = frame.groupby(['system_id','month'])
+        else:
+            groups = frame.groupby('system_id')
+
+        for k,new in groups:
+            if self._partitioned(table):
+                path = self._path(table, *k)
+                new = new.drop(columns=['month'])
+            else:
+                path = self._path(table, k)
+
+            if os.path.exists(path):
+                old = pq.read_table(path, schema=self.schemas[table],
+                    partitioning=None).to_pandas()
+                new = pd.concat([old, new])
+            new = new.drop_duplicates(keys, keep='last').sort_values(keys)
+            self._replace(path, self._toTable(table, new))
+
+    def _coveragePath(self, system_id, endpoint):
+        return os.path.join(self.root, 'coverage', 'system_id=%d' % system_id,
+            'endpoint=%s' % endpoint, DATA_FILE)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        batch = ParquetBatch()
+        yield batch
+
+        with self._lock:
+            for table,frames in batch.frames.items():
+                self._writeTable(table, frames)
+            for (system_id,endpoint),ranges in batch.coverage.items():
+                merged = IntervalSet(self.loadCoverage(system_id, endpoint))
+                for lower,upper in ranges:
+                    merged.add(lower, upper)
+                data = pa.Table.from_pylist([{'lower':l, 'upper':u}
+                    for l,u in merged], schema=COVERAGE_SCHEMA)
+                self._replace(self._coveragePath(system_id, endpoint), data)
+        logging.debug('Wrote %d tables to %s' % (len(batch.frames),
+            self.root))
+
+    def loadCoverage(self, system_id, endpoint):
+        path = self._coveragePath(system_id, endpoint)
+        if not os.path.exists(path):
+            return []
+        data = pq.read_table(path, partitioning=None).to_pydict()
+        return list(zip(data['lower'], data['upper']))
@@ -0,0 +1,177 @@
+
+import json
+import io
+
+from .EnphaseInterface import FrameBuilder, DateTimeType
+
+class Payload(object):
+    '''A response passed between the stages of a Pipeline
+
+        Holds the body as bytes, the decoded json or both, each side is
+        made from the other the first time it is asked for and kept, so
+        a payload is decoded at most once however many stages read it.'''
+
+    __slots__ = ('command', '_body', '_data')
+
+    def __init__(self, command, body=None, data=None):
+        if body is None and data is None:
+            raise ValueError('A payload needs a body or data')
+        self.command = command
+        self._body = body
+        self._data = data
+
+    @property
+    def decoded(self):
+        return self._data is not None
+
+    @property
+    def body(self):
+        if self._body is None:
+            self._body = json.dumps(self._data).encode('UTF-8')
+        return self._body
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = json.loads(self._body.decode('UTF-8'))
+        return self._data
+
+class ApiSource(object):
+    '''Fetches payloads from the Enphase api with interface, a
+        RawEnphaseInterface, which keeps its keys, caching and retries'''
+
+    def __init__(self, interface):
+        self.interface = interface
+
+    def fetch(self, system_id, command, kwargs):
+        if command in ('index', ''):
+            body = self.interface.index(**kwargs)
+        else:
+            body = getattr(self.interface, command)(system_id, **kwargs)
+        return Payload(command, body=body)
+
+class EnvoySource(object):
+    '''Reads payloads from the pages of an Envoy with interface, an
+        EnvoyInterface, in the shape the api returns them'''
+
+    def __init__(self, interface):
+        self.interface = interface
+
+    def fetch(self, system_id, command, kwargs):
+        return Payload(command,
+            data=self.interface.query(system_id, command, **kwargs))
+
+class RawStage(object):
+    '''Outputs the body of the payload as bytes'''
+
+    def __call__(self, command, payload):
+        return payload.body
+
+class JsonStage(object):
+    '''Outputs the decoded json of the payload'''
+
+    def __call__(self, command, payload):
+        return payload.data
+
+class PandasStage(FrameBuilder):
+    '''Outputs the payload as the DataFrame PandasEnphaseInterface
+        would return
+
+        Stats payloads that are still bytes are decoded straight into
+        columns rather than through json.'''
+
+    def __init__(self, datetimeType=DateTimeType.Enphase, tz=None,
+            compact=False):
+        self.dtt = datetimeType
+        self.tz = tz
+        self.compact = compact
+
+    def __call__(self, command, payload):
+        if command in ('stats','rgm_stats') and not payload.decoded:
+            return self._statsFrame(io.BytesIO(payload.body), command)
+        return self._toFrame(command, payload.data)
+
+class CacheStage(object):
+    '''Writes the DataFrames reaching it to the tables of cache, a
+        CachingEnphaseInterface, and passes them on
+
+        Place it after a PandasStage.  Stats, rgm_stats and envoys are
+        stored with CachingEnphaseInterface.storePolled so cache.stats and
+        cache.rgm_stats serve the intervals without asking the api,
+        summaries are written as they are.'''
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def __call__(self, command, frame):
+        if 'intervals' in frame.columns or len(frame) == 0:
+            return frame
+        if command == 'stats':
+            self.cache.storePolled([frame])
+        elif command == 'rgm_stats':
+            self.cache.storePolled([], rgm_stats=[frame])
+        elif command == 'envoys':
+            self.cache.storePolled([], [frame])
+        elif command == 'summary':
+            self.cache.store(command, frame)
+        return frame
+
+class Pipeline(object):
+    '''Answers queries from source and passes the payload through stages
+
+        Any source, an ApiSource or EnvoySource, can feed any stages, for
+        example Pipeline(EnvoySource(envoy), PandasStage(),
+        CacheStage(cache)) stores an Envoy's readings in the cache and
+        returns them as DataFrames.  A stage is a callable taking the
+        command and the output of the stage before it, the first gets a
+        Payload.  With no stages the Payload itself is returned.'''
+
+    def __init__(self, source, *stages):
+        self.source = source
+        self.stages = list(stages)
+
+    def run(self, system_id, command, kwargs):
+        output = self.source.fetch(system_id, command, kwargs)
+        for stage in self.stages:
+            output = stage(command, output)
+        return output
+
+    def energy_lifetime(self, system_id, **kwargs):
+        '''Get the lifetime energy produced by the system'''
+
+        return self.run(system_id, 'energy_lifetime', kwargs)
+
+    def envoys(self, system_id, **kwargs):
+        '''List the envoys associated with the system'''
+
+        return self.run(system_id, 'envoys', kwargs)
+
+    def index(self, **kwargs):
+        '''List the systems available'''
+
+        return self.run('', 'index', kwargs)
+
+    def inventory(self, system_id, **kwargs):
+        '''List the inverters associated with this system'''
+
+        return self.run(system_id, 'inventory', kwargs)
+
+    def monthly_production(self, system_id, **kwargs):
+        '''List the energy produced in the last month'''
+
+        return self.run(system_id, 'monthly_production', kwargs)
+
+    def rgm_stats(self, system_id, **kwargs):
+        '''List the Revenue Grade Meter stats'''
+
+        return self.run(system_id, 'rgm_stats', kwargs)
+
+    def stats(self, system_id, **kwargs):
+        '''Get the 5 minute interval data'''
+
+        return self.run(system_id, 'stats', kwargs)
+
+    def summary(self, system_id, **kwargs):
+        '''Get the system summary'''
+
+        return self.run(system_id, 'summary', kwargs)
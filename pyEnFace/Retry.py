@@ -0,0 +1,246 @@
+
+import urllib.parse as p
+import urllib.error as e
+import collections
+import threading
+import logging
+import random
+import time
+
+from .KeyRing import TokenBucket
+
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BASE_DELAY = 1.0
+DEFAULT_MAX_DELAY = 60.0
+#retries each endpoint may spend per minute before requests fail instead
+DEFAULT_RETRY_BUDGET = 30
+#consecutive 503s that open the circuit and how long it stays open
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_AFTER = 30.0
+
+def endpointOf(url):
+    '''The api endpoint of a url, the last part of its path'''
+
+    return p.urlparse(url).path.rstrip('/').rsplit('/',1)[-1]
+
+class CircuitOpenError(e.URLError):
+    '''Raised instead of sending a request while the api is failing'''
+
+    def __init__(self, host, retry_in):
+        super(CircuitOpenError,self).__init__(
+            'Circuit to %s is open for %.1f more seconds' % (host, retry_in))
+        self.host = host
+        self.retry_in = retry_in
+
+class RateLimitError(e.HTTPError):
+    '''A 409 whose rate limit period ends later than max_wait allows'''
+
+    def __init__(self, url, code, msg, hdrs, fp, wait):
+        super(RateLimitError,self).__init__(url, code, msg, hdrs, fp)
+        self.wait = wait
+
+class CircuitBreaker(object):
+    '''Stops requests to a host after threshold consecutive failures
+
+        While open every request fails at once.  After reset_after
+        seconds a single request is let through along with its own
+        retries, the circuit closes if it succeeds and opens again if it
+        fails in any way.'''
+
+    def __init__(self, threshold=DEFAULT_FAILURE_THRESHOLD,
+            reset_after=DEFAULT_RESET_AFTER):
+        self.threshold = threshold
+        self.reset_after = reset_after
+
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.opened = 0
+
+    def allow(self, now, retry=False):
+        '''Seconds the circuit stays open, 0 if a request may be sent
+
+            retry is set for the retry of a request that was let through,
+            it continues the trial instead of waiting for it to end.'''
+
+        if self.opened_at is None:
+            return 0
+        remaining = self.opened_at + self.reset_after - now
+        if remaining <= 0 and self.trial and retry:
+            return 0
+        if remaining > 0 or self.trial:
+            return max(remaining, 0.001)
+        self.trial = True
+        return 0
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    def abandon(self):
+        '''A request let through ended without an outcome, the next one
+            starts the trial again'''
+
+        self.trial = False
+
+    def failure(self, now, code=503):
+        '''Count a failed request, code is its status or None for an
+            exception.  Only 503s count towards opening the circuit, any
+            failure ends the trial and opens it again.'''
+
+        if code == 503:
+            self.failures += 1
+        if self.trial or (self.opened_at is None and
+                self.failures >= self.threshold):
+            self.opened += 1
+            self.opened_at = now
+            self.trial = False
+
+    def isOpen(self, now):
+        return self.opened_at is not None and \
+            now < self.opened_at + self.reset_after
+
+class RetryEngine(object):
+    '''Decides whether and when failed api requests are retried
+
+        Waits grow exponentially from base_delay up to max_delay with
+        full jitter so a fleet of clients backing off at once spreads
+        out.  Every endpoint has a budget of retries per minute, once it
+        is spent failures are raised instead of retried.  Repeated 503s
+        from a host open a CircuitBreaker for it.  Retries, waits and
+        give ups are counted by endpoint and status for stats().
+
+        The engine only computes waits, the caller sleeps, so the same
+        engine serves blocking and asyncio clients.'''
+
+    def __init__(self, max_retries=DEFAULT_MAX_RETRIES,
+            base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY,
+            budget=DEFAULT_RETRY_BUDGET,
+            failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+            reset_after=DEFAULT_RESET_AFTER):
+
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+
+        self._budgets = {}
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+        self.counts = collections.defaultdict(collections.Counter)
+        self.slept = collections.defaultdict(float)
+
+    def _breaker(self, url):
+        host = p.urlparse(url).netloc
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            breaker = self._breakers[host] = CircuitBreaker(
+                self.failure_threshold, self.reset_after)
+        return host, breaker
+
+    def _record(self, url, event, sleep=0.0):
+        endpoint = endpointOf(url)
+        self.counts[endpoint][event] += 1
+        self.slept[endpoint] += sleep
+
+    def check(self, url, retry=False):
+        '''Raise CircuitOpenError if requests to the host of url are
+            currently refused, retry is set for the retries of a request'''
+
+        with self._lock:
+            host,breaker = self._breaker(url)
+            remaining = breaker.allow(time.monotonic(), retry)
+            if remaining > 0:
+                self._record(url, 'refused')
+        if remaining > 0:
+            raise CircuitOpenError(host, remaining)
+
+    def success(self, url):
+        with self._lock:
+            self._breaker(url)[1].success()
+
+    def failure(self, url, code=None):
+        '''A request to url failed with code, None for an exception, and
+            is not retried'''
+
+        with self._lock:
+            self._breaker(url)[1].failure(time.monotonic(), code)
+
+    def abandon(self, url):
+        '''A request to url was interrupted, for example cancelled, and is
+            counted neither as a success nor a failure'''
+
+        with self._lock:
+            self._breaker(url)[1].abandon()
+
+    def delay(self, attempt):
+        '''A jittered wait before retry number attempt, from 0'''
+
+        cap = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return random.uniform(0, cap)
+
+    def backoff(self, url, code, attempt, wait=0.0):
+        '''Seconds to wait before retrying a request to url that failed
+            with code for the attempt'th time, or None to give up
+
+            wait is the least the server asked for.  Only 503s back off
+            exponentially, other codes retry after wait.'''
+
+        now = time.monotonic()
+        with self._lock:
+            host,breaker = self._breaker(url)
+            if code == 503:
+                breaker.failure(now)
+
+            endpoint = endpointOf(url)
+            budget = self._budgets.get(endpoint)
+            if budget is None:
+                budget = self._budgets[endpoint] = TokenBucket(self.budget,
+                    60)
+
+            reason = None
+            if attempt >= self.max_retries:
+                reason = 'too many retries'
+            elif breaker.isOpen(now):
+                reason = 'circuit open'
+            elif budget.available(time.time()) < 1:
+                reason = 'retry budget spent'
+
+            if reason is not None:
+                if code != 503:
+                    breaker.failure(now, code)
+                self._record(url, 'gave_up_%d' % code)
+                logging.warning('Not retrying %s error from %s: %s' %
+                    (code, endpoint, reason))
+                return None
+
+            budget.take(time.time())
+            if code == 503:
+                wait = max(wait, self.delay(attempt))
+            self._record(url, 'retry_%d' % code, wait)
+        return wait
+
+    def giveUp(self, url, code):
+        '''Count a failure that is not retried at all'''
+
+        with self._lock:
+            self._breaker(url)[1].failure(time.monotonic(), code)
+            self._record(url, 'gave_up_%d' % code)
+
+    def stats(self):
+        '''Retry counts and seconds slept by endpoint, and the circuits
+            that are open'''
+
+        now = time.monotonic()
+        with self._lock:
+            output = dict((k, dict(v, slept=self.slept[k]))
+                for k,v in self.counts.items())
+            output['open_circuits'] = [k for k,v in self._breakers.items()
+                if v.isOpen(now)]
+            return output
+
+DEFAULT_RETRY = RetryEngine()
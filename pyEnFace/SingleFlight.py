@@ -0,0 +1,105 @@
+
+import datetime as dt
+import threading
+import asyncio
+
+#parameters that do not change what a request returns
+IGNORED_PARAMS = ('key', 'progress', 'no_cache')
+
+def flightKey(params, ignore=()):
+    '''A hashable key of request parameters, times as epoch seconds and
+        the parameters in ignore and IGNORED_PARAMS left out'''
+
+    output = []
+    for k,v in sorted(params.items()):
+        if k in IGNORED_PARAMS or k in ignore:
+            continue
+        if isinstance(v, dt.datetime):
+            v = v.timestamp()
+        output.append((k,v))
+    return tuple(output)
+
+class Call(object):
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight(object):
+    '''Lets one thread at a time run a call for a key, threads asking for
+        the same key meanwhile wait for it and share its result or its
+        exception'''
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key, fn, *args):
+        '''Returns the result of fn(*args) and whether it was shared from
+            a call already running'''
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Call()
+                self.calls += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(*args)
+        except BaseException as x:
+            call.error = x
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result, False
+
+class AsyncSingleFlight(object):
+    '''The asyncio counterpart of SingleFlight for coroutine functions,
+        it belongs to the event loop it is first used on'''
+
+    def __init__(self):
+        self._calls = {}
+
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key, fn, *args):
+        future = self._calls.get(key)
+        if future is not None:
+            self.shared += 1
+            #a cancelled follower must not cancel the call
+            return await asyncio.shield(future), True
+
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        self.calls += 1
+        try:
+            result = await fn(*args)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as x:
+            future.set_exception(x)
+            #the leader raises it, do not log it as never retrieved
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            del self._calls[key]
+        return result, False
@@ -0,0 +1,154 @@
+
+import codecs
+import array
+import json
+import re
+
+import numpy as np
+
+CHUNK_SIZE = 64 * 1024
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+#the largest and smallest values an array('q') can hold
+INT_MAX = 2**63 - 1
+INT_MIN = -2**63
+
+#what json_normalize fills the keys missing from a row with
+MISSING = float('nan')
+
+class Column(object):
+    '''Collects the values of one column
+
+        Values are kept in a typed int64 array while every value is an
+        integer, the first value that is not turns it into a plain list.
+        A column first seen after rows rows starts with them missing.'''
+
+    def __init__(self, rows):
+        if rows > 0:
+            self.values = [MISSING] * rows
+        else:
+            self.values = array.array('q')
+
+    def append(self, value):
+        if type(self.values) is array.array:
+            if type(value) is int and INT_MIN <= value <= INT_MAX:
+                self.values.append(value)
+                return
+            self.values = self.values.tolist()
+        self.values.append(value)
+
+    def toArray(self):
+        if type(self.values) is array.array:
+            #share the buffer of the array instead of copying it
+            return np.frombuffer(self.values, dtype=np.int64)
+        return self.values
+
+class IntervalDecoder(object):
+    '''Decodes a json object read from fp without holding the whole
+        document in memory
+
+        The elements of the array under key are appended straight into
+        Columns as they are read, everything else at the top level is
+        returned as ordinary json values.'''
+
+    def __init__(self, fp, key='intervals', chunk_size=CHUNK_SIZE):
+        self.fp = fp
+        self.key = key
+        self.chunk_size = chunk_size
+
+        self.json = json.JSONDecoder()
+        self.text = codecs.getincrementaldecoder('UTF-8')()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+        self.columns = {}
+        self.rows = 0
+
+    def _fill(self):
+        data = self.fp.read(self.chunk_size)
+        if not data:
+            self.eof = True
+        self.buf = self.buf[self.pos:] + self.text.decode(data, final=self.eof)
+        self.pos = 0
+        return not self.eof
+
+    def _peek(self):
+        while True:
+            self.pos = WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                raise ValueError('Unexpected end of json document')
+
+    def _expect(self, chars):
+        c = self._peek()
+        if c not in chars:
+            raise ValueError('Expected one of %s at %s, found %s' %
+                (chars, self.pos, c))
+        self.pos += 1
+        return c
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value,end = self.json.raw_decode(self.buf, self.pos)
+                #a number at the end of the buffer may continue in the
+                #next chunk
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except ValueError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def _append(self, row):
+        for k,v in row.items():
+            column = self.columns.get(k)
+            if column is None:
+                column = self.columns[k] = Column(self.rows)
+            column.append(v)
+
+        if len(row) < len(self.columns):
+            for k,column in self.columns.items():
+                if k not in row:
+                    column.append(MISSING)
+        self.rows += 1
+
+    def _array(self):
+        if self._peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            self._append(self._value())
+            if self._expect(',]') == ']':
+                return
+
+    def decode(self):
+        '''Read the document, returns the top level values other than key
+
+            The rows of the array are in columns afterwards.'''
+
+        meta = {}
+        self._expect('{')
+        if self._peek() == '}':
+            return meta
+
+        while True:
+            name = self._value()
+            self._expect(':')
+            if name == self.key and self._peek() == '[':
+                self.pos += 1
+                self._array()
+            else:
+                meta[name] = self._value()
+            if self._expect(',}') == '}':
+                return meta
+
+    def arrays(self):
+        '''The decoded columns as numpy arrays or lists'''
+
+        return dict((k,v.toArray()) for k,v in self.columns.items())
@@ -0,0 +1,251 @@
+
+import datetime as dt
+import threading
+import logging
+import json
+import time
+import os
+
+from pandas import Series
+
+from .EnphaseInterface import APIKEYRING, INTERVAL, MAX_RANGE, toEpoch
+
+DEFAULT_ENDPOINTS = ('stats',)
+
+class SyncState(object):
+    '''The watermark, the end_at of the newest interval fetched, of every
+        system and endpoint and the last_report_at last seen of every
+        system, persisted as json at path when one is given'''
+
+    def __init__(self, path=None):
+        self.path = path
+        self.watermarks = {}
+        self.reports = {}
+
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            for k,v in data.get('watermarks', {}).items():
+                system_id,endpoint = k.split(':', 1)
+                self.watermarks[(int(system_id), endpoint)] = v
+            self.reports = dict((int(k), v)
+                for k,v in data.get('reports', {}).items())
+
+    def watermark(self, system_id, endpoint, default):
+        return self.watermarks.get((system_id, endpoint), default)
+
+    def advance(self, system_id, endpoint, watermark):
+        key = (system_id, endpoint)
+        self.watermarks[key] = max(self.watermarks.get(key, 0), watermark)
+
+    def save(self):
+        '''Write the state through a temporary file so a crash never
+            leaves half of it'''
+
+        if self.path is None:
+            return
+        data = {'watermarks':dict(('%d:%s' % k, v)
+                for k,v in self.watermarks.items()),
+            'reports':dict((str(k), v) for k,v in self.reports.items())}
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
+
+class SyncService(object):
+    '''Keeps the cache of a CachingEnphaseInterface up to date with every
+        system of the api key
+
+        Every interval seconds the service reads last_report_at of every
+        system from index(), or from summaries if index does not carry
+        it, and fetches endpoints only for systems that reported past
+        their watermark, from the watermark up to last_report_at.  Systems
+        whose last_report_at advanced since the last cycle go first, then
+        the ones left behind by earlier cycles, oldest watermark first.
+
+        Requests are paced so the monthly quota left on the keys lasts
+        until the month ends, share is the fraction of it the service may
+        use.  Work that does not fit before the next cycle waits for it.
+        The state is saved to state_path after every fetch so a restart
+        picks up where the service stopped.  A new system starts at since,
+        by default midnight of the day it is first seen.'''
+
+    def __init__(self, interface, state_path=None,
+            endpoints=DEFAULT_ENDPOINTS, interval=INTERVAL, share=1.0,
+            since=None):
+
+        self.interface = interface
+        self.state = SyncState(state_path)
+        self.endpoints = tuple(endpoints)
+        self.interval = interval
+        self.share = share
+        self.since = since
+
+        self._next = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.fetched = 0
+        self.skipped = 0
+        self.failures = 0
+
+    def _spacing(self, now):
+        '''Seconds between requests that spread the quota left over the
+            rest of the month'''
+
+        remaining = APIKEYRING.remaining(now)
+        if len(remaining) == 0:
+            return 0.0
+        left = sum(v['month'] for v in remaining.values()) * self.share
+        if left < 1:
+            return float(self.interval)
+
+        d = dt.datetime.fromtimestamp(now)
+        if d.month == 12:
+            d = dt.datetime(d.year+1, 1, 1)
+        else:
+            d = dt.datetime(d.year, d.month+1, 1)
+        return (d.timestamp() - now) / left
+
+    def _pace(self, deadline):
+        '''Wait for the next request slot, False if it comes after
+            deadline or the service was stopped'''
+
+        now = time.time()
+        slot = max(self._next, now)
+        if slot > deadline:
+            return False
+        if self._stop.wait(slot - now):
+            return False
+        self._next = slot + self._spacing(slot)
+        return True
+
+    def _default(self):
+        if self.since is not None:
+            return int(self.since.timestamp())
+        midnight = dt.datetime.combine(dt.date.today(), dt.time(0))
+        return int(midnight.timestamp())
+
+    def _lastReports(self, deadline):
+        '''last_report_at of every system by system_id'''
+
+        if not self._pace(deadline):
+            return {}
+        #the cached list would hide reports until its entry expires
+        systems = self.interface.index(no_cache=True)
+        for col in ('last_report_at', 'meta.last_report_at'):
+            if col in systems.columns:
+                reports = toEpoch(systems[col])
+                return dict((int(k), int(v)) for k,v in
+                    zip(systems.index.tolist(), reports) if v == v)
+
+        #read them from summaries, which are worth caching anyway
+        reports = {}
+        for system_id in systems.index.tolist():
+            if not self._pace(deadline):
+                break
+            try:
+                summary = self.interface.summary(system_id, no_cache=True)
+            except Exception as x:
+                logging.warning('Summary of %s failed: %s' % (system_id, x))
+                self.failures += 1
+                continue
+            self.interface.store('summary', summary)
+            reports[int(system_id)] = int(toEpoch(
+                summary['last_report_at'])[0])
+        return reports
+
+    def _work(self, reports):
+        '''The system and endpoint pairs that reported past their
+            watermark, most urgent first'''
+
+        default = self._default()
+        work = []
+        for system_id,report in reports.items():
+            advanced = report > self.state.reports.get(system_id, 0)
+            self.state.reports[system_id] = report
+            for endpoint in self.endpoints:
+                watermark = self.state.watermark(system_id, endpoint, default)
+                if report > watermark:
+                    work.append((not advanced, watermark, system_id,
+                        endpoint))
+                else:
+                    self.skipped += 1
+        work.sort()
+        return work
+
+    def _fetch(self, system_id, endpoint, watermark, report):
+        #a day at most, one request for each paced slot
+        end = min(report, int(time.time()), watermark + MAX_RANGE)
+        frame = self.interface.fill(system_id,
+            dt.datetime.fromtimestamp(watermark),
+            dt.datetime.fromtimestamp(end), endpoint)
+
+        #everything up to last_report_at has been reported, so intervals
+        #missing before it are nights, not data still to come.  A system
+        #more than a day behind is caught up over several cycles.
+        newest = end // INTERVAL * INTERVAL
+        if len(frame) > 0 and 'end_at' in frame.index.names:
+            ends = toEpoch(Series(frame.index.get_level_values('end_at')))
+            newest = max(newest, int(ends.max()))
+        self.state.advance(system_id, endpoint, newest)
+
+    def sync(self):
+        '''Run one cycle, returns the number of fetches made'''
+
+        deadline = time.time() + self.interval
+        reports = self._lastReports(deadline)
+        made = 0
+        for _,watermark,system_id,endpoint in self._work(reports):
+            if not self._pace(deadline):
+                break
+            try:
+                self._fetch(system_id, endpoint, watermark,
+                    reports[system_id])
+            except Exception as x:
+                logging.warning('Syncing %s of %s failed: %s' %
+                    (endpoint, system_id, x))
+                self.failures += 1
+                continue
+            made += 1
+            self.fetched += 1
+            self.state.save()
+
+        self.state.save()
+        return made
+
+    def run(self, cycles=None):
+        '''Sync every interval seconds, on the wall clock's interval
+            boundaries, until stop is called or cycles have run'''
+
+        done = 0
+        while not self._stop.is_set():
+            try:
+                self.sync()
+            except Exception:
+                logging.exception('Sync cycle failed')
+            done += 1
+            if cycles is not None and done >= cycles:
+                break
+            self._stop.wait(self.interval - time.time() % self.interval)
+
+    def start(self):
+        '''Sync on a background thread'''
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        '''Fetches made and skipped as up to date, and failures'''
+
+        return {'fetched':self.fetched,
+            'skipped':self.skipped,
+            'failures':self.failures,
+            'systems':len(self.state.reports)}
@@ -32,5 +32,6 @@ setup(
     include_package_data=True,
     install_requires=['pandas',
         'sqlalchemy',
-        'lxml',]
+        'lxml',],
+    extras_require={'parquet':['pyarrow']}
 )
@@ -0,0 +1,135 @@
+'''CachingEnphaseInterface against the stub server of the benchmarks'''
+
+import contextlib
+import datetime as dt
+import json
+import time
+
+import pytest
+from pandas.testing import assert_frame_equal
+
+from sqlalchemy import create_engine
+from pyEnFace.EnphaseInterface import (CachingEnphaseInterface,
+    SqlCacheBackend)
+from pyEnFace.ConnectionPool import ConnectionPool
+from pyEnFace.Coverage import CoverageIndex, IntervalSet
+from benchmarks.stub import StubServer, _stats
+from benchmarks.bench_suite import registerKeys, handler
+
+SYSTEMS = 16
+START = dt.datetime(2016, 1, 1)
+END = START + dt.timedelta(days=14)
+
+@pytest.fixture(scope='module')
+def server():
+    registerKeys()
+    server = StubServer(SYSTEMS).start()
+    yield server
+    server.stop()
+
+@pytest.fixture
+def caching(server):
+    '''Builds interfaces on the stub server, closing their pools after'''
+
+    pools = []
+
+    def build(**kwargs):
+        pools.append(ConnectionPool())
+        interface = CachingEnphaseInterface('user', 60, pool=pools[-1],
+            **kwargs)
+        interface.handler.retry = handler().retry
+        interface.apiDest = server.api
+        return interface
+
+    yield build
+    for pool in pools:
+        pool.close()
+
+def test_default_engine_per_instance():
+    a = CachingEnphaseInterface('user')
+    b = CachingEnphaseInterface('user')
+    assert a.backend.engine is not b.backend.engine
+
+def test_threads_keep_every_row(caching):
+    expected = len(caching(workers=1).stats(1, start_at=START, end_at=END))
+
+    interface = caching(workers=2)
+    systems = list(range(1, SYSTEMS + 1))
+    first = interface.stats_many(systems, start_at=START, end_at=END,
+        workers=8)
+    assert first.groupby(level='system_id').size().tolist() == \
+        [expected] * SYSTEMS
+
+    #served from the backend, which must hold every row it claims
+    interface.memory.clear()
+    again = interface.stats_many(systems, start_at=START, end_at=END,
+        workers=8)
+    assert_frame_equal(first.sort_index(), again.sort_index())
+    count = interface.backend._fetchall('select count(*) from stats')[0][0]
+    assert count == expected * SYSTEMS
+
+class FailingBackend(SqlCacheBackend):
+    '''Rolls back every transaction'''
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with super(FailingBackend,self).transaction() as batch:
+            yield batch
+            raise IOError('disk full')
+
+def test_failed_write_claims_no_coverage(caching):
+    backend = FailingBackend(create_engine('sqlite://'))
+    interface = caching(backend=backend)
+    with pytest.raises(IOError):
+        interface.stats(1, start_at=START, end_at=END)
+
+    assert interface.coverage.ranges(1, 'stats') == []
+    assert backend.loadCoverage(1, 'stats') == []
+
+@pytest.fixture(params=['sql','parquet'])
+def backend(request, tmp_path):
+    if request.param == 'sql':
+        return SqlCacheBackend(create_engine('sqlite://'))
+    ParquetCacheBackend = pytest.importorskip(
+        'pyEnFace.ParquetCache').ParquetCacheBackend
+    return ParquetCacheBackend(str(tmp_path))
+
+def test_shared_backend_keeps_every_range(caching, backend):
+    weeks = [START + dt.timedelta(days=7 * x) for x in range(4)]
+    a = caching(backend=backend)
+    b = caching(backend=backend)
+
+    #a only knows the coverage it loaded before b wrote the second week
+    a.stats(1, start_at=weeks[0], end_at=weeks[1])
+    b.stats(1, start_at=weeks[1], end_at=weeks[2])
+    a.stats(1, start_at=weeks[2], end_at=weeks[3])
+
+    stored = IntervalSet(backend.loadCoverage(1, 'stats'))
+    lower,upper = CoverageIndex.requestRange(weeks[0].timestamp(),
+        weeks[3].timestamp())
+    assert stored.gaps(lower, upper) == []
+
+@pytest.fixture
+def denver(monkeypatch):
+    monkeypatch.setenv('TZ', 'America/Denver')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+def test_fall_back_hour_keeps_both_intervals(caching, denver):
+    #daylight saving ends at 2am on the 6th, 1am to 2am happens twice
+    start = dt.datetime(2016, 11, 5)
+    end = dt.datetime(2016, 11, 7)
+    served = json.loads(_stats(1, int(start.timestamp()),
+        int(end.timestamp())).decode())['intervals']
+
+    interface = caching()
+    stats = interface.stats(1, start_at=start, end_at=end)
+    count = interface.backend._fetchall('select count(*) from stats')[0][0]
+    assert count == len(served)
+    assert len(stats) == len(served)
+
+    interface.memory.clear()
+    again = interface.stats(1, start_at=start, end_at=end)
+    assert_frame_equal(again, stats)
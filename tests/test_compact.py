@@ -0,0 +1,29 @@
+'''compactFrame shrinks the frames of the pandas interfaces'''
+
+import json
+import io
+
+import pandas as pd
+
+from pyEnFace.EnphaseInterface import PandasEnphaseInterface, compactFrame
+
+DATA = {'system_id':67, 'total_devices':24, 'intervals':[
+    {'end_at':1451606400 + 300*i, 'devices_reporting':24,
+        'powr':100 + i, 'enwh':8 + i} for i in range(1, 289)]}
+
+def test_stats_dtypes():
+    interface = PandasEnphaseInterface('user')
+    for stats in (interface._toFrame('stats', DATA),
+            interface._statsFrame(io.BytesIO(json.dumps(DATA).encode()))):
+        compact = compactFrame(stats)
+        assert compact.dtypes.to_dict() == {'devices_reporting':'int8',
+            'powr':'int16', 'enwh':'int16', 'total_devices':'int8'}
+        assert compact.index.levels[1].dtype == 'datetime64[ns]'
+
+def test_object_integers():
+    frame = pd.DataFrame({'whole':pd.Series([1, 2], dtype=object),
+        'missing':pd.Series([1, None], dtype=object),
+        'huge':pd.Series([2**64, 1], dtype=object),
+        'flags':pd.Series([True, False], dtype=object)})
+    assert compactFrame(frame).dtypes.astype(str).to_dict() == {
+        'whole':'int8', 'missing':'Int8', 'huge':'object', 'flags':'object'}
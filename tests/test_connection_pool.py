@@ -0,0 +1,44 @@
+'''The request timeouts of KeepAliveHandler'''
+
+import socket
+import time
+import urllib.request as r
+
+import pytest
+
+from pyEnFace.ConnectionPool import ConnectionPool, KeepAliveHandler
+from benchmarks.stub import StubServer
+
+@pytest.fixture
+def pool():
+    pool = ConnectionPool(timeout=5)
+    yield pool
+    pool.close()
+
+def test_request_timeout_bounds_the_wait(pool):
+    #accepts connections but never answers
+    silent = socket.socket()
+    silent.bind(('127.0.0.1', 0))
+    silent.listen(1)
+    url = 'http://127.0.0.1:%d/' % silent.getsockname()[1]
+
+    opener = r.build_opener(KeepAliveHandler(pool))
+    start = time.monotonic()
+    with pytest.raises(socket.timeout):
+        opener.open(url, timeout=0.2)
+    assert time.monotonic() - start < 2
+    silent.close()
+
+def test_pooled_connection_gets_the_pool_timeout_back(pool):
+    server = StubServer(1).start()
+    try:
+        opener = r.build_opener(KeepAliveHandler(pool))
+        opener.open('http://%s/home' % server.host, timeout=0.5).read()
+
+        con,reused = pool.checkout('http', server.host)
+        assert reused
+        assert con.timeout == 5
+        assert con.sock.gettimeout() == 5
+        con.close()
+    finally:
+        server.stop()
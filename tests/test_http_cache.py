@@ -0,0 +1,30 @@
+'''Which responses HttpCacheHandler buffers into a ResponseCache'''
+
+import email.message
+import io
+import urllib.request as r
+import urllib.response as ur
+
+from pyEnFace.HttpCache import ResponseCache, HttpCacheHandler
+
+API = 'https://api.enphaseenergy.com/api/v2/systems'
+
+def respond(handler, url):
+    headers = email.message.Message()
+    headers['ETag'] = '"abc"'
+    response = ur.addinfourl(io.BytesIO(b'{}'), headers, url, 200)
+    response.msg = 'OK'
+    return response, handler.http_response(r.Request(url), response)
+
+def test_stats_stream_past_the_cache():
+    cache = ResponseCache(ttls={'inventory':60})
+    response,output = respond(HttpCacheHandler(cache), API + '/1/stats')
+    assert output is response
+    assert cache.get(API + '/1/stats') is None
+
+def test_endpoints_with_a_ttl_are_kept():
+    cache = ResponseCache(ttls={'inventory':60})
+    response,output = respond(HttpCacheHandler(cache), API + '/inventory')
+    assert output is not response
+    assert output.read() == b'{}'
+    assert cache.get(API + '/inventory').body == b'{}'
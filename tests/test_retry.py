@@ -0,0 +1,79 @@
+'''The CircuitBreaker trial of a RetryEngine'''
+
+import asyncio
+
+import pytest
+
+from pyEnFace.Retry import RetryEngine, CircuitOpenError
+from pyEnFace.AsyncEnphaseInterface import AsyncRawEnphaseInterface
+
+URL = 'https://api.enphaseenergy.com/api/v2/systems/1/stats'
+
+def opened(monkeypatch):
+    '''An engine whose circuit opened and has waited out reset_after'''
+
+    clock = [1000.0]
+    monkeypatch.setattr('time.monotonic', lambda: clock[0])
+    engine = RetryEngine(max_retries=0, failure_threshold=1, reset_after=30)
+    assert engine.backoff(URL, 503, 0) is None
+    with pytest.raises(CircuitOpenError):
+        engine.check(URL)
+    clock[0] += 31
+    return engine, clock
+
+def test_trial_success_closes(monkeypatch):
+    engine,_ = opened(monkeypatch)
+    engine.check(URL)
+    with pytest.raises(CircuitOpenError):
+        engine.check(URL)
+    engine.success(URL)
+    engine.check(URL)
+
+@pytest.mark.parametrize('code', [None, 404, 422])
+def test_trial_failure_reopens(monkeypatch, code):
+    engine,clock = opened(monkeypatch)
+    engine.check(URL)
+    if code == 422:
+        engine.giveUp(URL, code)
+    else:
+        engine.failure(URL, code)
+    with pytest.raises(CircuitOpenError):
+        engine.check(URL)
+
+    #and lets the next trial through once reset_after has passed again
+    clock[0] += 31
+    engine.check(URL)
+
+def test_trial_retry_is_let_through(monkeypatch):
+    engine,_ = opened(monkeypatch)
+    engine.max_retries = 5
+    engine.check(URL)
+    assert engine.backoff(URL, 409, 0) is not None
+    engine.check(URL, retry=True)
+    with pytest.raises(CircuitOpenError):
+        engine.check(URL)
+    engine.success(URL)
+    engine.check(URL)
+
+def test_abandoned_trial_is_not_a_failure(monkeypatch):
+    engine,_ = opened(monkeypatch)
+    engine.check(URL)
+    engine.abandon(URL)
+
+    #the next request is the trial, without waiting out reset_after
+    engine.check(URL)
+    engine.success(URL)
+    engine.check(URL)
+
+class CancelledPool(object):
+    async def request(self, method, url, headers=None):
+        raise asyncio.CancelledError()
+
+def test_cancelled_fetch_ends_the_trial(monkeypatch):
+    engine,_ = opened(monkeypatch)
+    interface = AsyncRawEnphaseInterface('user', pool=CancelledPool(),
+        cache=None)
+    interface.retry = engine
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(interface._fetch(URL))
+    engine.check(URL)
@@ -0,0 +1,54 @@
+'''IntervalDecoder builds the same stats frames as json_normalize'''
+
+import json
+import io
+
+import pytest
+from pandas.testing import assert_frame_equal
+
+from pyEnFace.EnphaseInterface import PandasEnphaseInterface
+
+INTERVALS = {
+    'whole':[{'end_at':1451606700, 'powr':1, 'enwh':2,
+        'devices_reporting':24}, {'end_at':1451607000, 'powr':3, 'enwh':4,
+        'devices_reporting':24}],
+    'missing then none':[{'end_at':1451606700, 'powr':1},
+        {'end_at':1451607000, 'powr':3, 'enwh':None}],
+    'none then int':[{'end_at':1451606700, 'powr':None},
+        {'end_at':1451607000, 'powr':3}],
+    'int then missing':[{'end_at':1451606700, 'powr':1},
+        {'end_at':1451607000}],
+    'all none':[{'end_at':1451606700, 'powr':None},
+        {'end_at':1451607000, 'powr':None}],
+    'float':[{'end_at':1451606700, 'powr':1.5},
+        {'end_at':1451607000, 'powr':3}],
+    'too big for int64':[{'end_at':1451606700, 'powr':2**64},
+        {'end_at':1451607000, 'powr':3}],
+    'text':[{'end_at':1451606700, 'powr':'x'},
+        {'end_at':1451607000, 'powr':3}],
+    'empty':[],
+}
+
+class Trickle(io.BytesIO):
+    '''Reads at most size bytes at a time, splitting values across reads'''
+
+    def __init__(self, data, size):
+        super(Trickle,self).__init__(data)
+        self.size = size
+
+    def read(self, n=-1):
+        return super(Trickle,self).read(self.size)
+
+@pytest.fixture
+def interface():
+    return PandasEnphaseInterface('user')
+
+@pytest.mark.parametrize('size', [7, 64 * 1024])
+@pytest.mark.parametrize('name', sorted(INTERVALS))
+def test_matches_json_normalize(interface, name, size):
+    data = {'system_id':67, 'total_devices':24,
+        'intervals':INTERVALS[name]}
+
+    streamed = interface._statsFrame(Trickle(json.dumps(data).encode(),
+        size))
+    assert_frame_equal(streamed, interface._toFrame('stats', data))